@@ -0,0 +1,32 @@
+"""add crawler columns to access_log
+
+Revision ID: 3f9a1c7d2b40
+Revises: feb836f97c38
+Create Date: 2026-10-18 09:12:04.118230
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f9a1c7d2b40'
+down_revision: Union[str, None] = 'feb836f97c38'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('access_log', sa.Column('crawler_family', sa.String(), nullable=True))
+    op.add_column('access_log', sa.Column('crawler_category', sa.String(), nullable=True))
+    op.create_index(op.f('ix_access_log_crawler_category'), 'access_log', ['crawler_category'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_access_log_crawler_category'), table_name='access_log')
+    op.drop_column('access_log', 'crawler_category')
+    op.drop_column('access_log', 'crawler_family')
@@ -0,0 +1,28 @@
+"""add (tenant_id, timestamp, id) index for cursor pagination
+
+Revision ID: 5e0c7b93a1d8
+Revises: d4a8f2e61c3b
+Create Date: 2026-10-18 14:05:12.550318
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5e0c7b93a1d8'
+down_revision: Union[str, None] = 'd4a8f2e61c3b'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_access_log_tenant_ts_id', 'access_log', ['tenant_id', 'timestamp', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_access_log_tenant_ts_id', table_name='access_log')
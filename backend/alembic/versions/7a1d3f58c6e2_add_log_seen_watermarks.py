@@ -0,0 +1,59 @@
+"""add log_seen_watermarks and drop access_log.seen
+
+Revision ID: 7a1d3f58c6e2
+Revises: e2f71c5a8b94
+Create Date: 2026-10-18 16:02:13.518344
+
+La marca de cada tenant sale del último log que tenía seen = true (por
+timestamp: el id es un UUID y no sigue el orden de llegada). Sin columna
+seen, todo lo anterior a la migración cuenta como visto.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7a1d3f58c6e2'
+down_revision: Union[str, None] = 'e2f71c5a8b94'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _has_seen() -> bool:
+    columns = sa.inspect(op.get_bind()).get_columns('access_log')
+    return any(c['name'] == 'seen' for c in columns)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('log_seen_watermarks',
+    sa.Column('tenant_id', sa.String(), nullable=False),
+    sa.Column('seen_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('tenant_id')
+    )
+    # seen venía de create_all, no de una migración: puede no existir
+    if _has_seen():
+        op.execute(
+            "INSERT INTO log_seen_watermarks (tenant_id, seen_at) "
+            "SELECT tenant_id, max(timestamp) FROM access_log "
+            "WHERE seen AND tenant_id IS NOT NULL AND timestamp IS NOT NULL "
+            "GROUP BY tenant_id")
+        op.drop_column('access_log', 'seen')
+    else:
+        # Sin marcas previas: no se avisa de golpe de todo el histórico
+        op.execute(
+            "INSERT INTO log_seen_watermarks (tenant_id, seen_at) "
+            "SELECT tenant_id, max(timestamp) FROM access_log "
+            "WHERE tenant_id IS NOT NULL AND timestamp IS NOT NULL "
+            "GROUP BY tenant_id")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.add_column('access_log', sa.Column('seen', sa.Boolean(), nullable=True))
+    op.execute(
+        "UPDATE access_log SET seen = (timestamp <= (SELECT seen_at FROM "
+        "log_seen_watermarks w WHERE w.tenant_id = access_log.tenant_id))")
+    op.drop_table('log_seen_watermarks')
@@ -0,0 +1,30 @@
+"""add allow sampling (plan rate and access_log weight)
+
+Revision ID: 8c2e5d41a9f3
+Revises: 3f9a1c7d2b40
+Create Date: 2026-10-18 11:40:27.503114
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8c2e5d41a9f3'
+down_revision: Union[str, None] = '3f9a1c7d2b40'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('subscription_plans', sa.Column('allow_sample_rate', sa.Integer(), nullable=False, server_default='1'))
+    op.add_column('access_log', sa.Column('sample_weight', sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('access_log', 'sample_weight')
+    op.drop_column('subscription_plans', 'allow_sample_rate')
@@ -0,0 +1,91 @@
+"""partition access_log by month on timestamp (Postgres)
+
+Revision ID: 9b3e6a0f4c12
+Revises: 5e0c7b93a1d8
+Create Date: 2026-10-18 14:48:33.207615
+
+Solo en Postgres. access_log pasa a ser una tabla particionada por rango de
+timestamp: una partición por mes desde el primer log hasta 3 meses por
+delante, más access_log_default como red de seguridad. Las siguientes las
+crea services/partitions.py al arrancar y periódicamente.
+La clave primaria pasa a ser (id, timestamp): Postgres exige que incluya la
+columna de partición.
+"""
+from datetime import datetime
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9b3e6a0f4c12'
+down_revision: Union[str, None] = '5e0c7b93a1d8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+AHEAD_MONTHS = 3
+
+INDEXES = [
+    ('ix_access_log_tenant_id', ['tenant_id']),
+    ('ix_access_log_timestamp', ['timestamp']),
+    ('ix_access_log_country_code', ['country_code']),
+    ('ix_access_log_outcome', ['outcome']),
+    ('ix_access_log_crawler_category', ['crawler_category']),
+    ('ix_access_log_tenant_ts_id', ['tenant_id', 'timestamp', 'id']),
+]
+
+
+def _month(i: int) -> datetime:
+    return datetime(i // 12, i % 12 + 1, 1)
+
+
+def _create_indexes():
+    for name, columns in INDEXES:
+        cols = ", ".join(f'"{c}"' for c in columns)
+        op.execute(f'CREATE INDEX IF NOT EXISTS {name} ON access_log ({cols})')
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return
+
+    op.execute('ALTER TABLE access_log RENAME TO access_log_unpartitioned')
+    op.execute('CREATE TABLE access_log (LIKE access_log_unpartitioned INCLUDING DEFAULTS) '
+               'PARTITION BY RANGE ("timestamp")')
+    # La columna de partición forma parte de la PK, que no admite NULL
+    op.execute('UPDATE access_log_unpartitioned SET "timestamp" = COALESCE('
+               '(SELECT min("timestamp") FROM access_log_unpartitioned), '
+               "now() AT TIME ZONE 'utc') WHERE \"timestamp\" IS NULL")
+    op.execute('ALTER TABLE access_log ADD PRIMARY KEY (id, "timestamp")')
+
+    first = bind.execute(sa.text('SELECT min("timestamp") FROM access_log_unpartitioned')).scalar()
+    now = datetime.utcnow()
+    start = (first or now).year * 12 + (first or now).month - 1
+    last = now.year * 12 + now.month - 1 + AHEAD_MONTHS
+    for i in range(start, last + 1):
+        lo, hi = _month(i), _month(i + 1)
+        op.execute(f"CREATE TABLE access_log_p{lo:%Y%m} PARTITION OF access_log "
+                   f"FOR VALUES FROM ('{lo:%Y-%m-%d}') TO ('{hi:%Y-%m-%d}')")
+    op.execute('CREATE TABLE access_log_default PARTITION OF access_log DEFAULT')
+
+    op.execute('INSERT INTO access_log SELECT * FROM access_log_unpartitioned')
+    op.execute('DROP TABLE access_log_unpartitioned')
+    # Índices en la tabla padre: Postgres los crea en cada partición
+    _create_indexes()
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return
+
+    op.execute('ALTER TABLE access_log RENAME TO access_log_partitioned')
+    op.execute('CREATE TABLE access_log (LIKE access_log_partitioned INCLUDING DEFAULTS)')
+    op.execute('INSERT INTO access_log SELECT * FROM access_log_partitioned')
+    op.execute('DROP TABLE access_log_partitioned')
+    op.execute('ALTER TABLE access_log ADD PRIMARY KEY (id)')
+    _create_indexes()
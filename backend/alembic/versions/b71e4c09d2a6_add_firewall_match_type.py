@@ -0,0 +1,28 @@
+"""add firewall_rules.match_type (user_agent | ip)
+
+Revision ID: b71e4c09d2a6
+Revises: 8c2e5d41a9f3
+Create Date: 2026-10-18 12:52:09.318406
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b71e4c09d2a6'
+down_revision: Union[str, None] = '8c2e5d41a9f3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('firewall_rules', sa.Column('match_type', sa.String(), nullable=False, server_default='user_agent'))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('firewall_rules', 'match_type')
@@ -0,0 +1,35 @@
+"""add access_log_daily_uniques hyperloglog sketches
+
+Revision ID: c58e2a7f1d93
+Revises: 7a1d3f58c6e2
+Create Date: 2026-10-18 17:10:52.306418
+
+Los días anteriores se rellenan con tasks/rebuild_uniques.py.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c58e2a7f1d93'
+down_revision: Union[str, None] = '7a1d3f58c6e2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('access_log_daily_uniques',
+    sa.Column('tenant_id', sa.String(), nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('metric', sa.String(), nullable=False),
+    sa.Column('sketch', sa.LargeBinary(), nullable=False),
+    sa.PrimaryKeyConstraint('tenant_id', 'day', 'metric')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('access_log_daily_uniques')
@@ -0,0 +1,37 @@
+"""add agent_family, agent_version and is_crawler to access_log
+
+Revision ID: e2f71c5a8b94
+Revises: 9b3e6a0f4c12
+Create Date: 2026-10-18 15:20:41.774902
+
+Las filas existentes se rellenan con tasks/backfill_agents.py.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e2f71c5a8b94'
+down_revision: Union[str, None] = '9b3e6a0f4c12'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('access_log', sa.Column('agent_family', sa.String(), nullable=True))
+    op.add_column('access_log', sa.Column('agent_version', sa.String(), nullable=True))
+    op.add_column('access_log', sa.Column('is_crawler', sa.Boolean(), nullable=True))
+    op.create_index('ix_access_log_tenant_agent', 'access_log', ['tenant_id', 'agent_family'], unique=False)
+    op.create_index('ix_access_log_tenant_crawler', 'access_log', ['tenant_id', 'is_crawler'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_access_log_tenant_crawler', table_name='access_log')
+    op.drop_index('ix_access_log_tenant_agent', table_name='access_log')
+    op.drop_column('access_log', 'is_crawler')
+    op.drop_column('access_log', 'agent_version')
+    op.drop_column('access_log', 'agent_family')
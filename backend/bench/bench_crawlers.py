@@ -0,0 +1,64 @@
+# backend/bench/bench_crawlers.py
+"""
+Micro-benchmark del clasificador de crawlers (services/crawlers.py).
+
+Mide el tiempo de compilación del índice y p50/p99 de classify() frente a
+recorrer los patrones de crawler-user-agents.json uno a uno, sobre los
+ejemplos del propio JSON más UAs de navegador.
+
+    cd backend && python bench/bench_crawlers.py [--rounds 3000]
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from bench_matcher import BROWSER_UAS, load_crawlers, percentiles
+from services.crawlers import CrawlerClassifier
+from config import settings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rounds", type=int, default=3000)
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    classifier = CrawlerClassifier(settings.CRAWLERS_FILE, reload_interval=0)
+    compile_ms = (time.perf_counter() - t0) * 1000
+
+    crawlers = load_crawlers()
+    naive = [re.compile(c["pattern"]) for c in crawlers]
+    bot_uas = [ua for c in crawlers for ua in c.get("instances", [])]
+    rnd = random.Random(42)
+    corpus = [
+        rnd.choice(BROWSER_UAS) if rnd.random() < 0.8 else rnd.choice(bot_uas)
+        for _ in range(args.rounds)
+    ]
+
+    def naive_classify(ua):
+        for rx in naive:
+            if rx.search(ua):
+                return rx
+        return None
+
+    print(f"{len(classifier)} patrones compilados en {compile_ms:.1f} ms")
+    detected = sum(1 for ua in bot_uas if classifier.classify(ua))
+    print(f"ejemplos del JSON clasificados: {detected}/{len(bot_uas)}")
+    for label, fn in (("naive", naive_classify),
+                      ("index", classifier.classify)):
+        samples = []
+        for ua in corpus:
+            t = time.perf_counter_ns()
+            fn(ua)
+            samples.append(time.perf_counter_ns() - t)
+        p = percentiles(samples)
+        print(f"{label:>6}: p50 {p['p50_us']:.2f} us  p99 {p['p99_us']:.2f} us")
+
+
+if __name__ == "__main__":
+    main()
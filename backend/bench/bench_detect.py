@@ -0,0 +1,205 @@
+# backend/bench/bench_detect.py
+"""
+Benchmark reproducible del pixel /rest/detect/{tenant}.png.
+
+Crea una base de datos con N tenants (usuario, suscripción y M FirewallRule
+sacadas de crawler-user-agents.json), lanza el corpus de UAs del JSON más UAs
+de navegador contra la app en proceso y mide rps, p50/p95/p99 y consultas a
+la base de datos por petición. El resultado se guarda en
+bench/results/<commit>.json para comparar entre commits con --compare.
+
+    cd backend && python bench/bench_detect.py [--tenants 20] [--rules 50]
+    cd backend && python bench/bench_detect.py --compare bench/results/abc1234.json
+
+Por defecto usa un SQLite temporal y el estado "local"; --database-url
+permite medir contra Postgres (las tablas se crean si no existen).
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+METRICS = ("rps", "p50_ms", "p95_ms", "p99_ms", "queries_per_request")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--tenants", type=int, default=20)
+    parser.add_argument("--rules", type=int, default=50,
+                        help="FirewallRule por tenant")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--routes", default="sync,async")
+    parser.add_argument("--database-url",
+                        help="por defecto, un SQLite temporal")
+    parser.add_argument("--output", help="por defecto, bench/results/<commit>.json")
+    parser.add_argument("--compare", help="JSON de una ejecución anterior")
+    return parser.parse_args()
+
+
+def git_sha() -> str:
+    try:
+        sha = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                      text=True).strip()
+        dirty = subprocess.check_output(["git", "status", "--porcelain"],
+                                        text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return f"{sha}-dirty" if dirty else sha
+
+
+class QueryCounter:
+    """Cuenta las sentencias que llegan a los motores sync y async."""
+
+    def __init__(self, *engines):
+        self.count = 0
+        self._lock = threading.Lock()
+        from sqlalchemy import event
+        for eng in engines:
+            event.listen(eng, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args):
+        with self._lock:
+            self.count += 1
+
+    def reset(self) -> int:
+        with self._lock:
+            count, self.count = self.count, 0
+        return count
+
+
+def seed(tenants: int, rules: int, crawlers) -> list:
+    """Crea los tenants con suscripción ilimitada en la práctica y sus reglas."""
+    from bench_matcher import build_cfg
+    from db import Base, SessionLocal, engine
+    from models.models import FirewallRule, Subscription, User
+
+    Base.metadata.create_all(engine)
+    cfg = build_cfg(crawlers, rules)
+    ids = [f"bench-{i}" for i in range(tenants)]
+    db = SessionLocal()
+    try:
+        for tid in ids:
+            if db.get(User, tid):
+                continue
+            db.add(User(id=tid, email=f"{tid}@bench.local", name=tid))
+            db.add(Subscription(user_id=tid, traffic_limit=10**9,
+                                remaining_tokens=10**9))
+            for pat in cfg["blockedAgents"]:
+                db.add(FirewallRule(tenant_id=tid, llm_name=pat, pattern=pat,
+                                    policy="block"))
+            for pat, limit in cfg["limitedAgents"].items():
+                db.add(FirewallRule(tenant_id=tid, llm_name=pat, pattern=pat,
+                                    policy="restricted",
+                                    limit=limit["maxPerHour"]))
+            for r in cfg["redirectAgents"]:
+                db.add(FirewallRule(tenant_id=tid, llm_name=r["pattern"],
+                                    pattern=r["pattern"], policy="redirect",
+                                    redirect_url=r["url"]))
+        db.commit()
+    finally:
+        db.close()
+    return ids
+
+
+async def measure(args, tenants, corpus, counter):
+    from load_detect import ROUTES, make_client, run_load
+    from db import async_engine
+    from services.ingest import access_log_writer
+    from services.quota import quota_meter
+
+    results = {}
+    async with make_client() as client:
+        for name in args.routes.split(","):
+            route = ROUTES[name]
+            # Calentamiento: carga reglas y cuotas de todos los tenants
+            await run_load(client, route, tenants, corpus, len(tenants) * 2, 4)
+            access_log_writer.stop()
+            quota_meter.flush()
+            access_log_writer.start()
+            counter.reset()
+            r = await run_load(client, route, tenants, corpus, args.requests,
+                               args.concurrency)
+            # Las escrituras diferidas también cuentan: se vuelcan antes de medir
+            access_log_writer.stop()
+            quota_meter.flush()
+            r["queries"] = counter.reset()
+            r["queries_per_request"] = round(r["queries"] / r["requests"], 4)
+            results[name] = r
+            access_log_writer.start()
+    # Cierra las conexiones async dentro del bucle (aiosqlite usa hilos propios)
+    await async_engine.dispose()
+    return results
+
+
+def compare(current: dict, previous: dict):
+    print(f"\ncomparado con {previous.get('commit')}:")
+    for name, r in current["routes"].items():
+        old = previous.get("routes", {}).get(name)
+        if not old:
+            continue
+        deltas = []
+        for m in METRICS:
+            if old.get(m):
+                deltas.append(f"{m} {(r[m] - old[m]) / old[m] * 100:+.1f}%")
+        print(f"{name:>6}: " + "  ".join(deltas))
+
+
+def main():
+    args = parse_args()
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+    else:
+        tmpdir = tempfile.mkdtemp(prefix="neptuno-bench-")
+        os.environ["DATABASE_URL"] = f"sqlite:///{tmpdir}/bench.db"
+    # Estado propio de esta ejecución, sin restos de otras
+    os.environ.setdefault("STATE_BACKEND", "local")
+
+    from bench_matcher import load_crawlers
+    from load_detect import ua_corpus
+    from db import async_engine, engine
+    import main as app_main
+
+    tenants = seed(args.tenants, args.rules, load_crawlers())
+    counter = QueryCounter(engine, async_engine.sync_engine)
+    app_main.startup_event()
+    try:
+        routes = asyncio.run(measure(args, tenants, ua_corpus(), counter))
+    finally:
+        app_main.shutdown_event()
+
+    result = {
+        "commit": git_sha(),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "database": engine.dialect.name,
+        "params": {k: getattr(args, k) for k in
+                   ("tenants", "rules", "requests", "concurrency")},
+        "routes": routes,
+    }
+    print(f"{'route':>6}  {'rps':>8}  {'p50 ms':>8}  {'p95 ms':>8}  "
+          f"{'p99 ms':>8}  {'q/req':>6}  errors")
+    for name, r in routes.items():
+        print(f"{name:>6}  {r['rps']:>8}  {r['p50_ms']:>8}  {r['p95_ms']:>8}  "
+              f"{r['p99_ms']:>8}  {r['queries_per_request']:>6}  {r['errors']}")
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{result['commit']}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"\nresultados en {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(result, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# backend/bench/bench_ip_ranges.py
+"""
+Benchmark de las reglas de IP (services/ip_ranges.py).
+
+Escribe una lista sintética de rangos IPv4/IPv6 con prefijos variados (como
+las publicadas por los proveedores cloud), la carga con "file:" en un
+CompiledRuleset y mide tiempo de compilación y p50/p99 de match_ip en
+microsegundos.
+
+    cd backend && python bench/bench_ip_ranges.py [--sizes 1000,10000,50000]
+"""
+import argparse
+import ipaddress
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from bench_matcher import percentiles
+from config import settings
+from services.matcher import compile_ruleset
+
+
+def synthetic_ranges(n: int, rnd: random.Random) -> list:
+    ranges = []
+    for i in range(n):
+        if i % 5 == 0:
+            plen = rnd.choice((32, 36, 44, 48, 56, 64))
+            addr = ipaddress.IPv6Address(rnd.getrandbits(128))
+        else:
+            plen = rnd.choice((12, 16, 18, 20, 22, 24, 26, 28, 32))
+            addr = ipaddress.IPv4Address(rnd.getrandbits(32))
+        ranges.append(str(ipaddress.ip_network(f"{addr}/{plen}", strict=False)))
+    return ranges
+
+
+def run(sizes, rounds, seed=42):
+    rnd = random.Random(seed)
+    tmpdir = tempfile.mkdtemp(prefix="neptuno-ip-")
+    settings.IP_LISTS_DIR = tmpdir
+
+    results = []
+    for n in sizes:
+        ranges = synthetic_ranges(n, rnd)
+        name = f"ranges-{n}.txt"
+        with open(os.path.join(tmpdir, name), "w") as f:
+            f.write("\n".join(ranges))
+        cfg = {"blockedAgents": [], "limitedAgents": {}, "redirectAgents": [],
+               "ipRules": [{"policy": "block", "ranges": f"file:{name}"}]}
+        t0 = time.perf_counter()
+        ruleset = compile_ruleset(cfg)
+        build_ms = (time.perf_counter() - t0) * 1000
+
+        # Mitad dentro de algún rango, mitad al azar (casi siempre fuera)
+        nets = [ipaddress.ip_network(r) for r in ranges]
+        corpus = []
+        for _ in range(rounds):
+            if rnd.random() < 0.5:
+                net = rnd.choice(nets)
+                corpus.append(str(net.network_address + rnd.randrange(
+                    min(net.num_addresses, 1 << 16))))
+            elif rnd.random() < 0.8:
+                corpus.append(str(ipaddress.IPv4Address(rnd.getrandbits(32))))
+            else:
+                corpus.append(str(ipaddress.IPv6Address(rnd.getrandbits(128))))
+
+        samples, hits = [], 0
+        for ip in corpus:
+            t0 = time.perf_counter_ns()
+            hit = ruleset.match_ip(ip)
+            samples.append(time.perf_counter_ns() - t0)
+            hits += hit is not None
+        results.append({"ranges": n, "build_ms": round(build_ms, 1),
+                        "hit_rate": round(hits / rounds, 3),
+                        **percentiles(samples)})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", default="1000,10000,50000")
+    parser.add_argument("--rounds", type=int, default=20000)
+    parser.add_argument("--json", help="guardar resultados en este fichero")
+    args = parser.parse_args()
+
+    results = run([int(s) for s in args.sizes.split(",")], args.rounds)
+    print(f"{'ranges':>8}  {'build ms':>9}  {'hits':>6}  {'p50 (us)':>10}  "
+          f"{'p99 (us)':>10}")
+    for r in results:
+        print(f"{r['ranges']:>8}  {r['build_ms']:>9}  {r['hit_rate']:>6}  "
+              f"{r['p50_us']:>10.2f}  {r['p99_us']:>10.2f}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
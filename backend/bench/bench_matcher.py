@@ -0,0 +1,121 @@
+# backend/bench/bench_matcher.py
+"""
+Benchmark del matcher de reglas de detect_png.
+
+Compara el bucle original (un re.search por patrón) con CompiledRuleset para
+10, 100 y 1.000 patrones y muestra p50/p99 por petición en microsegundos.
+
+    cd backend && python bench/bench_matcher.py [--rounds 1000] [--json out.json]
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from services.matcher import compile_ruleset
+
+CRAWLERS_JSON = os.path.join(os.path.dirname(__file__), "..", "..",
+                             "crawler-user-agents.json")
+
+BROWSER_UAS = [
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.5 Safari/605.1.15",
+    "Mozilla/5.0 (X11; Linux x86_64; rv:127.0) Gecko/20100101 Firefox/127.0",
+    "Mozilla/5.0 (iPhone; CPU iPhone OS 17_5 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.5 Mobile/15E148 Safari/604.1",
+    "Mozilla/5.0 (Linux; Android 14; Pixel 8) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0.0.0 Mobile Safari/537.36",
+]
+
+
+def load_crawlers():
+    with open(CRAWLERS_JSON) as f:
+        return json.load(f)
+
+
+def build_cfg(crawlers, n):
+    """cfg con n patrones (reales del JSON y sintéticos si no llegan)."""
+    patterns = [c["pattern"] for c in crawlers][:n]
+    patterns += [f"SyntheticBot{i}/" for i in range(n - len(patterns))]
+    cfg = {"blockedAgents": [], "limitedAgents": {}, "redirectAgents": []}
+    for i, pat in enumerate(patterns):
+        if i % 3 == 0:
+            cfg["blockedAgents"].append(pat)
+        elif i % 3 == 1:
+            cfg["limitedAgents"][pat] = {"maxPerHour": 10}
+        else:
+            cfg["redirectAgents"].append({"pattern": pat,
+                                          "url": "https://example.com"})
+    return cfg
+
+
+def linear_match(cfg, ua):
+    # Réplica del bucle original de detect_png
+    for pat in cfg["blockedAgents"]:
+        if re.search(pat, ua):
+            return pat
+    for r in cfg["redirectAgents"]:
+        if re.search(r["pattern"], ua):
+            return r["pattern"]
+    for pat in cfg["limitedAgents"]:
+        if re.search(pat, ua):
+            return pat
+    return None
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))]
+    return {"p50_us": pick(0.50) / 1000, "p99_us": pick(0.99) / 1000}
+
+
+def run(sizes, rounds, seed=42):
+    crawlers = load_crawlers()
+    bot_uas = [ua for c in crawlers for ua in c.get("instances", [])]
+    rnd = random.Random(seed)
+    # Mezcla aproximada del tráfico real: mayoría de navegadores
+    corpus = [
+        rnd.choice(BROWSER_UAS) if rnd.random() < 0.8 else rnd.choice(bot_uas)
+        for _ in range(rounds)
+    ]
+
+    results = []
+    for n in sizes:
+        cfg = build_cfg(crawlers, n)
+        ruleset = compile_ruleset(cfg)
+        for label, fn in (("linear", lambda ua: linear_match(cfg, ua)),
+                          ("compiled", ruleset.match)):
+            for ua in corpus[:50]:  # calentamiento
+                fn(ua)
+            samples = []
+            for ua in corpus:
+                t0 = time.perf_counter_ns()
+                fn(ua)
+                samples.append(time.perf_counter_ns() - t0)
+            results.append({"patterns": n, "matcher": label,
+                            **percentiles(samples)})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", default="10,100,1000")
+    parser.add_argument("--rounds", type=int, default=1000)
+    parser.add_argument("--json", help="guardar resultados en este fichero")
+    args = parser.parse_args()
+
+    results = run([int(s) for s in args.sizes.split(",")], args.rounds)
+    print(f"{'patterns':>8}  {'matcher':>8}  {'p50 (us)':>10}  {'p99 (us)':>10}")
+    for r in results:
+        print(f"{r['patterns']:>8}  {r['matcher']:>8}  "
+              f"{r['p50_us']:>10.2f}  {r['p99_us']:>10.2f}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+# backend/bench/check_uniques_sampling.py
+"""
+Comprueba que /rest/logs/uniques cuenta todos los visitantes aunque el
+plan muestree los "allow" (allow_sample_rate).
+
+Dos tenants reciben por el pixel los mismos N visitantes (una IP y un
+fingerprint distintos por hit): uno con un plan de --rate (solo se guarda
+1 de cada N hits) y otro sin muestreo. Los sketches de ambos deben dar el
+mismo número de únicos, N dentro del error del HyperLogLog.
+
+    cd backend && python bench/check_uniques_sampling.py [--visitors 5000] [--rate 10]
+
+Usa un SQLite temporal y el estado "local".
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+BROWSER_UA = ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+              "(KHTML, like Gecko) Chrome/124.0 Safari/537.36")
+TOLERANCE = 4  # errores típicos
+
+
+def seed(rate: int) -> dict:
+    """Un tenant por tasa de muestreo: {tenant: allow_sample_rate}."""
+    from db import SessionLocal
+    from models.models import PlanLevel, Subscription, SubscriptionPlan, User
+
+    tenants = {"check-sampled": (PlanLevel.enterprise, rate),
+               "check-full": (PlanLevel.free, 1)}
+    db = SessionLocal()
+    try:
+        for tid, (level, tenant_rate) in tenants.items():
+            plan = db.query(SubscriptionPlan).filter_by(plan=level).one()
+            plan.allow_sample_rate = tenant_rate
+            db.add(User(id=tid, email=f"{tid}@check.local", name=tid))
+            db.add(Subscription(user_id=tid, plan=level, traffic_limit=10**9,
+                                remaining_tokens=10**9))
+        db.commit()
+    finally:
+        db.close()
+    return {tid: tenant_rate for tid, (_, tenant_rate) in tenants.items()}
+
+
+def with_client_ip(app):
+    """La IP del cliente sale de la cabecera x-client-ip (sin red)."""
+
+    async def wrapped(scope, receive, send):
+        if scope["type"] == "http":
+            ip = dict(scope["headers"]).get(b"x-client-ip")
+            if ip:
+                scope = dict(scope, client=(ip.decode(), 5000))
+        await app(scope, receive, send)
+
+    return wrapped
+
+
+async def visit(tenants, visitors: int, concurrency: int) -> int:
+    import httpx
+    import main
+
+    transport = httpx.ASGITransport(app=with_client_ip(main.app))
+    errors = 0
+    counter = iter(range(visitors))
+
+    async def worker(client):
+        nonlocal errors
+        for i in counter:
+            ip = f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}"
+            for tenant in tenants:
+                r = await client.get(f"/rest/detect/{tenant}.png",
+                                     params={"fp": f"visitor-{i}"},
+                                     headers={"user-agent": BROWSER_UA,
+                                              "x-client-ip": ip})
+                if r.status_code != 200:
+                    errors += 1
+
+    async with httpx.AsyncClient(transport=transport,
+                                 base_url="http://check") as client:
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--visitors", type=int, default=5000)
+    parser.add_argument("--rate", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=20)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix="neptuno-uniques-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{tmpdir}/check.db"
+    os.environ["STATE_BACKEND"] = "local"
+
+    from datetime import datetime
+    import main as app_main
+    from db import SessionLocal
+    from models.models import AccessLog
+    from services.hll import STANDARD_ERROR
+    from services.uniques import unique_counts
+
+    app_main.startup_event()
+    tenants = seed(args.rate)
+    try:
+        errors = asyncio.run(visit(tenants, args.visitors, args.concurrency))
+    finally:
+        # Vuelca el writer de logs y los únicos de los hits no guardados
+        app_main.shutdown_event()
+
+    db = SessionLocal()
+    today = datetime.utcnow().date()
+    failed = errors > 0
+    limit = TOLERANCE * STANDARD_ERROR
+    print(f"{'tenant':>14}  {'rate':>4}  {'rows':>6}  {'ips':>6}  "
+          f"{'fps':>6}  error")
+    try:
+        for tenant, rate in tenants.items():
+            rows = db.query(AccessLog).filter(AccessLog.tenant_id == tenant).count()
+            counts = unique_counts(db, tenant, today)
+            worst = max(abs(counts[m] - args.visitors) / args.visitors
+                        for m in counts)
+            failed |= worst > limit
+            print(f"{tenant:>14}  {rate:>4}  {rows:>6}  {counts['ip']:>6}  "
+                  f"{counts['fingerprint']:>6}  {worst:.2%}")
+    finally:
+        db.close()
+    print(f"\n{args.visitors} visitantes, errores HTTP {errors}, "
+          f"tolerancia {limit:.2%}: {'FALLO' if failed else 'OK'}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+# backend/bench/load_detect.py
+"""
+Prueba de carga del pixel: compara /rest/detect/{tenant}.png (def, threadpool)
+con /rest/detect/async/{tenant}.png (async def, AsyncEngine).
+
+Sin --url se ejecuta la app en proceso con httpx.ASGITransport (sin red),
+sobre un SQLite temporal con los tenants bench-N y sus reglas creados como
+en bench_detect.py; con --url se ataca un servidor ya arrancado (p.ej.
+uvicorn o gunicorn), que debe tener esos tenants.
+
+    cd backend && python bench/load_detect.py [--requests 2000] [--concurrency 50]
+    cd backend && python bench/load_detect.py --url http://localhost:8001
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import httpx
+
+from bench_matcher import BROWSER_UAS, load_crawlers, percentiles
+
+
+ROUTES = {
+    "sync": "/rest/detect/{tenant}.png",
+    "async": "/rest/detect/async/{tenant}.png",
+}
+
+
+def ua_corpus(seed=42, size=5000, bot_share=0.2):
+    bot_uas = [ua for c in load_crawlers() for ua in c.get("instances", [])]
+    rnd = random.Random(seed)
+    return [
+        rnd.choice(bot_uas) if rnd.random() < bot_share else rnd.choice(BROWSER_UAS)
+        for _ in range(size)
+    ]
+
+
+async def run_load(client, route, tenants, corpus, requests, concurrency):
+    """Lanza `requests` peticiones con `concurrency` clientes simultáneos."""
+    latencies, errors = [], 0
+    counter = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            url = route.format(tenant=tenants[i % len(tenants)])
+            headers = {"user-agent": corpus[i % len(corpus)]}
+            t0 = time.perf_counter_ns()
+            try:
+                r = await client.get(url, headers=headers)
+                if r.status_code >= 500:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter_ns() - t0)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - t0
+    p = percentiles(latencies)
+    ordered = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(p["p50_us"] / 1000, 3),
+        "p95_ms": round(ordered[int(0.95 * (len(ordered) - 1))] / 1e6, 3),
+        "p99_ms": round(p["p99_us"] / 1000, 3),
+    }
+
+
+def make_client(url=None):
+    if url:
+        return httpx.AsyncClient(base_url=url, follow_redirects=False)
+    import main
+    transport = httpx.ASGITransport(app=main.app, client=("127.0.0.1", 5000))
+    return httpx.AsyncClient(transport=transport,
+                             base_url="http://bench",
+                             follow_redirects=False)
+
+
+async def compare(args):
+    tenants = [f"bench-{i}" for i in range(args.tenants)]
+    corpus = ua_corpus()
+    results = {}
+    async with make_client(args.url) as client:
+        for name in args.routes.split(","):
+            route = ROUTES[name]
+            # Calentamiento: carga reglas y cuotas de todos los tenants
+            await run_load(client, route, tenants, corpus, len(tenants) * 2, 4)
+            results[name] = await run_load(client, route, tenants, corpus,
+                                           args.requests, args.concurrency)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--url", help="servidor a probar (por defecto, en proceso)")
+    parser.add_argument("--routes", default="sync,async")
+    parser.add_argument("--tenants", type=int, default=10)
+    parser.add_argument("--rules", type=int, default=50,
+                        help="FirewallRule por tenant (solo en proceso)")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+
+    if not args.url:
+        # Base de datos y estado propios: nunca la de desarrollo
+        # (settings ya está cargado por bench_matcher: el entorno no basta)
+        from config import settings
+        tmpdir = tempfile.mkdtemp(prefix="neptuno-load-")
+        settings.DATABASE_URL = f"sqlite:///{tmpdir}/load.db"
+        settings.STATE_BACKEND = "local"
+        from bench_detect import seed
+        import main as app_main
+        seed(args.tenants, args.rules, load_crawlers())
+        app_main.startup_event()
+    try:
+        results = asyncio.run(compare(args))
+    finally:
+        if not args.url:
+            app_main.shutdown_event()
+
+    print(f"{'route':>6}  {'rps':>8}  {'p50 ms':>8}  {'p95 ms':>8}  {'p99 ms':>8}  errors")
+    for name, r in results.items():
+        print(f"{name:>6}  {r['rps']:>8}  {r['p50_ms']:>8}  {r['p95_ms']:>8}  "
+              f"{r['p99_ms']:>8}  {r['errors']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -33,6 +33,94 @@ class Settings(BaseSettings):
     MAIL_PASSWORD: str
     MAIL_FROM: str
 
+    # Ingesta write-behind de AccessLog (routers/detect.py)
+    INGEST_BATCH_SIZE: int = 500
+    INGEST_FLUSH_INTERVAL: float = 1.0  # segundos
+    INGEST_QUEUE_MAX: int = 50_000
+    INGEST_PUT_TIMEOUT: float = 0.05  # espera máxima con la cola llena
+    INGEST_WRITE_RETRIES: int = 3  # reintentos de un INSERT fallido
+    INGEST_RETRY_BACKOFF: float = 0.5  # segundos; se dobla en cada reintento
+
+    # Caché de reglas del firewall por tenant (services/rule_cache.py)
+    RULES_CACHE_TTL: float = 60
+    RULES_CHECK_INTERVAL: float = 1.0  # cada cuánto se mira la generación
+
+    # LRU de veredictos por (tenant, versión de reglas, UA)
+    VERDICT_CACHE_SIZE: int = 50_000
+
+    # Clasificador de crawlers (services/crawlers.py)
+    CRAWLERS_FILE: str = os.path.join(os.path.dirname(__file__), "..",
+                                      "crawler-user-agents.json")
+    CRAWLERS_RELOAD_INTERVAL: float = 30  # segundos entre comprobaciones
+
+    # Listas de rangos IP para reglas match_type="ip" con "file:<nombre>"
+    IP_LISTS_DIR: str = os.path.join(os.path.dirname(__file__), "..",
+                                     "ip-lists")
+
+    # GeoIP local para AccessLog.country_code: .mmdb de MaxMind o CSV de
+    # rangos (services/geoip.py); vacío = desactivado
+    GEOIP_DB_PATH: str = ""
+    GEOIP_CACHE_SIZE: int = 100_000
+    GEOIP_RELOAD_INTERVAL: float = 300  # segundos entre comprobaciones
+
+    # POST /rest/detect/{tenant}/batch (sendBeacon)
+    DETECT_BATCH_MAX_EVENTS: int = 50
+    DETECT_BATCH_MAX_BYTES: int = 64 * 1024
+
+    # Ventana de las reglas "restricted" (maxPerHour)
+    LIMIT_WINDOW_SECONDS: int = 3600
+    LIMIT_WINDOW_BUCKETS: int = 60
+
+    # Volcado de Subscription.remaining_tokens desde memoria
+    QUOTA_FLUSH_INTERVAL: float = 5.0  # segundos
+    # Cada cuánto se vuelve a cargar el saldo compartido de la base de datos
+    QUOTA_BALANCE_TTL: float = 300.0  # segundos
+
+    # Caché de /rest/logs/advanced-insights por tenant y rango
+    # (services/insights.py)
+    INSIGHTS_CACHE_TTL: float = 60  # segundos hasta el siguiente refresco
+    INSIGHTS_CACHE_SIZE: int = 5_000  # entradas (tenant, rango)
+    INSIGHTS_RESCAN_HOURS: int = 1  # horas cerradas que se releen siempre
+    INSIGHTS_CACHE_MAX_AGE: float = 3600  # segundos hasta recalcular entero
+
+    # Live tail de logs por SSE (services/live.py)
+    LIVE_POLL_INTERVAL: float = 1.0  # segundos entre comprobaciones
+    LIVE_LAG: float = 10.0  # margen para lotes volcados tarde por otro worker
+    LIVE_MAX_ROWS: int = 500  # filas por lectura y tenant
+    LIVE_BUFFER_EVENTS: int = 2_000  # eventos pendientes por cliente
+    LIVE_MAX_CLIENTS: int = 20  # conexiones por tenant y worker
+    LIVE_KEEPALIVE: float = 15.0  # segundos sin eventos hasta un comentario
+
+    # IPs y fingerprints de los "allow" que el muestreo no guarda
+    # (services/uniques.py)
+    UNIQUES_FLUSH_INTERVAL: float = 10.0  # segundos
+    UNIQUES_MAX_PENDING: int = 100_000  # valores distintos por volcado
+
+    # Particiones de access_log en Postgres (services/partitions.py)
+    ACCESS_LOG_PARTITION_MONTHS: int = 1  # meses por partición
+    ACCESS_LOG_PARTITIONS_AHEAD: int = 3  # meses creados por adelantado
+    ACCESS_LOG_RETENTION_DAYS: int = 0  # 0 = no se borra nada
+    PARTITION_MAINTENANCE_INTERVAL: float = 6 * 3600  # segundos
+
+    # Estado compartido entre workers (services/state.py): local | shm | redis
+    STATE_BACKEND: str = "shm"
+    # Vacío = un fichero en el tmp del sistema por APP_NAME y DATABASE_URL,
+    # para que dos despliegues en la misma máquina no compartan contadores.
+    # Una ruta fija con otro STATE_SHM_SLOTS que el del fichero no arranca
+    STATE_SHM_PATH: str = ""
+    STATE_SHM_SLOTS: int = 1 << 20  # 24 bytes por hueco
+    REDIS_URL: str = "redis://localhost:6379/0"
+
+    # Exportación de reglas block/redirect a maps de nginx (vacío = desactivado)
+    NGINX_EXPORT_PATH: str = ""
+    # nginx en otro contenedor: "docker exec <contenedor> nginx -t", etc.
+    # (ver services/nginx_export.py); vacíos = los lanza otro proceso
+    NGINX_TEST_CMD: str = "nginx -t"
+    NGINX_RELOAD_CMD: str = "nginx -s reload"
+    NGINX_EXPORT_DEBOUNCE: float = 2.0  # segundos
+    NGINX_EDGE_LOG: str = ""  # access_log con formato neptuno_edge
+    NGINX_EDGE_SAMPLE: int = 10  # se guarda 1 de cada N decisiones del borde
+
     class Config:
         env_file = ".env"
         extra = "allow"
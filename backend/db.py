@@ -2,6 +2,7 @@
 from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 
 from config import settings
 # backend/db.py
@@ -18,3 +19,25 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+# Motor async para las rutas calientes (aiosqlite en dev, asyncpg en Postgres)
+def async_database_url(url: str) -> str:
+    if url.startswith("sqlite://"):
+        return url.replace("sqlite://", "sqlite+aiosqlite://", 1)
+    for prefix in ("postgresql+psycopg2://", "postgresql://", "postgres://"):
+        if url.startswith(prefix):
+            return url.replace(prefix, "postgresql+asyncpg://", 1)
+    return url
+
+
+async_engine = create_async_engine(async_database_url(settings.DATABASE_URL))
+
+AsyncSessionLocal = async_sessionmaker(bind=async_engine,
+                                       autoflush=False,
+                                       expire_on_commit=False)
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
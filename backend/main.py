@@ -3,6 +3,20 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from routers import auth, user, admin, embed, detect, logs, firewall, payments
 from db import engine, Base, SessionLocal
+from services.ingest import access_log_writer
+from services.limits import limit_counters
+from services.quota import quota_meter
+from services.verdict_cache import verdict_cache
+from services.crawlers import crawler_classifier
+from services.geoip import geoip_resolver
+from services.agents import enrich_agents
+from services.rollup import update_hourly
+from services.partitions import partition_maintainer
+from services.live import live_hub, notify_live
+from services.uniques import sampled_uniques, update_uniques
+from services.metrics import registry
+from services.nginx_export import nginx_exporter, edge_log_tailer
+from fastapi.responses import PlainTextResponse
 from models.models import User, UserRole
 from utils import hash_password
 from config import settings
@@ -36,6 +50,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Paginación de /rest/logs (routers/logs.py)
+    expose_headers=["X-Next-Cursor", "X-Total-Approx"],
 )
 
 # Middlewares de seguridad
@@ -105,6 +121,34 @@ def startup_event():
         finally:
             db.close()
 
+    limit_counters.seed_from_db()
+    access_log_writer.add_enricher(crawler_classifier.enrich)
+    access_log_writer.add_enricher(enrich_agents)
+    access_log_writer.add_enricher(geoip_resolver.enrich)
+    access_log_writer.add_write_hook(update_hourly)
+    access_log_writer.add_write_hook(update_uniques)
+    access_log_writer.add_write_hook(notify_live)
+    access_log_writer.start()
+    quota_meter.start()
+    nginx_exporter.start()
+    edge_log_tailer.start()
+    partition_maintainer.start()
+    live_hub.start()
+    sampled_uniques.start()
+
+
+@app.on_event("shutdown")
+def shutdown_event():
+    # Vuelca los logs y el consumo de cuota pendientes antes de salir
+    live_hub.stop()
+    sampled_uniques.stop()
+    partition_maintainer.stop()
+    edge_log_tailer.stop()
+    nginx_exporter.stop()
+    access_log_writer.stop()
+    quota_meter.stop()
+
+
 def _create_db_and_user():
     import subprocess
     try:
@@ -166,4 +210,29 @@ def seed_default_plans(db: Session):
 @app.get("/health")
 @app.get("/rest/health")
 async def health_check():
-    return {"status": "ok", "version": "1.0.0"}
\ No newline at end of file
+    return {
+        "status": "ok",
+        "version": "1.0.0",
+        "ingest": access_log_writer.stats(),
+        "verdicts": verdict_cache.stats()
+    }
+
+
+# Métricas del pixel en formato Prometheus (services/metrics.py)
+registry.gauge("neptuno_ingest", "Estado del buffer de AccessLog",
+               access_log_writer.stats, ("stat",))
+registry.gauge("neptuno_verdict_cache", "LRU de veredictos por UA",
+               verdict_cache.stats, ("stat",))
+registry.gauge("neptuno_geoip_cache", "LRU de países por IP",
+               geoip_resolver.stats, ("stat",))
+registry.gauge("neptuno_quota", "Tenants con cuota en memoria",
+               quota_meter.stats, ("stat",))
+registry.gauge("neptuno_live_logs", "Clientes de /rest/logs/live",
+               live_hub.stats, ("stat",))
+
+
+@app.get("/metrics")
+@app.get("/rest/metrics")
+def metrics():
+    return PlainTextResponse(registry.render(),
+                             media_type="text/plain; version=0.0.4")
\ No newline at end of file
@@ -1,5 +1,5 @@
 # File: backend/models.py
-from sqlalchemy import Column, String, DateTime, Integer, Boolean, Enum, ForeignKey, Float
+from sqlalchemy import Column, String, DateTime, Integer, Boolean, Enum, ForeignKey, Float, Index, Date, LargeBinary
 from sqlalchemy.orm import relationship
 from db import Base
 from datetime import datetime
@@ -86,6 +86,9 @@ class SubscriptionPlan(Base):
     price = Column(Integer, default=0)
     active = Column(Boolean, default=True)
     description = Column(String, nullable=True)  # nuevo campo
+    # Solo se guarda 1 de cada N hits "allow" (con sample_weight = N).
+    # 1 = sin muestreo; el operador lo sube por plan desde admin
+    allow_sample_rate = Column(Integer, default=1, nullable=False)
 
 
 class Subscription(Base):
@@ -146,14 +149,26 @@ class FirewallRule(Base):
     limit = Column(Integer, nullable=True)
     fee = Column(Float, nullable=True)  # <-- CORREGIDO
     redirect_url = Column(String, nullable=True)
+    # "user_agent": pattern es una regex del UA; "ip": CIDRs o "file:<lista>"
+    match_type = Column(String, default="user_agent", nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
 
 
 class AccessLog(Base):
     __tablename__ = "access_log"
+    # Paginación por cursor de /rest/logs: (timestamp, id) dentro del tenant
+    __table_args__ = (Index("ix_access_log_tenant_ts_id", "tenant_id",
+                            "timestamp", "id"),
+                      Index("ix_access_log_tenant_agent", "tenant_id",
+                            "agent_family"),
+                      Index("ix_access_log_tenant_crawler", "tenant_id",
+                            "is_crawler"))
     id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
     tenant_id = Column(String, index=True)
-    timestamp = Column(DateTime, default=datetime.utcnow, index=True)
+    # En la PK como en la migración 9b3e6a0f4c12: Postgres exige que la
+    # columna de partición forme parte de ella
+    timestamp = Column(DateTime, default=datetime.utcnow, index=True,
+                       primary_key=True)
     ip_address = Column(String)
     user_agent = Column(String)
     referrer = Column(String, nullable=True)
@@ -171,6 +186,13 @@ class AccessLog(Base):
     )  # "allow" | "block" | "limit" | "redirect" | "ratelimit" | "flagged" | "tariff"
     rule = Column(String)
     redirect_url = Column(String, nullable=True)
+    crawler_family = Column(String, nullable=True)  # services/crawlers.py
+    crawler_category = Column(String, nullable=True, index=True)
+    sample_weight = Column(Integer, nullable=True)  # hits que representa (NULL = 1)
+    # UA normalizado al ingerir (services/agents.py)
+    agent_family = Column(String, nullable=True)
+    agent_version = Column(String, nullable=True)
+    is_crawler = Column(Boolean, nullable=True)
     js_executed = Column(Boolean, default=False)
     page: str = Column(
         String, nullable=True)  # Nueva columna: la página a la que llegó
@@ -179,7 +201,32 @@ class AccessLog(Base):
     exit_timestamp: DateTime = Column(
         DateTime, nullable=True)  # Para cálculo de time-on-page
 
-    seen = Column(Boolean, default=False)
+
+class AccessLogHourly(Base):
+    """Hits de access_log agregados por hora; lo mantiene services/rollup.py."""
+    __tablename__ = "access_log_hourly"
+    tenant_id = Column(String, primary_key=True)
+    hour = Column(DateTime, primary_key=True, index=True)
+    outcome = Column(String, primary_key=True)
+    agent_family = Column(String, primary_key=True)
+    hits = Column(Integer, nullable=False, default=0)  # ponderados por sample_weight
+    rows = Column(Integer, nullable=False, default=0)  # filas guardadas
+
+
+class AccessLogDailyUniques(Base):
+    """Sketch HyperLogLog de IPs / fingerprints por tenant y día (services/uniques.py)."""
+    __tablename__ = "access_log_daily_uniques"
+    tenant_id = Column(String, primary_key=True)
+    day = Column(Date, primary_key=True)
+    metric = Column(String, primary_key=True)  # "ip" | "fingerprint"
+    sketch = Column(LargeBinary, nullable=False)
+
+
+class LogSeenWatermark(Base):
+    """Hasta dónde ha visto cada tenant sus logs (/rest/logs/mark-seen)."""
+    __tablename__ = "log_seen_watermarks"
+    tenant_id = Column(String, primary_key=True)
+    seen_at = Column(DateTime, nullable=False)  # logs con timestamp <= seen_at
 
 
 class LoginHistory(Base):
@@ -18,7 +18,7 @@ from sqlalchemy import func, desc
 from datetime import datetime, timedelta
 from dependencies import get_current_user
 from db import get_db
-from models.models import User, AccessLog, Subscription
+from models.models import User, AccessLog, AccessLogDailyUniques, AccessLogHourly, LogSeenWatermark, Subscription
 from pydantic import BaseModel
 
 router = APIRouter(tags=["admin"])
@@ -207,6 +207,12 @@ def delete_user(user_id: str,
     db.query(Subscription).filter(Subscription.user_id == user_id).delete()
     db.query(LoginHistory).filter(LoginHistory.user_id == user_id).delete()
     db.query(AccessLog).filter(AccessLog.tenant_id == user_id).delete()
+    db.query(AccessLogHourly).filter(
+        AccessLogHourly.tenant_id == user_id).delete()
+    db.query(LogSeenWatermark).filter(
+        LogSeenWatermark.tenant_id == user_id).delete()
+    db.query(AccessLogDailyUniques).filter(
+        AccessLogDailyUniques.tenant_id == user_id).delete()
 
     # Finalmente eliminar el usuario
     db.delete(user)
@@ -1,11 +1,23 @@
 # backend/routers/detect.py
-from datetime import datetime, timezone
-import re, time, io
-from fastapi import APIRouter, Request, Response
-from fastapi.responses import RedirectResponse, StreamingResponse
-from db import SessionLocal
-from models.models import AccessLog, FirewallRule, User
-from collections import defaultdict
+import json
+import random
+import time
+
+from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi.responses import RedirectResponse
+from sqlalchemy import select
+from db import SessionLocal, AsyncSessionLocal
+from models.models import FirewallRule
+from config import settings
+from services.rule_cache import RuleCache, rule_generations
+from services.verdict_cache import verdict_cache
+from services.ingest import access_log_writer, build_log_row
+from services.limits import limit_counters
+from services.quota import quota_meter
+from services.state import call_state
+from services.uniques import sampled_uniques
+from services.metrics import detect_request_seconds, detect_requests_total, stage
+from services.matcher import prefer
 
 router = APIRouter()
 
@@ -14,20 +26,32 @@ EMPTY_PNG = (b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x01'
              b'\x89\x00\x00\x00\nIDATx\x9cc`\x00\x00\x00\x02\x00'
              b'\x01\xe2!\xbc\x33\x00\x00\x00\x00IEND\xaeB`\x82')
 
-# Caché de reglas en memoria
-tenant_rules_cache = {}
-tenant_rules_last = defaultdict(lambda: 0)
-TTL = 60
+DEFAULT_RULES = {
+    "blockedAgents": [r"GPTBot", r"Perplexity"],
+    "limitedAgents": {
+        r"ClaudeAI": {
+            "maxPerHour": 5
+        }
+    },
+    "redirectAgents": [{
+        "pattern": r"PaywallLLM",
+        "url": "https://example.com/paywall"
+    }]
+}
 
 
-def load_rules_from_db(tenant_id: str):
-    db = SessionLocal()
-    rows = db.query(FirewallRule).filter(
-        FirewallRule.tenant_id == tenant_id).all()
-    db.close()
-    cfg = {"blockedAgents": [], "limitedAgents": {}, "redirectAgents": []}
+def rules_cfg(rows) -> dict:
+    cfg = {"blockedAgents": [], "limitedAgents": {}, "redirectAgents": [],
+           "ipRules": []}
     for r in rows:
-        if r.policy == "block":
+        if r.match_type == "ip":
+            cfg["ipRules"].append({
+                "policy": r.policy,
+                "ranges": r.pattern,
+                "url": r.redirect_url,
+                "limit": r.limit
+            })
+        elif r.policy == "block":
             cfg["blockedAgents"].append(r.pattern)
         elif r.policy == "restricted":
             cfg["limitedAgents"][r.pattern] = {"maxPerHour": r.limit}
@@ -39,115 +63,305 @@ def load_rules_from_db(tenant_id: str):
     return cfg
 
 
+def load_rules_from_db(tenant_id: str):
+    t0 = time.perf_counter()
+    db = SessionLocal()
+    rows = db.query(FirewallRule).filter(
+        FirewallRule.tenant_id == tenant_id).all()
+    db.close()
+    stage("rules_db", t0)
+    return rules_cfg(rows)
+
+
+async def aload_rules_from_db(tenant_id: str):
+    t0 = time.perf_counter()
+    async with AsyncSessionLocal() as db:
+        rows = (await db.execute(
+            select(FirewallRule).where(
+                FirewallRule.tenant_id == tenant_id))).scalars().all()
+    stage("rules_db", t0)
+    return rules_cfg(rows)
+
+
+# Caché de reglas compiladas en memoria, invalidada al escribir reglas
+tenant_rules_cache = RuleCache(loader=load_rules_from_db,
+                               aloader=aload_rules_from_db,
+                               default=DEFAULT_RULES,
+                               ttl=settings.RULES_CACHE_TTL,
+                               check_interval=settings.RULES_CHECK_INTERVAL,
+                               generations=rule_generations)
+
+
 def get_rules(tenant_id: str):
-    now = time.time()
-    if now - tenant_rules_last[tenant_id] > TTL:
-        fetched = load_rules_from_db(tenant_id)
-        if not fetched["blockedAgents"] and not fetched[
-                "limitedAgents"] and not fetched["redirectAgents"]:
-            fetched = tenant_rules_cache.get("default")
-        tenant_rules_cache[tenant_id] = fetched
-        tenant_rules_last[tenant_id] = now
-    return tenant_rules_cache[tenant_id]
-
-
-# Always keep a default entry to avoid KeyError
-tenant_rules_cache["default"] = {
-    "blockedAgents": [r"GPTBot", r"Perplexity"],
-    "limitedAgents": {
-        r"ClaudeAI": {
-            "maxPerHour": 5
-        }
-    },
-    "redirectAgents": [{
-        "pattern": r"PaywallLLM",
-        "url": "https://example.com/paywall"
-    }]
-}
+    t0 = time.perf_counter()
+    rules = tenant_rules_cache.get(tenant_id)
+    stage("rules", t0)
+    return rules
 
 
-@router.get("/detect/{tenant}.png")
-def detect_png(tenant: str,
-               request: Request,
-               noscript: str = None,
-               fp: str = None):
+def beacon_fields(request: Request):
     ua = request.query_params.get("ua") or request.headers.get(
         "user-agent", "")
     ip = request.client.host
     # path = request.url.path + ("?"+request.url.query if request.url.query else "")
     path = request.query_params.get("src") or request.url.path
-    rules = get_rules(tenant)
+    return ua, ip, path
+
+
+def match_rules(rules, ua: str, ip: str):
+    """
+    Regla que encaja con la petición: la de UA pasa por la LRU de veredictos;
+    la de IP se busca siempre en el índice de rangos (microsegundos).
+    """
+    t0 = time.perf_counter()
+    hit = prefer(verdict_cache.match(rules, ua), rules.match_ip(ip))
+    stage("match", t0)
+    return hit
+
 
+def evaluate(tenant: str, rules, ua: str, ip: str):
+    """Aplica las reglas del tenant a un UA e IP: (outcome, rule_applied, redirect_url)."""
+    return apply_hit(tenant, match_rules(rules, ua, ip))
+
+
+def apply_hit(tenant: str, hit):
+    """Resultado de una regla ya encontrada; las "restricted" cuentan el hit."""
     outcome, rule_applied, redirect_url = "allow", None, None
 
     # BLOCK
-    for pat in rules["blockedAgents"]:
-        if re.search(pat, ua):
-            outcome, rule_applied = "block", f"blocked:{pat}"
-            break
+    if hit and hit.policy == "block":
+        outcome, rule_applied = "block", f"blocked:{hit.pattern}"
 
     # REDIRECT
-    if outcome == "allow":
-        for r in rules["redirectAgents"]:
-            if re.search(r["pattern"], ua):
-                outcome, rule_applied, redirect_url = "redirect", f"redirect:{r['pattern']}", r[
-                    "url"]
-                break
+    elif hit and hit.policy == "redirect":
+        outcome, rule_applied, redirect_url = "redirect", f"redirect:{hit.pattern}", hit.url
 
     # LIMIT
-    if outcome == "allow":
-        for pat, cfg in rules["limitedAgents"].items():
-            if re.search(pat, ua):
-                db = SessionLocal()
-                today = datetime.now(timezone.utc).replace(hour=0,
-                                                           minute=0,
-                                                           second=0,
-                                                           microsecond=0)
-                used = db.query(AccessLog).filter(
-                    AccessLog.tenant_id == tenant,
-                    AccessLog.rule.like(f"limit:{pat}%"), AccessLog.timestamp
-                    >= today).count()
-                db.close()
-                if used >= cfg["maxPerHour"]:
-                    outcome, rule_applied = "block", f"limit_exceeded:{pat} ({used}/{cfg['maxPerHour']})"
-                else:
-                    outcome, rule_applied = "limit", f"limit:{pat} ({used+1}/{cfg['maxPerHour']})"
-                break
+    elif hit and hit.policy == "restricted":
+        pat = hit.pattern
+        t0 = time.perf_counter()
+        # Ventana deslizante de una hora en el estado compartido (services/limits.py)
+        allowed, used = limit_counters.try_acquire((tenant, pat), hit.limit)
+        stage("limit", t0)
+        if not allowed:
+            outcome, rule_applied = "block", f"limit_exceeded:{pat} ({used}/{hit.limit})"
+        else:
+            outcome, rule_applied = "limit", f"limit:{pat} ({used}/{hit.limit})"
 
+    return outcome, rule_applied, redirect_url
 
-    db = SessionLocal()
-    user = db.query(User).filter(User.id == tenant).first()
-    if user and user.subscription:
-        sub = user.subscription
 
-        if sub.remaining_tokens is None:
-            sub.remaining_tokens = sub.traffic_limit
+async def aapply_hit(tenant: str, hit):
+    """apply_hit() para rutas async: la ventana de límite va con call_state()."""
+    if hit and hit.policy == "restricted":
+        return await call_state(limit_counters.state, apply_hit, tenant, hit)
+    return apply_hit(tenant, hit)
+
 
-        if sub.remaining_tokens <= 0:
+def batch_outcomes(tenant: str, hit, n: int) -> list:
+    """apply_hit() y cuota de n eventos con la misma regla, en una llamada."""
+    outcomes = []
+    for _ in range(n):
+        outcome, rule_applied, redirect_url = apply_hit(tenant, hit)
+        t0 = time.perf_counter()
+        if quota_meter.consume(tenant) is False:
             outcome, rule_applied = "ratelimit", "subscription_limit_exceeded"
-        else:
-            sub.remaining_tokens -= 1
+        stage("quota", t0)
+        outcomes.append((outcome, rule_applied, redirect_url))
+    return outcomes
 
-        db.add(sub)
-        db.commit()
 
-    # SAVE LOG
-    db = SessionLocal()
-    db.add(
-        AccessLog(tenant_id=tenant,
-                  ip_address=ip,
-                  user_agent=ua,
-                  fingerprint=(fp or noscript or ""),
-                  path=path,
-                  outcome=outcome,
-                  rule=rule_applied or "none",
-                  redirect_url=redirect_url))
-    db.commit()
-    db.close()
+def sample_weight(tenant: str, outcome: str) -> int:
+    """
+    Peso con el que se guarda el hit, o 0 si no se guarda: los "allow" de un
+    plan con allow_sample_rate N se guardan 1 de cada N, con peso N. El resto
+    de resultados se guardan siempre.
+    """
+    if outcome != "allow":
+        return 1
+    rate = quota_meter.sample_rate(tenant)
+    if rate <= 1:
+        return 1
+    return rate if random.randrange(rate) == 0 else 0
+
+
+def observe_request(route: str, outcome: str, start: float):
+    detect_request_seconds.labels(route).observe(time.perf_counter() - start)
+    detect_requests_total.labels(route, outcome).inc()
+
 
-    # RESPONSES
+def beacon_response(outcome: str, redirect_url: str = None):
     if outcome == "block":
         return Response(status_code=401)
     if outcome == "redirect":
         return RedirectResponse(redirect_url)
-    return StreamingResponse(io.BytesIO(EMPTY_PNG), media_type="image/png")
+    # Contenido fijo: sin StreamingResponse, que itera en el threadpool
+    return Response(content=EMPTY_PNG, media_type="image/png")
+
+
+@router.get("/detect/{tenant}.png")
+def detect_png(tenant: str,
+               request: Request,
+               noscript: str = None,
+               fp: str = None):
+    start = time.perf_counter()
+    ua, ip, path = beacon_fields(request)
+    rules = get_rules(tenant)
+
+    outcome, rule_applied, redirect_url = evaluate(tenant, rules, ua, ip)
+
+    # QUOTA (services/quota.py: sin cargar User ni bloquear la fila)
+    t0 = time.perf_counter()
+    if quota_meter.consume(tenant) is False:
+        outcome, rule_applied = "ratelimit", "subscription_limit_exceeded"
+    t0 = stage("quota", t0)
+
+    # SAVE LOG (write-behind: se vuelca en lote desde services/ingest.py)
+    weight = sample_weight(tenant, outcome)
+    if weight:
+        access_log_writer.submit(
+            build_log_row(tenant_id=tenant,
+                          ip_address=ip,
+                          user_agent=ua,
+                          fingerprint=(fp or noscript or ""),
+                          path=path,
+                          outcome=outcome,
+                          rule=rule_applied or "none",
+                          redirect_url=redirect_url,
+                          sample_weight=weight))
+    else:
+        sampled_uniques.observe(tenant, ip, fp or noscript)
+    stage("log", t0)
+
+    observe_request("sync", outcome, start)
+    return beacon_response(outcome, redirect_url)
+
+
+@router.get("/detect/async/{tenant}.png")
+async def detect_png_async(tenant: str,
+                           request: Request,
+                           noscript: str = None,
+                           fp: str = None):
+    """
+    Misma lógica que detect_png sin pasar por el threadpool: las cargas de
+    reglas y cuota usan el AsyncEngine, el estado compartido (flock o red)
+    se toca con call_state() y el log nunca bloquea el event loop.
+    """
+    start = time.perf_counter()
+    ua, ip, path = beacon_fields(request)
+    t0 = time.perf_counter()
+    rules = await tenant_rules_cache.aget(tenant)
+    stage("rules", t0)
+
+    hit = match_rules(rules, ua, ip)
+    outcome, rule_applied, redirect_url = await aapply_hit(tenant, hit)
+
+    t0 = time.perf_counter()
+    if await quota_meter.aconsume(tenant) is False:
+        outcome, rule_applied = "ratelimit", "subscription_limit_exceeded"
+    t0 = stage("quota", t0)
+
+    weight = sample_weight(tenant, outcome)
+    if weight:
+        access_log_writer.submit(build_log_row(tenant_id=tenant,
+                                               ip_address=ip,
+                                               user_agent=ua,
+                                               fingerprint=(fp or noscript or ""),
+                                               path=path,
+                                               outcome=outcome,
+                                               rule=rule_applied or "none",
+                                               redirect_url=redirect_url,
+                                               sample_weight=weight),
+                                 wait=False)
+    else:
+        sampled_uniques.observe(tenant, ip, fp or noscript)
+    stage("log", t0)
+
+    observe_request("async", outcome, start)
+    return beacon_response(outcome, redirect_url)
+
+
+async def read_batch(request: Request) -> bytes:
+    """
+    Cuerpo del batch sin pasar de DETECT_BATCH_MAX_BYTES: se rechaza por
+    Content-Length antes de leer y, si no lo trae (chunked) o miente, al
+    pasarse mientras llega.
+    """
+    limit = settings.DETECT_BATCH_MAX_BYTES
+    length = request.headers.get("content-length")
+    if length is not None:
+        if not length.isdigit():
+            raise HTTPException(status_code=400, detail="Invalid batch")
+        if int(length) > limit:
+            raise HTTPException(status_code=413, detail="Batch too large")
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > limit:
+            raise HTTPException(status_code=413, detail="Batch too large")
+    return bytes(body)
+
+
+def parse_batch(body: bytes) -> list:
+    """
+    Cuerpo de /detect/{tenant}/batch: lista JSON de eventos compactos
+    {"p": url de la página, "f": fingerprint}. Llega como text/plain desde
+    navigator.sendBeacon, así que no se valida el Content-Type.
+    """
+    if len(body) > settings.DETECT_BATCH_MAX_BYTES:
+        raise HTTPException(status_code=413, detail="Batch too large")
+    try:
+        events = json.loads(body)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid batch")
+    if not isinstance(events, list):
+        raise HTTPException(status_code=400, detail="Invalid batch")
+    if len(events) > settings.DETECT_BATCH_MAX_EVENTS:
+        raise HTTPException(status_code=413, detail="Too many events")
+    return [e for e in events if isinstance(e, dict)]
+
+
+@router.post("/detect/{tenant}/batch")
+async def detect_batch(tenant: str, request: Request):
+    """
+    Varios page views de una visita (p.ej. navegación SPA) en una petición:
+    el UA se evalúa una vez y las ventanas de límite y la cuota se aplican
+    evento a evento; las filas se entregan juntas al writer.
+    """
+    start = time.perf_counter()
+    events = parse_batch(await read_batch(request))
+    ua, ip, default_path = beacon_fields(request)
+    t0 = time.perf_counter()
+    rules = await tenant_rules_cache.aget(tenant)
+    stage("rules", t0)
+    hit = match_rules(rules, ua, ip)
+    await quota_meter.aregister(tenant)
+    # Límites y cuota de todos los eventos en una sola llamada al estado
+    outcomes = await call_state(quota_meter.state, batch_outcomes, tenant,
+                                hit, len(events))
+
+    rows = []
+    for event, (outcome, rule_applied, redirect_url) in zip(events, outcomes):
+        detect_requests_total.labels("batch", outcome).inc()
+        weight = sample_weight(tenant, outcome)
+        fingerprint = str(event.get("f") or "")[:1024]
+        if not weight:
+            sampled_uniques.observe(tenant, ip, fingerprint)
+            continue
+        rows.append(
+            build_log_row(tenant_id=tenant,
+                          ip_address=ip,
+                          user_agent=ua,
+                          fingerprint=fingerprint,
+                          path=str(event.get("p") or default_path)[:2048],
+                          outcome=outcome,
+                          rule=rule_applied or "none",
+                          redirect_url=redirect_url,
+                          sample_weight=weight))
+
+    t0 = time.perf_counter()
+    access_log_writer.submit_many(rows, wait=False)
+    stage("log", t0)
+    detect_request_seconds.labels("batch").observe(time.perf_counter() - start)
+    # sendBeacon ignora la respuesta
+    return Response(status_code=204)
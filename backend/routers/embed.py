@@ -119,7 +119,7 @@ EMBED_TEMPLATE = (
     '<a href=https://losguardias.com/rest/detect/{t}.png style=display:none rel=nofollow>@prompt:/?</a>'
     '<img src=https://losguardias.com/rest/detect/{t}.png?js=0 width=1 height=1 style=display:none alt>'
     '<script>!async function(){if(navigator.webdriver||!(await new Promise(r=>{let e=performance.now(),t=1;'
-    'requestAnimationFrame(()=>{(performance.now()-e<2)&&(t=0),r(t)}),setTimeout(()=>r(t),5)}))return '
+    'requestAnimationFrame(()=>{(performance.now()-e<2)&&(t=0),r(t)}),setTimeout(()=>r(t),5)})))return '
     'fetch("https://losguardias.com/rest/detect/{t}.png?js=1").catch(1);let n=new Image;'
     'n.src=`https://losguardias.com/rest/detect/{t}.png?js=2&fp=${encodeURIComponent(['
     'navigator.userAgent,navigator.language,screen.width+"x"+screen.height,'
@@ -128,10 +128,35 @@ EMBED_TEMPLATE = (
     '<noscript><img src=https://losguardias.com/rest/detect/{t}.png?noscript=1 style=display:none alt></noscript>'
 )
 
+# Modo batch (opt-in): los page views de la visita, incluida la navegación
+# SPA por history.pushState, se acumulan y se envían juntos con sendBeacon a
+# POST /rest/detect/{t}/batch al ocultarse la página o al llegar a 20. Antes
+# se pasa la misma prueba que en EMBED_TEMPLATE (webdriver, rAF, headless):
+# si falla se avisa con js=1 y no se encola nada. El primer page view solo
+# va en la cola (el <img> sin JS queda en el <noscript>).
+EMBED_BATCH_TEMPLATE = (
+    '<a href=https://losguardias.com/rest/detect/{t}.png style=display:none rel=nofollow>@prompt:/?</a>'
+    '<script>!async function(){if(navigator.webdriver||navigator.userAgentData?.brands.some(b=>/headless/i.test(b.brand))'
+    '||!(await new Promise(r=>{let e=performance.now(),t=1;'
+    'requestAnimationFrame(()=>{(performance.now()-e<2)&&(t=0),r(t)}),setTimeout(()=>r(t),5)})))return '
+    'fetch("https://losguardias.com/rest/detect/{t}.png?js=1").catch(1);'
+    'const u="https://losguardias.com/rest/detect/{t}/batch",q=[],'
+    'f=[navigator.userAgent,navigator.language,screen.width+"x"+screen.height,'
+    'Intl.DateTimeFormat().resolvedOptions().timeZone].join("|"),'
+    's=()=>{q.length&&navigator.sendBeacon(u,JSON.stringify(q.splice(0)))},'
+    'a=()=>{q.push({p:location.href,f:f});q.length>=20&&s()},o=history.pushState;'
+    'history.pushState=function(){const r=o.apply(this,arguments);return a(),r};'
+    'addEventListener("popstate",a);addEventListener("pagehide",s);'
+    'addEventListener("visibilitychange",()=>document.visibilityState=="hidden"&&s());a()}()</script>'
+    '<noscript><img src=https://losguardias.com/rest/detect/{t}.png?noscript=1 style=display:none alt></noscript>'
+)
+
 @router.get("/embed/snippet.js", response_class=PlainTextResponse)
 def get_tracking_snippet(
+    batch: bool = False,
     db=Depends(get_db),
     current_user=Depends(get_current_user)
 ):
     tenant_id = current_user.id
-    return EMBED_TEMPLATE.replace("{t}", tenant_id)
\ No newline at end of file
+    template = EMBED_BATCH_TEMPLATE if batch else EMBED_TEMPLATE
+    return template.replace("{t}", tenant_id)
\ No newline at end of file
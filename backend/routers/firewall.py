@@ -6,7 +6,10 @@ from sqlalchemy.orm import Session
 from dependencies import get_current_user
 from db import get_db
 from models.models import FirewallRule
+from services.rule_cache import invalidate_rules
+from services.nginx_export import nginx_exporter
 from pydantic import BaseModel, HttpUrl
+from typing import Literal
 import uuid
 
 router = APIRouter(tags=["firewall"]) # prefix="/firewall"
@@ -18,6 +21,8 @@ class RuleIn(BaseModel):
     limit: int | None = None
     fee: float | None = None  # Nuevo campo para tarifa
     redirect_url: HttpUrl | None = None
+    # "ip": pattern es una lista de CIDRs y/o "file:<lista>" (services/ip_ranges.py)
+    match_type: Literal["user_agent", "ip"] = "user_agent"
 
 DEFAULT_RULES = [
     {"llm_name": "GPTBot", "pattern": "GPTBot", "policy": "block"},
@@ -48,6 +53,8 @@ def list_rules(current_user=Depends(get_current_user), db: Session = Depends(get
             created_at=now
             ))
         db.commit()
+        invalidate_rules(current_user.id)
+        nginx_exporter.schedule()
         rows = db.query(FirewallRule).filter(FirewallRule.tenant_id == current_user.id).all()
     return rows
 
@@ -63,7 +70,10 @@ def update_rules(rules: list[RuleIn], current_user=Depends(get_current_user), db
             policy=r.policy,
             limit=r.limit,
             fee=r.fee,  # Nuevo campo
-            redirect_url=str(r.redirect_url) if r.redirect_url else None
+            redirect_url=str(r.redirect_url) if r.redirect_url else None,
+            match_type=r.match_type
         ))
     db.commit()
+    invalidate_rules(current_user.id)
+    nginx_exporter.schedule()
     return {"ok": True}
\ No newline at end of file
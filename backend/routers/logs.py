@@ -1,15 +1,40 @@
 # File: backend/routers/logs.py
+import base64
+import csv
+import io
+import json
+import zlib
 from schemas.schemas import AdvancedInsightsOut
-from fastapi import APIRouter, Depends, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.encoders import jsonable_encoder
 from sqlalchemy.orm import Session
-from sqlalchemy import func, case
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, tuple_
 from datetime import datetime, timedelta
 from dependencies import get_current_user
-from db import get_db
-from models.models import AccessLog
+from db import engine, get_db
+from models.models import AccessLog, LogSeenWatermark
+from config import settings
+from services.insights import insights_cache
+from services.live import live_hub, log_dict
+from services.hll import STANDARD_ERROR
+from services.rollup import (approx_rows, hourly_counts, outcome_totals,
+                             rows_since)
+from services.uniques import unique_counts
 
 router = APIRouter(tags=["logs"])
 
+OUTCOMES = ["allow", "block", "limit", "ratelimit", "redirect", "flagged"]
+DETECTION_OUTCOMES = ("block", "limit", "ratelimit", "redirect", "flagged")
+
+
+def outcome_stats(totals) -> dict:
+    total = int(sum(totals.values()))
+    stats = {outcome: int(totals.get(outcome, 0)) for outcome in OUTCOMES}
+    stats["other"] = total - sum(stats.values())
+    stats["total"] = total
+    return stats
+
 def get_cutoff_from_range(range_str: str) -> datetime:
     now = datetime.utcnow()
     if range_str == "24h":
@@ -28,52 +53,187 @@ def get_cutoff_from_range(range_str: str) -> datetime:
         return now - timedelta(hours=24)  # default to 24h
 
 
+def encode_cursor(ts: datetime, log_id: str) -> str:
+    raw = f"{ts.isoformat()}|{log_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        ts, log_id = raw.decode().split("|", 1)
+        return datetime.fromisoformat(ts), log_id
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
 @router.get("/")
 def list_logs(
+    response: Response,
     range: str = Query("24h", description="Time range for logs"),
-    page: int = 1,
-    limit: int = 1000,
+    page: int = Query(None, ge=1, description="Paginación por OFFSET (compatibilidad)"),
+    limit: int = Query(1000, ge=1, le=10000),
+    cursor: str = Query(None, description="X-Next-Cursor de la página anterior"),
+    with_total: bool = Query(False, description="X-Total-Approx desde access_log_hourly"),
     current_user=Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
+    """
+    Logs del tenant, del más reciente al más antiguo. Sin cursor ni page
+    devuelve la primera página; X-Next-Cursor trae el cursor de la
+    siguiente (keyset sobre (timestamp, id), sin OFFSET) y falta en la
+    última. page sigue funcionando como antes, sin COUNT.
+    """
     cutoff = get_cutoff_from_range(range)
     
     # Build query with cutoff
     query = db.query(AccessLog).filter(
         AccessLog.tenant_id == current_user.id,
         AccessLog.timestamp >= cutoff
-    ).order_by(AccessLog.timestamp.desc())
-    
-    offset = (page - 1) * limit
-    total = query.count()
-    raw = query.offset(offset).limit(limit).all()
+    ).order_by(AccessLog.timestamp.desc(), AccessLog.id.desc())
+
+    if cursor:
+        ts, log_id = decode_cursor(cursor)
+        query = query.filter(
+            tuple_(AccessLog.timestamp, AccessLog.id) < tuple_(ts, log_id))
+    elif page:
+        query = query.offset((page - 1) * limit)
+
+    # Una fila de más indica si hay página siguiente
+    raw = query.limit(limit + 1).all()
+    if len(raw) > limit:
+        raw = raw[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor(raw[-1].timestamp,
+                                                          raw[-1].id)
+    if with_total:
+        response.headers["X-Total-Approx"] = str(
+            approx_rows(db, cutoff, current_user.id))
     
-    # Return only the logs within the cutoff
-    return [{
-        "id": r.id,
-        "timestamp": r.timestamp,
-        "ip_address": r.ip_address,
-        "user_agent": r.user_agent,
-        "referrer": r.referrer,
-        "accept_language": r.accept_language,
-        "sec_ch_ua": r.sec_ch_ua,
-        "sec_ch_ua_mobile": r.sec_ch_ua_mobile,
-        "sec_ch_ua_platform": r.sec_ch_ua_platform,
-        "utm_source": r.utm_source,
-        "fingerprint": r.fingerprint,
-        "path": r.path,
-        "outcome": r.outcome,
-        "rule": r.rule,
-        "redirect_url": r.redirect_url,
-        "js_executed": r.js_executed,
-    } for r in raw]
+    return [log_dict(r) for r in raw]
+
+
+# Columnas de la exportación, en este orden también en el CSV
+EXPORT_COLUMNS = ("id", "timestamp", "ip_address", "country_code", "user_agent",
+                  "referrer", "accept_language", "path", "outcome", "rule",
+                  "redirect_url", "crawler_family", "crawler_category",
+                  "agent_family", "agent_version", "is_crawler", "fingerprint",
+                  "js_executed", "sample_weight")
+EXPORT_CHUNK = 64 * 1024  # bytes sin comprimir por trozo enviado
+EXPORT_YIELD_PER = 2000
+
+
+def _export_lines(tenant: str, cutoff: datetime, fmt: str):
+    """Líneas de la exportación leídas con un cursor de servidor."""
+    columns = [getattr(AccessLog, c) for c in EXPORT_COLUMNS]
+    stmt = select(*columns).where(
+        AccessLog.tenant_id == tenant,
+        AccessLog.timestamp >= cutoff).order_by(AccessLog.timestamp,
+                                                AccessLog.id)
+    if fmt == "csv":
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        writer.writerow(EXPORT_COLUMNS)
+    # Conexión propia: la sesión de get_db se cierra antes de acabar el stream
+    with engine.connect() as conn:
+        result = conn.execution_options(yield_per=EXPORT_YIELD_PER).execute(stmt)
+        for row in result:
+            if fmt == "csv":
+                writer.writerow(row)
+                yield buf.getvalue()
+                buf.seek(0)
+                buf.truncate()
+            else:
+                record = dict(zip(EXPORT_COLUMNS, row))
+                record["timestamp"] = record["timestamp"].isoformat()
+                yield json.dumps(record, ensure_ascii=False) + "\n"
+
+
+def _export_chunks(lines, compress: bool):
+    """Agrupa las líneas en trozos de ~EXPORT_CHUNK y, si se pide, en gzip."""
+    gz = zlib.compressobj(wbits=31) if compress else None
+    pending, size = [], 0
+    for line in lines:
+        pending.append(line)
+        size += len(line)
+        if size >= EXPORT_CHUNK:
+            data = "".join(pending).encode()
+            pending, size = [], 0
+            data = gz.compress(data) if gz else data
+            if data:
+                yield data
+    data = "".join(pending).encode()
+    if gz:
+        data = gz.compress(data) + gz.flush()
+    if data:
+        yield data
+
+
+@router.get("/export")
+def export_logs(
+    range: str = Query("24h", description="Time range for the export"),
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    gzip: bool = False,
+    current_user=Depends(get_current_user)
+):
+    """
+    Logs del tenant en NDJSON o CSV, del más antiguo al más reciente. Se
+    envían en streaming desde un cursor de servidor, así que la memoria no
+    depende del rango.
+    """
+    cutoff = get_cutoff_from_range(range)
+    filename = f"logs-{range}.{format}" + (".gz" if gzip else "")
+    media_type = ("application/gzip" if gzip else
+                  "text/csv" if format == "csv" else "application/x-ndjson")
+    return StreamingResponse(
+        _export_chunks(_export_lines(current_user.id, cutoff, format), gzip),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+
+@router.get("/live")
+async def live_logs(request: Request, current_user=Depends(get_current_user)):
+    """
+    Logs nuevos del tenant por Server-Sent Events (event: log, un log por
+    evento con los campos de /rest/logs). event: overflow avisa de que el
+    cliente se ha quedado atrás y se cierra el stream; EventSource vuelve
+    a conectar solo.
+    """
+    sub = live_hub.subscribe(current_user.id)
+    if sub is None:
+        raise HTTPException(status_code=429, detail="Too many live connections")
+
+    async def stream():
+        try:
+            yield "retry: 3000\n\n"
+            while not await request.is_disconnected():
+                events = await sub.next(settings.LIVE_KEEPALIVE)
+                if sub.overflow:
+                    yield "event: overflow\ndata: {}\n\n"
+                    return
+                if not events:
+                    yield ": keepalive\n\n"
+                    continue
+                yield "".join(
+                    f"id: {e['id']}\nevent: log\n"
+                    f"data: {json.dumps(jsonable_encoder(e))}\n\n"
+                    for e in events)
+        finally:
+            live_hub.unsubscribe(sub)
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache",
+                                      "X-Accel-Buffering": "no"})
 
 
 @router.post("/mark-seen")
 def mark_logs_as_seen(db: Session = Depends(get_db),
                       user=Depends(get_current_user)):
-    db.query(AccessLog).filter_by(tenant_id=user.id,
-                                  seen=False).update({"seen": True})
+    # Solo se mueve la marca del tenant; las filas no se tocan
+    watermark = db.get(LogSeenWatermark, user.id)
+    if watermark is None:
+        db.add(LogSeenWatermark(tenant_id=user.id, seen_at=datetime.utcnow()))
+    else:
+        watermark.seen_at = datetime.utcnow()
     db.commit()
     return {"status": "ok"}
 
@@ -81,9 +241,9 @@ def mark_logs_as_seen(db: Session = Depends(get_db),
 @router.get("/unseen")
 def unseen_logs_count(db: Session = Depends(get_db),
                       user=Depends(get_current_user)):
-    count = db.query(AccessLog).filter_by(tenant_id=user.id,
-                                          seen=False).count()
-    return {"unseen": count}
+    watermark = db.get(LogSeenWatermark, user.id)
+    return {"unseen": rows_since(db, user.id,
+                                 watermark.seen_at if watermark else None)}
 
 
 @router.get("/stats")
@@ -93,16 +253,8 @@ def get_firewall_stats(
 ):
     cutoff = get_cutoff_from_range(range) if range else datetime.utcnow() - timedelta(hours=24)
     
-    query = db.query(AccessLog).filter(AccessLog.timestamp >= cutoff)
-    
-    total = query.count()
-    stats = {}
-    for outcome in ["allow", "block", "limit", "ratelimit", "redirect", "flagged"]:
-        count = query.filter(AccessLog.outcome == outcome).count()
-        stats[outcome] = count
-    stats["other"] = total - sum(stats.values())
-    stats["total"] = total
-    return stats
+    # access_log_hourly (services/rollup.py) en lugar de recorrer access_log
+    return outcome_stats(outcome_totals(hourly_counts(db, cutoff)))
 
 @router.get("/stats/user")
 def get_user_firewall_stats(
@@ -112,19 +264,27 @@ def get_user_firewall_stats(
 ):
     cutoff = get_cutoff_from_range(range) if range else datetime.utcnow() - timedelta(hours=24)
     
-    query = db.query(AccessLog).filter(
-        AccessLog.tenant_id == current_user.id,
-        AccessLog.timestamp >= cutoff
-    )
-    
-    total = query.count()
-    stats = {}
-    for outcome in ["allow", "block", "limit", "ratelimit", "redirect", "flagged"]:
-        count = query.filter(AccessLog.outcome == outcome).count()
-        stats[outcome] = count
-    stats["other"] = total - sum(stats.values())
-    stats["total"] = total
-    return stats
+    counts = hourly_counts(db, cutoff, tenant=current_user.id)
+    return outcome_stats(outcome_totals(counts))
+
+@router.get("/uniques")
+def unique_visitors(
+    range: str = Query("24h", description="Time range for unique counts"),
+    current_user=Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    IPs y fingerprints distintos aproximados (HyperLogLog, services/uniques.py).
+    Se cuentan días completos: desde el día de inicio del rango hasta hoy.
+    """
+    since = get_cutoff_from_range(range).date()
+    counts = unique_counts(db, current_user.id, since)
+    return {
+        "since": since,
+        "uniqueIps": counts["ip"],
+        "uniqueFingerprints": counts["fingerprint"],
+        "standardError": round(STANDARD_ERROR, 4)
+    }
 
 @router.get("/insights")
 def risk_insights(
@@ -134,12 +294,12 @@ def risk_insights(
 ):
     cutoff = get_cutoff_from_range(range)
     
+    # Una sola lectura de access_log_hourly por (outcome, agent_family)
+    counts = hourly_counts(db, cutoff, tenant=current_user.id)
+    totals = outcome_totals(counts)
+
     # Detections in selected range
-    detections = db.query(func.count(AccessLog.id)).filter(
-        AccessLog.tenant_id == current_user.id, 
-        AccessLog.timestamp >= cutoff,
-        AccessLog.outcome.in_(["block", "limit", "ratelimit", "redirect", "flagged"])
-    ).scalar()
+    detections = sum(totals[o] for o in DETECTION_OUTCOMES)
 
     # Risk level based on detections
     risk_level = "low"
@@ -149,28 +309,18 @@ def risk_insights(
         risk_level = "medium"
 
     # Stats for selected range
-    stats = db.query(
-        func.count(AccessLog.id).label("total"),
-        func.sum(case((AccessLog.outcome == "block", 1), else_=0)).label("blocked"),
-        func.sum(case((AccessLog.outcome == "limit", 1), else_=0)).label("limited"),
-        func.sum(case((AccessLog.outcome == "allow", 1), else_=0)).label("allowed")
-    ).filter(
-        AccessLog.tenant_id == current_user.id,
-        AccessLog.timestamp >= cutoff
-    ).first()
-
-    # Get logs for bot types
-    logs = db.query(AccessLog.user_agent).filter(
-        AccessLog.tenant_id == current_user.id, 
-        AccessLog.timestamp >= cutoff,
-        AccessLog.outcome.in_(["block", "limit", "ratelimit", "redirect", "flagged"])
-    ).all()
+    stats = {
+        "total": sum(totals.values()),
+        "blocked": totals["block"],
+        "limited": totals["limit"],
+        "allowed": totals["allow"]
+    }
 
-    # Process bot types
+    # Bot types: familia del crawler o primer token del UA
     bot_counts = {}
-    for log in logs:
-        bot_type = log.user_agent.split('/')[0].split(' ')[0] if log.user_agent else "Unknown"
-        bot_counts[bot_type] = bot_counts.get(bot_type, 0) + 1
+    for (outcome, family), hits in counts.items():
+        if outcome in DETECTION_OUTCOMES:
+            bot_counts[family] = bot_counts.get(family, 0) + hits
 
     sorted_bots = sorted(bot_counts.items(), key=lambda x: x[1], reverse=True)[:10]
     by_bot_type = [{"botType": bot[0], "count": bot[1]} for bot in sorted_bots]
@@ -182,12 +332,7 @@ def risk_insights(
         # New structure
         "detections": detections,
         "riskLevel": risk_level,
-        "stats": {
-            "total": stats.total or 0,
-            "blocked": stats.blocked or 0,
-            "limited": stats.limited or 0,
-            "allowed": stats.allowed or 0
-        },
+        "stats": stats,
         "byBotType": by_bot_type,
         "protectionLevel": protection_level,
         
@@ -197,138 +342,21 @@ def risk_insights(
             "riskLevel": risk_level
         },
         "last7days": {
-            "totalDetected": stats.total or 0,
-            "blocked": stats.blocked or 0,
-            "limited": stats.limited or 0,
-            "allowed": stats.allowed or 0
+            "totalDetected": stats["total"],
+            "blocked": stats["blocked"],
+            "limited": stats["limited"],
+            "allowed": stats["allowed"]
         }
     }
 
 @router.get("/advanced-insights", response_model=AdvancedInsightsOut)
-def advanced_insights(current_user=Depends(get_current_user),
+def advanced_insights(range: str = Query("24h", description="Time range for insights"),
+                      current_user=Depends(get_current_user),
                       db: Session = Depends(get_db)):
-    tenant = current_user.id
-
-    # 1. Traffic by Agent Type
-    agent_buckets = {
-        "AI Agent": ["AgentGPT", "OpenAI"],
-        "AI Assistant": ["Siri", "Alexa"],
-        "AI Data Scraper": ["Scrapy", "Octoparse"],
-        "Uncategorized": []
-    }
-    traffic_by_agent = []
-    for label, patterns in agent_buckets.items():
-        if patterns:
-            count = db.query(func.count(AccessLog.id)).filter(
-                AccessLog.tenant_id == tenant,
-                *[AccessLog.user_agent.ilike(f"%{pat}%")
-                  for pat in patterns]).scalar()
-        else:
-            count = 0
-        traffic_by_agent.append({"key": label, "count": count})
-
-    total_hits = db.query(func.count(
-        AccessLog.id)).filter(AccessLog.tenant_id == tenant).scalar()
-    known = sum(item["count"] for item in traffic_by_agent)
-    traffic_by_agent.append({
-        "key": "Uncategorized",
-        "count": total_hits - known
-    })
-
-    # 2. Top referred pages
-    top_referrals = db.query(
-        AccessLog.referrer.label("key"),
-        func.count(AccessLog.id).label("count")).filter(
-            AccessLog.tenant_id == tenant, AccessLog.referrer
-            != None).group_by(AccessLog.referrer).order_by(
-                func.count(AccessLog.id).desc()).limit(10).all()
-    top_referrals = [{"key": r.key, "count": r.count} for r in top_referrals]
-
-    # 3. Traffic by LLM referrer
-    traffic_by_llm = db.query(
-        AccessLog.referrer.label("key"),
-        func.count(AccessLog.id).label("count")).filter(
-            AccessLog.tenant_id == tenant,
-            AccessLog.referrer.ilike("%llm=%")).group_by(
-                AccessLog.referrer).order_by(func.count(
-                    AccessLog.id).desc()).limit(10).all()
-    traffic_by_llm = [{"key": r.key, "count": r.count} for r in traffic_by_llm]
-
-    # 4. Time spent browsing por agente
-    times = db.query(
-        AccessLog.user_agent.label("key"),
-        func.avg(
-            func.extract(
-                "epoch", AccessLog.exit_timestamp -
-                AccessLog.timestamp)).label("count")).filter(
-                    AccessLog.tenant_id == tenant, AccessLog.exit_timestamp
-                    != None).group_by(AccessLog.user_agent).order_by(
-                        func.avg(
-                            func.extract(
-                                "epoch", AccessLog.exit_timestamp -
-                                AccessLog.timestamp)).desc()).limit(10).all()
-    by_time = [{"key": t.key, "count": round(t.count or 0)} for t in times]
-
-    # 5. Most Active Agents (compatibilidad con varios dialectos)
-    ua_coalesce = func.coalesce(AccessLog.user_agent, "")
-    ua_with_slash = ua_coalesce + "/"
-
-    # Detectamos el dialecto
-    dialect_name = db.bind.dialect.name  # 'postgresql', 'sqlite', 'mysql', etc.
-
-    if dialect_name == "postgresql":
-        # en Postgres: strpos(column, substr) devuelve la posición (1-based)
-        pos_fn = func.strpos(ua_with_slash, "/")
-    else:
-        # SQLite y MySQL disponen de instr()
-        pos_fn = func.instr(ua_with_slash, "/")
-
-    # substr(col, start, length)
-    agent_expr = func.substr(ua_coalesce, 1, pos_fn - 1).label("agent")
-
-    most_active = (db.query(
-        agent_expr,
-        func.count(AccessLog.id).label("count")).filter(
-            AccessLog.tenant_id == tenant).group_by("agent").order_by(
-                func.count(AccessLog.id).desc()).limit(10).all())
-
-    most_active_agents = [{
-        "key": row.agent or "Unknown",
-        "count": row.count
-    } for row in most_active]
-    if not most_active_agents:
-        most_active_agents = [{"key": "Unknown", "count": 0}]
-
-    # 6. Top Originating Countries
-    top_countries = db.query(
-        AccessLog.country_code,
-        func.count(AccessLog.id).label("count")).filter(
-            AccessLog.tenant_id == tenant).group_by(
-                AccessLog.country_code).order_by(
-                    func.count(AccessLog.id).desc()).limit(10).all()
-    top_countries_list = [{
-        "key": c.country_code or "??",
-        "count": c.count
-    } for c in top_countries]
-
-    # 7. Referral Click Rate
-    total_impressions = total_hits or 0
-    total_clicks = db.query(func.count(AccessLog.id)).filter(
-        AccessLog.tenant_id == tenant, AccessLog.referral
-        == True).scalar() or 0
-    ctr = (total_clicks / total_impressions *
-           100) if total_impressions else 0.0
-
-    return {
-        "trafficByAgentType": traffic_by_agent,
-        "mostActiveAgents": most_active_agents,
-        "topOriginatingCountries": top_countries_list,
-        "referralClickRate": {
-            "clicks": total_clicks,
-            "impressions": total_impressions,
-            "rate": round(ctr, 2)
-        },
-        "topReferredPages": top_referrals,
-        "trafficByLLMReferrer": traffic_by_llm,
-        "timeSpentByAgent": by_time,
-    }
\ No newline at end of file
+    """
+    Paneles de insights sobre el rango pedido: una sola pasada por
+    access_log, cacheada por tenant y refrescada de forma incremental
+    (services/insights.py).
+    """
+    return insights_cache.get(db, current_user.id, range,
+                              get_cutoff_from_range(range))
@@ -16,6 +16,7 @@ from db import get_db
 from models.models import User, AccessLog
 from datetime import datetime, timedelta
 from utils import send_email
+from services.rollup import hourly_counts, outcome_totals
 from jinja2 import Environment, FileSystemLoader
 from models.models import User, AccessLog, Subscription
 
@@ -155,20 +156,20 @@ def send_weekly_report(db: Session = Depends(get_db),
 
     # Calcula actividad semanal
     one_week_ago = datetime.utcnow() - timedelta(days=7)
-    logs = db.query(AccessLog).filter(AccessLog.tenant_id == current_user.id,
-                                      AccessLog.timestamp
-                                      >= one_week_ago).all()
+    totals = outcome_totals(
+        hourly_counts(db, one_week_ago, tenant=current_user.id))
 
+    total = sum(totals.values())
     stats = {
         "total":
-        len(logs),
+        total,
         "blocked":
-        sum(1 for l in logs if l.outcome == "block"),
+        totals["block"],
         "limited":
-        sum(1 for l in logs if l.outcome == "limit"),
+        totals["limit"],
         "approaching_limit":
         (current_user.subscription
-         and len(logs) > current_user.subscription.traffic_limit * 0.8)
+         and total > current_user.subscription.traffic_limit * 0.8)
     }
 
     template = env.get_template("weekly_summary.html")
@@ -1,7 +1,7 @@
 # backend/schemas.py
 from typing import List, Optional
 from models.models import PaymentProvider
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field
 from datetime import datetime
 from enum import Enum
 
@@ -67,6 +67,7 @@ class SubscriptionPlanOut(BaseModel):
     price: int
     active: bool
     description: Optional[str]  # nuevo campo
+    allow_sample_rate: int = Field(1, ge=1)
 
     class Config:
         orm_mode = True
@@ -79,6 +80,7 @@ class SubscriptionPlanUpdate(BaseModel):
     price: Optional[int]
     active: Optional[bool]
     description: Optional[str]  # nuevo campo
+    allow_sample_rate: Optional[int] = Field(None, ge=1)  # 1 de cada N "allow"
 
     active: Optional[bool]
 
@@ -0,0 +1,108 @@
+# backend/services/agents.py
+import re
+from functools import lru_cache
+from typing import NamedTuple, Optional
+
+from sqlalchemy import bindparam, select, update
+
+from db import engine
+from models.models import AccessLog
+
+# Navegadores, en orden: Edge y Opera también dicen "Chrome/", y casi todos
+# "Safari/"
+_BROWSERS = [
+    ("Edge", re.compile(r"Edg(?:e|A|iOS)?/([\d.]+)")),
+    ("Opera", re.compile(r"(?:OPR|Opera)/([\d.]+)")),
+    ("Samsung Internet", re.compile(r"SamsungBrowser/([\d.]+)")),
+    ("Firefox", re.compile(r"(?:Firefox|FxiOS)/([\d.]+)")),
+    ("Chrome", re.compile(r"(?:Chrome|CriOS)/([\d.]+)")),
+    ("Safari", re.compile(r"Version/([\d.]+).*Safari/")),
+    ("Internet Explorer", re.compile(r"(?:MSIE |Trident/.*rv:)([\d.]+)")),
+]
+_TOKEN = re.compile(r"\s*([^/\s;()]+)(?:/([^\s;()]+))?")
+# Bots que se anuncian como "Mozilla/5.0 (compatible; Nombre/1.0; ...)"
+_COMPATIBLE = re.compile(r"\(compatible;\s*([^/\s;()]+)(?:/([^\s;()]+))?")
+_VERSION = re.compile(r"v?(\d[\w.\-]*)")
+
+FAMILY_MAX = 64
+VERSION_MAX = 32
+
+
+class AgentInfo(NamedTuple):
+    family: str
+    version: Optional[str]
+    is_crawler: bool
+
+
+def _crawler_version(ua: str, family: str) -> Optional[str]:
+    i = ua.find(family)
+    if i < 0:
+        return None
+    m = _VERSION.match(ua, i + len(family) + 1)
+    return m.group(1)[:VERSION_MAX] if m else None
+
+
+@lru_cache(maxsize=8192)
+def parse_agent(ua: Optional[str], crawler_family: Optional[str] = None) -> AgentInfo:
+    """
+    Familia y versión normalizadas de un UA. Si services/crawlers.py lo ha
+    reconocido, la familia es la del crawler; si es un navegador, el nombre
+    del navegador; si no, el primer producto del UA ("curl/8.4" -> curl).
+    """
+    if crawler_family:
+        return AgentInfo(crawler_family[:FAMILY_MAX],
+                         _crawler_version(ua or "", crawler_family), True)
+    if not ua:
+        return AgentInfo("Unknown", None, False)
+    if ua.startswith("Mozilla/"):
+        for family, rx in _BROWSERS:
+            m = rx.search(ua)
+            if m:
+                return AgentInfo(family, m.group(1)[:VERSION_MAX], False)
+        m = _COMPATIBLE.search(ua)
+        if m:
+            return AgentInfo(m.group(1)[:FAMILY_MAX],
+                             (m.group(2) or None) and m.group(2)[:VERSION_MAX],
+                             False)
+    m = _TOKEN.match(ua)
+    if not m or not m.group(1):
+        return AgentInfo("Unknown", None, False)
+    return AgentInfo(m.group(1)[:FAMILY_MAX],
+                     (m.group(2) or None) and m.group(2)[:VERSION_MAX], False)
+
+
+def enrich_agents(rows: list):
+    """
+    Enricher de services/ingest.py; va después del de crawlers porque usa
+    crawler_family.
+    """
+    for row in rows:
+        info = parse_agent(row.get("user_agent"), row.get("crawler_family"))
+        row["agent_family"] = info.family
+        row["agent_version"] = info.version
+        row["is_crawler"] = info.is_crawler
+
+
+def backfill(batch: int = 5000) -> int:
+    """Rellena agent_* en las filas anteriores a estas columnas."""
+    stmt = update(AccessLog).where(AccessLog.id == bindparam("_id")).values(
+        agent_family=bindparam("agent_family"),
+        agent_version=bindparam("agent_version"),
+        is_crawler=bindparam("is_crawler"))
+    done = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(
+                select(AccessLog.id, AccessLog.user_agent,
+                       AccessLog.crawler_family).where(
+                           AccessLog.agent_family.is_(None)).limit(batch)).all()
+            if not rows:
+                return done
+            values = []
+            for log_id, ua, crawler_family in rows:
+                info = parse_agent(ua, crawler_family)
+                values.append({"_id": log_id, "agent_family": info.family,
+                               "agent_version": info.version,
+                               "is_crawler": info.is_crawler})
+            conn.execute(stmt, values)
+        done += len(rows)
@@ -0,0 +1,168 @@
+# backend/services/crawlers.py
+import json
+import os
+import re
+import threading
+import time
+from typing import NamedTuple, Optional
+
+from config import settings
+from services.matcher import PatternSet
+
+# Categorías con las que el dashboard agrupa el tráfico (advanced_insights)
+AI_AGENT = "AI Agent"
+AI_ASSISTANT = "AI Assistant"
+AI_DATA_SCRAPER = "AI Data Scraper"
+AI_SEARCH_CRAWLER = "AI Search Crawler"
+SEARCH_ENGINE_CRAWLER = "Search Engine Crawler"
+CRAWLER = "Crawler"
+
+CATEGORIES = (AI_AGENT, AI_ASSISTANT, AI_DATA_SCRAPER, AI_SEARCH_CRAWLER,
+              SEARCH_ENGINE_CRAWLER, CRAWLER)
+
+# Agentes de IA conocidos: se evalúan antes que crawler-user-agents.json,
+# que no los distingue del resto de crawlers. (patrón, familia, categoría)
+AI_AGENTS = [
+    (r"ChatGPT-User", "ChatGPT-User", AI_ASSISTANT),
+    (r"Perplexity-User", "Perplexity-User", AI_ASSISTANT),
+    (r"Claude-User", "Claude-User", AI_ASSISTANT),
+    (r"Claude-Web", "Claude-Web", AI_ASSISTANT),
+    (r"MistralAI-User", "MistralAI-User", AI_ASSISTANT),
+    (r"DuckAssistBot", "DuckAssistBot", AI_ASSISTANT),
+    (r"Meta-ExternalFetcher", "Meta-ExternalFetcher", AI_ASSISTANT),
+    (r"Siri", "Siri", AI_ASSISTANT),
+    (r"Alexa", "Alexa", AI_ASSISTANT),
+    (r"OAI-SearchBot", "OAI-SearchBot", AI_SEARCH_CRAWLER),
+    (r"Claude-SearchBot", "Claude-SearchBot", AI_SEARCH_CRAWLER),
+    (r"PerplexityBot", "PerplexityBot", AI_SEARCH_CRAWLER),
+    (r"GPTBot", "GPTBot", AI_DATA_SCRAPER),
+    (r"ClaudeBot", "ClaudeBot", AI_DATA_SCRAPER),
+    (r"anthropic-ai", "anthropic-ai", AI_DATA_SCRAPER),
+    (r"CCBot", "CCBot", AI_DATA_SCRAPER),
+    (r"Bytespider", "Bytespider", AI_DATA_SCRAPER),
+    (r"Google-Extended", "Google-Extended", AI_DATA_SCRAPER),
+    (r"Applebot-Extended", "Applebot-Extended", AI_DATA_SCRAPER),
+    (r"meta-externalagent", "meta-externalagent", AI_DATA_SCRAPER),
+    (r"cohere-ai|cohere-training-data-crawler", "cohere-ai", AI_DATA_SCRAPER),
+    (r"Diffbot", "Diffbot", AI_DATA_SCRAPER),
+    (r"Omgilibot|omgili", "Omgilibot", AI_DATA_SCRAPER),
+    (r"Timpibot", "Timpibot", AI_DATA_SCRAPER),
+    (r"ImagesiftBot", "ImagesiftBot", AI_DATA_SCRAPER),
+    (r"Scrapy", "Scrapy", AI_DATA_SCRAPER),
+    (r"Octoparse", "Octoparse", AI_DATA_SCRAPER),
+    (r"AgentGPT", "AgentGPT", AI_AGENT),
+    (r"OpenAI", "OpenAI", AI_AGENT),
+]
+
+# Familias del JSON que son buscadores
+_SEARCH_ENGINES = re.compile(
+    r"Googlebot|bingbot|Baiduspider|YandexBot|DuckDuckBot|Slurp|Applebot|"
+    r"Sogou|Exabot|SeznamBot|Qwantify|PetalBot|YisouSpider|naver|Yeti",
+    re.IGNORECASE)
+
+
+class CrawlerInfo(NamedTuple):
+    family: str
+    category: str
+
+
+def _family_from_entry(entry: dict, rx) -> str:
+    # Texto que casa en el primer ejemplo del JSON: "Googlebot\/" -> "Googlebot"
+    for instance in entry.get("instances", []):
+        m = rx.search(instance)
+        if m and m.group(0).strip(" /;()"):
+            return m.group(0).strip(" /;()")[:64]
+    return re.sub(r"[\\^$()\[\]|?*+]", "", entry["pattern"]).strip(" /")[:64]
+
+
+class _Index:
+    def __init__(self, entries: list):
+        infos, patterns = [], []
+        for pattern, family, category in AI_AGENTS:
+            patterns.append(pattern)
+            infos.append(CrawlerInfo(family, category))
+        for entry in entries:
+            patterns.append(entry["pattern"])
+            infos.append(None)
+        self.patterns = PatternSet(patterns)
+        # Las familias del JSON se calculan con las regex ya compiladas
+        for i, entry in enumerate(entries, start=len(AI_AGENTS)):
+            family = _family_from_entry(entry, self.patterns.compiled(i))
+            category = (SEARCH_ENGINE_CRAWLER
+                        if _SEARCH_ENGINES.search(family) else CRAWLER)
+            infos[i] = CrawlerInfo(family, category)
+        self.infos = infos
+
+
+class CrawlerClassifier:
+    """
+    Clasificador de User-Agents compilado a partir de crawler-user-agents.json
+    más la lista AI_AGENTS. classify() devuelve la familia y la categoría del
+    crawler, o None si el UA no es de ningún crawler conocido.
+
+    El índice se reconstruye en caliente si el fichero cambia
+    (reload_if_changed, como mucho cada reload_interval segundos).
+    """
+
+    def __init__(self, path: str, reload_interval: float):
+        self.path = path
+        self.reload_interval = reload_interval
+        self._mtime = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self._index = _Index([])
+        self.reload()
+
+    def _file_mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def reload(self):
+        mtime = self._file_mtime()
+        entries = []
+        if mtime is not None:
+            try:
+                with open(self.path) as f:
+                    entries = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"No se pudo leer {self.path}: {e}")
+                return
+        else:
+            print(f"No existe {self.path}: solo se clasifican los agentes de IA")
+        index = _Index(entries)
+        with self._lock:
+            self._index = index
+            self._mtime = mtime
+
+    def reload_if_changed(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.reload_interval:
+            return
+        self._checked_at = now
+        if self._file_mtime() != self._mtime:
+            self.reload()
+
+    def __len__(self):
+        return len(self._index.infos)
+
+    def classify(self, ua: str) -> Optional[CrawlerInfo]:
+        if not ua:
+            return None
+        index = self._index
+        i = index.patterns.first(ua)
+        return None if i is None else index.infos[i]
+
+    def enrich(self, rows: list):
+        """Enricher de services/ingest.py: etiqueta las filas de un lote."""
+        self.reload_if_changed()
+        for row in rows:
+            info = self.classify(row.get("user_agent") or "")
+            row["crawler_family"] = info.family if info else None
+            row["crawler_category"] = info.category if info else None
+
+
+crawler_classifier = CrawlerClassifier(
+    path=settings.CRAWLERS_FILE,
+    reload_interval=settings.CRAWLERS_RELOAD_INTERVAL)
@@ -0,0 +1,222 @@
+# backend/services/geoip.py
+import bisect
+import csv
+import ipaddress
+import os
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import Optional
+
+from config import settings
+from services.ip_ranges import parse_ip
+
+_MISSING = object()
+
+
+class _MaxMindReader:
+    """GeoLite2/GeoIP2 (.mmdb) con maxminddb en modo mmap."""
+
+    def __init__(self, path: str):
+        import maxminddb  # opcional: solo hace falta con una base .mmdb
+        self._db = maxminddb.open_database(path, maxminddb.MODE_MMAP)
+
+    def country(self, ip: str) -> Optional[str]:
+        try:
+            record = self._db.get(ip)
+        except ValueError:
+            return None
+        if not record:
+            return None
+        for key in ("country", "registered_country"):
+            code = (record.get(key) or {}).get("iso_code")
+            if code:
+                return code
+        return None
+
+    def close(self):
+        self._db.close()
+
+
+class _CSVReader:
+    """
+    Rangos "inicio,fin,país" (IPs o enteros, formato de db-ip/IP2Location) o
+    "red/prefijo,país", cargados en arrays ordenados y buscados con bisect.
+    """
+
+    def __init__(self, path: str):
+        ranges = {4: [], 6: []}
+        with open(path, newline="", encoding="utf-8") as f:
+            for row in csv.reader(f):
+                parsed = self._parse_row(row)
+                if parsed:
+                    version, start, end, code = parsed
+                    ranges[version].append((start, end, code))
+        self._tables = {}
+        for version, rows in ranges.items():
+            rows.sort()
+            # IPv4 cabe en enteros sin signo de 32 bits; IPv6 necesita int
+            typecode = "L" if version == 4 else None
+            starts = [r[0] for r in rows]
+            ends = [r[1] for r in rows]
+            self._tables[version] = (
+                array(typecode, starts) if typecode else starts,
+                array(typecode, ends) if typecode else ends,
+                [r[2] for r in rows],
+            )
+
+    @staticmethod
+    def _address(value: str):
+        value = value.strip()
+        if value.isdigit():
+            n = int(value)
+            return (4 if n < 1 << 32 else 6), n
+        return parse_ip(value)
+
+    def _parse_row(self, row):
+        if not row or row[0].startswith("#"):
+            return None
+        try:
+            if "/" in row[0] and len(row) >= 2:
+                net = ipaddress.ip_network(row[0].strip(), strict=False)
+                code = row[1]
+                version = net.version
+                start = int(net.network_address)
+                end = int(net.broadcast_address)
+            elif len(row) >= 3:
+                first, last = self._address(row[0]), self._address(row[1])
+                if first is None or last is None:
+                    return None
+                (version, start), (_, end), code = first, last, row[2]
+            else:
+                return None
+        except ValueError:
+            return None  # cabeceras y filas mal formadas
+        code = code.strip().upper()
+        if len(code) != 2 or code == "-" * 2 or code == "ZZ":
+            return None
+        return version, start, end, code
+
+    def country(self, ip: str) -> Optional[str]:
+        parsed = parse_ip(ip)
+        if parsed is None:
+            return None
+        version, n = parsed
+        starts, ends, codes = self._tables[version]
+        i = bisect.bisect_right(starts, n) - 1
+        if i >= 0 and n <= ends[i]:
+            return codes[i]
+        return None
+
+    def close(self):
+        pass
+
+
+def open_reader(path: str):
+    if path.endswith(".mmdb"):
+        return _MaxMindReader(path)
+    return _CSVReader(path)
+
+
+class GeoIPResolver:
+    """
+    País (ISO 3166-1 alfa-2) de una IP a partir de una base local: .mmdb de
+    MaxMind o CSV de rangos. Delante del lector hay una LRU por IP: el
+    tráfico de un tenant se concentra en pocas IPs y cada lote repite muchas.
+
+    enrich() es un enricher de services/ingest.py, así que la búsqueda se
+    hace al volcar el lote y no en la petición del pixel. Sin base (path
+    vacío o ilegible) las filas quedan con country_code a None.
+    La base se recarga si cambia el fichero (reload_if_changed).
+    """
+
+    def __init__(self, path: str, cache_size: int, reload_interval: float):
+        self.path = path
+        self.cache_size = cache_size
+        self.reload_interval = reload_interval
+        self._reader = None
+        self._mtime = None
+        self._checked_at = 0.0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.reload()
+
+    def _file_mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def reload(self):
+        if not self.path:
+            return
+        mtime = self._file_mtime()
+        if mtime is None:
+            print(f"No existe la base GeoIP {self.path}: sin country_code")
+            return
+        try:
+            reader = open_reader(self.path)
+        except Exception as e:
+            print(f"No se pudo abrir la base GeoIP {self.path}: {e}")
+            return
+        with self._lock:
+            old, self._reader = self._reader, reader
+            self._mtime = mtime
+            self._cache.clear()
+        if old is not None:
+            old.close()
+
+    def reload_if_changed(self):
+        if not self.path:
+            return
+        now = time.monotonic()
+        if now - self._checked_at < self.reload_interval:
+            return
+        self._checked_at = now
+        if self._file_mtime() != self._mtime:
+            self.reload()
+
+    def country(self, ip: str) -> Optional[str]:
+        if not ip or self._reader is None:
+            return None
+        with self._lock:
+            code = self._cache.get(ip, _MISSING)
+            if code is not _MISSING:
+                self._cache.move_to_end(ip)
+                self.hits += 1
+                return code
+            self.misses += 1
+            reader = self._reader
+        code = reader.country(ip)
+        with self._lock:
+            self._cache[ip] = code
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return code
+
+    def enrich(self, rows: list):
+        """Enricher de services/ingest.py: rellena country_code en el lote."""
+        self.reload_if_changed()
+        for row in rows:
+            if not row.get("country_code"):
+                row["country_code"] = self.country(row.get("ip_address"))
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "loaded": int(self._reader is not None),
+                "size": len(self._cache),
+                "capacity": self.cache_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+geoip_resolver = GeoIPResolver(path=settings.GEOIP_DB_PATH,
+                               cache_size=settings.GEOIP_CACHE_SIZE,
+                               reload_interval=settings.GEOIP_RELOAD_INTERVAL)
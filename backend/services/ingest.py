@@ -0,0 +1,237 @@
+# backend/services/ingest.py
+import queue
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from sqlalchemy import insert
+
+from config import settings
+from db import engine
+from models.models import AccessLog
+
+# Columnas que escribe el pixel; todas las filas de un lote llevan las mismas
+# claves para que el INSERT se ejecute como executemany.
+LOG_FIELDS = ("tenant_id", "ip_address", "user_agent", "fingerprint", "path",
+              "outcome", "rule", "redirect_url", "sample_weight")
+
+
+def build_log_row(**fields) -> dict:
+    row = {k: fields.get(k) for k in LOG_FIELDS}
+    # id y timestamp se fijan al recibir la petición, no al volcar el lote
+    row["id"] = str(uuid.uuid4())
+    row["timestamp"] = datetime.utcnow()
+    return row
+
+
+class AccessLogWriter:
+    """
+    Buffer write-behind de AccessLog.
+
+    submit() encola la fila y vuelve enseguida; un hilo de fondo la vuelca con
+    un INSERT masivo cuando el lote llega a batch_size o pasa flush_interval.
+    La cola es acotada: si está llena, submit espera como mucho put_timeout y
+    después descarta la fila (contabilizada en stats()). stop() vacía la cola
+    antes de salir. Sin start(), submit escribe de forma síncrona.
+
+    Un INSERT que falla (timeout de lock, error transitorio) se reintenta
+    hasta `retries` veces, esperando `backoff` segundos y el doble en cada
+    intento. Si sigue fallando, el lote se pierde: "failed" cuenta esas
+    filas y "dropped" todas las perdidas, también las de cola llena.
+
+    Los enrichers registrados con add_enricher() reciben cada lote antes del
+    INSERT, fuera del camino de la petición, y deben poner las mismas claves
+    en todas las filas. Los hooks de add_write_hook() reciben (conn, filas)
+    después del INSERT, en su propia transacción: si fallan, el lote ya
+    está guardado.
+    """
+
+    def __init__(self, batch_size: int, flush_interval: float, max_queue: int,
+                 put_timeout: float, retries: int = 3, backoff: float = 0.5):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._enrichers = []
+        self._write_hooks = []
+        self._stats = {
+            "enqueued": 0,
+            "written": 0,
+            "dropped": 0,
+            "blocked": 0,
+            "failed": 0,
+            "retried": 0,
+            "hook_failed": 0,
+            "flushes": 0,
+            "max_depth": 0,
+            "last_flush_rows": 0,
+            "last_flush_ms": 0.0,
+        }
+
+    def add_enricher(self, fn):
+        if fn not in self._enrichers:
+            self._enrichers.append(fn)
+
+    def add_write_hook(self, fn):
+        if fn not in self._write_hooks:
+            self._write_hooks.append(fn)
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name="access-log-writer",
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        if not self.running:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+        # Lo que quedase tras el join (p.ej. submit concurrente) se vuelca aquí
+        self._drain()
+
+    def submit(self, row: dict, wait: bool = True) -> bool:
+        """wait=False (rutas async) descarta en cuanto la cola está llena."""
+        if not self.running:
+            self._write([row])
+            return True
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self._incr("blocked")
+            if not wait:
+                self._incr("dropped")
+                return False
+            try:
+                self._queue.put(row, timeout=self.put_timeout)
+            except queue.Full:
+                self._incr("dropped")
+                return False
+        self._incr("enqueued")
+        depth = self._queue.qsize()
+        if depth > self._stats["max_depth"]:
+            self._stats["max_depth"] = depth
+        return True
+
+    def submit_many(self, rows: list, wait: bool = True) -> int:
+        """Encola varias filas; sin start() se escriben en un solo INSERT."""
+        if not rows:
+            return 0
+        if not self.running:
+            self._write(rows)
+            return len(rows)
+        return sum(1 for row in rows if self.submit(row, wait=wait))
+
+    def stats(self) -> dict:
+        with self._lock:
+            out = dict(self._stats)
+        out["depth"] = self._queue.qsize()
+        out["capacity"] = self._queue.maxsize
+        return out
+
+    def _incr(self, key: str, n: int = 1):
+        with self._lock:
+            self._stats[key] += n
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._collect()
+            if batch:
+                self._write(batch)
+        self._drain()
+
+    def _collect(self) -> list:
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self._stop.is_set():
+                break
+            try:
+                batch.append(self._queue.get(timeout=min(remaining, 0.25)))
+            except queue.Empty:
+                continue
+        return batch
+
+    def _drain(self):
+        while True:
+            batch = []
+            try:
+                while len(batch) < self.batch_size:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            if not batch:
+                return
+            self._write(batch)
+
+    def _insert(self, rows: list) -> bool:
+        delay = self.backoff
+        for attempt in range(self.retries + 1):
+            try:
+                # executemany; en Postgres SQLAlchemy lo agrupa en INSERT multi-VALUES
+                with engine.begin() as conn:
+                    conn.execute(insert(AccessLog), rows)
+                return True
+            except Exception as e:
+                if attempt == self.retries:
+                    print(f"Error al volcar {len(rows)} logs (sin más "
+                          f"reintentos, se pierden): {e}")
+                    return False
+                print(f"Error al volcar {len(rows)} logs, reintento en "
+                      f"{delay:g}s: {e}")
+                self._incr("retried")
+                time.sleep(delay)
+                delay *= 2
+
+    def _write(self, rows: list):
+        t0 = time.perf_counter()
+        try:
+            for enrich in self._enrichers:
+                enrich(rows)
+        except Exception as e:
+            print(f"Error al preparar {len(rows)} logs: {e}")
+            ok = False
+        else:
+            ok = self._insert(rows)
+        if not ok:
+            with self._lock:
+                self._stats["failed"] += len(rows)
+                self._stats["dropped"] += len(rows)
+            return
+        for hook in self._write_hooks:
+            try:
+                with engine.begin() as conn:
+                    hook(conn, rows)
+            except Exception as e:
+                print(f"Error en {getattr(hook, '__name__', hook)} tras volcar "
+                      f"{len(rows)} logs: {e}")
+                self._incr("hook_failed")
+        with self._lock:
+            self._stats["written"] += len(rows)
+            self._stats["flushes"] += 1
+            self._stats["last_flush_rows"] = len(rows)
+            self._stats["last_flush_ms"] = round(
+                (time.perf_counter() - t0) * 1000, 2)
+
+
+access_log_writer = AccessLogWriter(batch_size=settings.INGEST_BATCH_SIZE,
+                                    flush_interval=settings.INGEST_FLUSH_INTERVAL,
+                                    max_queue=settings.INGEST_QUEUE_MAX,
+                                    put_timeout=settings.INGEST_PUT_TIMEOUT,
+                                    retries=settings.INGEST_WRITE_RETRIES,
+                                    backoff=settings.INGEST_RETRY_BACKOFF)
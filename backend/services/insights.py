@@ -0,0 +1,212 @@
+# backend/services/insights.py
+import threading
+import time
+from collections import Counter, OrderedDict
+from datetime import datetime, timedelta
+
+from sqlalchemy import case, func
+
+from config import settings
+from models.models import AccessLog
+from services.crawlers import AI_AGENT, AI_ASSISTANT, AI_DATA_SCRAPER
+from services.rollup import truncate_hour
+
+HIT_WEIGHT = func.coalesce(AccessLog.sample_weight, 1)
+# extract(epoch) de cada extremo por separado: restar timestamps no es
+# portable entre Postgres y SQLite
+_EXITED = AccessLog.exit_timestamp != None
+_SECONDS = case((_EXITED, func.extract("epoch", AccessLog.exit_timestamp) -
+                 func.extract("epoch", AccessLog.timestamp)), else_=0)
+
+
+class InsightsAggregate:
+    """Sumas de /logs/advanced-insights sobre un tramo de access_log."""
+
+    __slots__ = ("categories", "agents", "countries", "referrers", "clicks",
+                 "seconds", "exits")
+
+    def __init__(self):
+        self.categories = Counter()
+        self.agents = Counter()
+        self.countries = Counter()
+        self.referrers = Counter()
+        self.clicks = 0
+        self.seconds = Counter()  # segundos en página por agente
+        self.exits = Counter()  # filas con exit_timestamp por agente
+
+    def merge(self, other: "InsightsAggregate", sign: int = 1):
+        for name in ("categories", "agents", "countries", "referrers",
+                     "seconds", "exits"):
+            mine = getattr(self, name)
+            for key, value in getattr(other, name).items():
+                mine[key] += sign * value
+                if sign < 0 and mine[key] <= 0:
+                    del mine[key]  # claves que ya no están en la ventana
+        self.clicks += sign * other.clicks
+
+    def copy(self) -> "InsightsAggregate":
+        out = InsightsAggregate()
+        out.merge(self)
+        return out
+
+
+def scan(db, tenant: str, start: datetime, end: datetime) -> InsightsAggregate:
+    """
+    Una sola pasada por las filas del tenant en [start, end): un GROUP BY
+    con todas las dimensiones del panel, que se reparte luego en memoria.
+    """
+    agg = InsightsAggregate()
+    if start >= end:
+        return agg
+    dims = (AccessLog.crawler_category, AccessLog.agent_family,
+            AccessLog.country_code, AccessLog.referrer, AccessLog.referral)
+    rows = db.query(*dims, func.sum(HIT_WEIGHT), func.sum(_SECONDS),
+                    func.count(AccessLog.exit_timestamp)).filter(
+                        AccessLog.tenant_id == tenant,
+                        AccessLog.timestamp >= start,
+                        AccessLog.timestamp < end).group_by(*dims)
+    for category, agent, country, referrer, referral, hits, seconds, exits in rows:
+        hits = int(hits or 0)
+        agg.categories[category] += hits
+        agg.agents[agent] += hits
+        agg.countries[country] += hits
+        if referrer is not None:
+            agg.referrers[referrer] += hits
+        if referral:
+            agg.clicks += hits
+        if exits:
+            agg.seconds[agent] += float(seconds or 0)
+            agg.exits[agent] += exits
+    return agg
+
+
+def _buckets(counter: Counter, n: int = 10, label=lambda k: k) -> list:
+    top = sorted(((k, v) for k, v in counter.items() if v > 0),
+                 key=lambda kv: (-kv[1], str(kv[0])))[:n]
+    return [{"key": label(k), "count": v} for k, v in top]
+
+
+def build_insights(agg: InsightsAggregate) -> dict:
+    """Respuesta de AdvancedInsightsOut a partir de las sumas."""
+    by_category = Counter({k: v for k, v in agg.categories.items() if v > 0})
+    total_hits = sum(by_category.values())
+    uncategorized = by_category.pop(None, 0)
+    traffic_by_agent = [{
+        "key": label,
+        "count": by_category.pop(label, 0)
+    } for label in (AI_AGENT, AI_ASSISTANT, AI_DATA_SCRAPER)]
+    traffic_by_agent += [{
+        "key": label,
+        "count": count
+    } for label, count in sorted(by_category.items())]
+    traffic_by_agent.append({
+        "key": "Uncategorized",
+        "count": uncategorized
+    })
+
+    most_active_agents = _buckets(agg.agents, label=lambda k: k or "Unknown")
+    if not most_active_agents:
+        most_active_agents = [{"key": "Unknown", "count": 0}]
+
+    llm = Counter({k: v for k, v in agg.referrers.items()
+                   if "llm=" in k.lower()})
+    averages = Counter({agent: round(agg.seconds[agent] / n)
+                        for agent, n in agg.exits.items() if n > 0})
+    ctr = (agg.clicks / total_hits * 100) if total_hits else 0.0
+    return {
+        "trafficByAgentType": traffic_by_agent,
+        "mostActiveAgents": most_active_agents,
+        "topOriginatingCountries": _buckets(agg.countries,
+                                            label=lambda k: k or "??"),
+        "referralClickRate": {
+            "clicks": agg.clicks,
+            "impressions": total_hits,
+            "rate": round(ctr, 2)
+        },
+        "topReferredPages": _buckets(agg.referrers),
+        "trafficByLLMReferrer": _buckets(llm),
+        "timeSpentByAgent": _buckets(averages, label=lambda k: k or "Unknown"),
+    }
+
+
+class _Entry:
+    __slots__ = ("cutoff", "stable", "agg", "built", "result", "expires")
+
+    def __init__(self, cutoff, stable, agg):
+        self.cutoff = cutoff
+        self.stable = stable
+        self.agg = agg
+        self.built = time.monotonic()
+        self.result = None
+        self.expires = 0.0
+
+
+class InsightsCache:
+    """
+    Sumas de advanced-insights por (tenant, rango), en este proceso.
+
+    La parte estable ([cutoff, stable)) se guarda y se actualiza de forma
+    incremental: al refrescar se suman las horas que han entrado y se
+    restan las filas que han salido de la ventana, cada una con un scan()
+    acotado. stable queda rescan horas cerradas por detrás de la hora en
+    curso: esas horas se leen enteras en cada refresco, con lo que se ven
+    las filas que el writer vuelca tarde y los exit_timestamp o referral
+    que se rellenan después. Lo que cambie más atrás (y el error de restar
+    filas que han cambiado desde que se sumaron) dura como mucho max_age
+    segundos: pasado ese tiempo la entrada se recalcula entera. La
+    respuesta se reutiliza durante ttl segundos.
+    """
+
+    def __init__(self, ttl: float, max_entries: int, rescan_hours: int,
+                 max_age: float):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.rescan = timedelta(hours=rescan_hours)
+        self.max_age = max_age
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._locks = {}
+
+    def _lock_for(self, key) -> threading.Lock:
+        with self._lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def get(self, db, tenant: str, range_key: str, cutoff: datetime) -> dict:
+        key = (tenant, range_key)
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires > time.monotonic():
+            return entry.result
+        with self._lock_for(key):
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires > time.monotonic():
+                return entry.result  # lo ha refrescado otro hilo
+            now = datetime.utcnow()
+            stable = max(truncate_hour(now) - self.rescan, cutoff)
+            if (entry is None or entry.stable <= cutoff
+                    or cutoff < entry.cutoff or stable < entry.stable
+                    or time.monotonic() - entry.built > self.max_age):
+                entry = _Entry(cutoff, stable, scan(db, tenant, cutoff, stable))
+            else:
+                entry.agg.merge(scan(db, tenant, entry.stable, stable))
+                entry.agg.merge(scan(db, tenant, entry.cutoff, cutoff), sign=-1)
+                entry.cutoff, entry.stable = cutoff, stable
+            current = entry.agg.copy()
+            current.merge(scan(db, tenant, entry.stable, now))
+            entry.result = build_insights(current)
+            entry.expires = time.monotonic() + self.ttl
+            self._store(key, entry)
+            return entry.result
+
+    def _store(self, key, entry: _Entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                old, _ = self._entries.popitem(last=False)
+                self._locks.pop(old, None)
+
+
+insights_cache = InsightsCache(ttl=settings.INSIGHTS_CACHE_TTL,
+                               max_entries=settings.INSIGHTS_CACHE_SIZE,
+                               rescan_hours=settings.INSIGHTS_RESCAN_HOURS,
+                               max_age=settings.INSIGHTS_CACHE_MAX_AGE)
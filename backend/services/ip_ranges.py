@@ -0,0 +1,178 @@
+# backend/services/ip_ranges.py
+import ipaddress
+import json
+import os
+import re
+import socket
+import threading
+from typing import Optional
+
+from config import settings
+
+# Rangos publicados por los proveedores cloud que se cargan con "file:"
+_FILE_PREFIX = "file:"
+_SPLIT = re.compile(r"[\s,;]+")
+
+_file_cache = {}  # ruta -> (mtime, [redes])
+_file_lock = threading.Lock()
+
+
+def _networks_from_json(data) -> list:
+    """
+    Valores de las claves *prefix* de un JSON de rangos publicado
+    (AWS ip-ranges.json: ip_prefix/ipv6_prefix, GCP: ipv4Prefix/ipv6Prefix...).
+    """
+    found = []
+    if isinstance(data, dict):
+        for key, value in data.items():
+            if isinstance(value, str) and key.lower().endswith("prefix"):
+                found.append(value)
+            elif isinstance(value, (dict, list)):
+                found.extend(_networks_from_json(value))
+    elif isinstance(data, list):
+        for item in data:
+            found.extend(_networks_from_json(item))
+    return found
+
+
+def _parse_networks(values, source: str) -> list:
+    networks, invalid = [], 0
+    for value in values:
+        value = value.strip()
+        if not value:
+            continue
+        try:
+            networks.append(ipaddress.ip_network(value, strict=False))
+        except ValueError:
+            invalid += 1
+    if invalid:
+        print(f"{invalid} rangos IP no válidos ignorados en {source}")
+    return networks
+
+
+def _read_file(path: str) -> list:
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    if text.lstrip().startswith(("{", "[")):
+        return _networks_from_json(json.loads(text))
+    values = []
+    for line in text.splitlines():
+        values.extend(_SPLIT.split(line.split("#", 1)[0]))
+    return values
+
+
+def load_list(name: str) -> list:
+    """
+    Redes de IP_LISTS_DIR/name (texto con un CIDR por línea o JSON de
+    rangos). Se cachean por mtime: varios tenants pueden usar la misma lista
+    y la recompilación de reglas no vuelve a leerla.
+    """
+    if not settings.IP_LISTS_DIR or os.path.basename(name) != name:
+        print(f"Lista de IPs no permitida: {name}")
+        return []
+    path = os.path.join(settings.IP_LISTS_DIR, name)
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError as e:
+        print(f"Error al leer la lista de IPs {name}: {e}")
+        return []
+    with _file_lock:
+        cached = _file_cache.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+    try:
+        networks = _parse_networks(_read_file(path), name)
+    except (OSError, ValueError) as e:
+        print(f"Error al leer la lista de IPs {name}: {e}")
+        return []
+    with _file_lock:
+        _file_cache[path] = (mtime, networks)
+    return networks
+
+
+def parse_ranges(spec: str) -> list:
+    """
+    Patrón de una regla match_type="ip": CIDRs o IPs sueltas separados por
+    comas o espacios y/o "file:<nombre>" de IP_LISTS_DIR.
+    """
+    networks, literals = [], []
+    for token in _SPLIT.split(spec or ""):
+        if token.startswith(_FILE_PREFIX):
+            networks.extend(load_list(token[len(_FILE_PREFIX):]))
+        elif token:
+            literals.append(token)
+    return networks + _parse_networks(literals, "la regla")
+
+
+def parse_ip(ip: str):
+    """
+    (versión, entero) de una IP, o None si no es válida; las IPv6 mapeadas
+    (::ffff:a.b.c.d) se tratan como IPv4. inet_pton es bastante más rápido
+    que ipaddress.ip_address.
+    """
+    try:
+        if ":" in ip:
+            n = int.from_bytes(socket.inet_pton(socket.AF_INET6, ip), "big")
+            if n >> 32 == 0xFFFF:
+                return 4, n & 0xFFFFFFFF
+            return 6, n
+        return 4, int.from_bytes(socket.inet_pton(socket.AF_INET, ip), "big")
+    except (OSError, ValueError, TypeError):
+        return None
+
+
+class PrefixIndex:
+    """
+    Índice de longest-prefix-match para IPv4 e IPv6.
+
+    Una tabla hash por longitud de prefijo ({red enmascarada: valor}); la
+    búsqueda enmascara la IP con cada longitud presente, de la más larga a la
+    más corta, y devuelve la primera que encaja. El coste depende del número
+    de longitudes distintas (unas pocas decenas como mucho), no del número
+    de rangos.
+    """
+
+    def __init__(self):
+        self._tables = {4: {}, 6: {}}
+        self._levels = {4: [], 6: []}
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def add(self, network, value):
+        """Si el mismo rango ya estaba se queda el valor añadido primero."""
+        tables = self._tables[network.version]
+        table = tables.get(network.prefixlen)
+        if table is None:
+            table = tables[network.prefixlen] = {}
+            bits = network.max_prefixlen
+            self._levels[network.version] = [
+                (((1 << plen) - 1) << (bits - plen), t)
+                for plen, t in sorted(tables.items(), reverse=True)
+            ]
+        key = int(network.network_address)
+        if key not in table:
+            table[key] = (str(network), value)
+            self._size += 1
+
+    def lookup(self, ip: str):
+        """("red/prefijo", valor) del rango más específico que contiene ip, o None."""
+        parsed = parse_ip(ip)
+        if parsed is None:
+            return None
+        version, n = parsed
+        for mask, table in self._levels[version]:
+            found = table.get(n & mask)
+            if found is not None:
+                return found
+        return None
+
+
+def build_index(rules) -> Optional[PrefixIndex]:
+    """rules: [(rango o lista de rangos, valor)] en orden de prioridad."""
+    index = PrefixIndex()
+    for spec, value in rules:
+        for network in parse_ranges(spec):
+            index.add(network, value)
+    return index if len(index) else None
@@ -0,0 +1,135 @@
+# backend/services/limits.py
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+from config import settings
+from db import SessionLocal
+from models.models import AccessLog
+from services.state import StateBackend, state
+
+
+def limit_pattern(rule: str) -> str:
+    """Patrón de una regla de log "limit:{pat} ({used}/{max})"."""
+    return rule[len("limit:"):].rsplit(" (", 1)[0]
+
+
+class SlidingWindowCounter:
+    """
+    Contadores de ventana deslizante por clave (tenant, patrón).
+
+    La ventana se divide en `buckets` tramos; cada tramo es un contador del
+    estado compartido (services/state.py) que caduca solo al salir de la
+    ventana, así que todos los workers ven y limitan el mismo total. Solo se
+    escribe en el tramo actual: la suma de los tramos cerrados se calcula una
+    vez por tramo y clave, y cada hit cuesta un único incremento.
+    No guarda estado propio en la base de datos: cada hit permitido queda en
+    AccessLog (volcado periódicamente por services/ingest.py) y seed_from_db()
+    reconstruye la última ventana a partir de esos logs si el estado se ha
+    perdido.
+    """
+
+    def __init__(self, window: int, buckets: int, state: StateBackend):
+        self.window = window
+        self.buckets = buckets
+        self.width = window / buckets
+        self.state = state
+        self._closed = {}  # clave -> (tramo, suma de los tramos cerrados)
+        self._ops = 0
+
+    def _bucket(self, ts: float) -> int:
+        return int(ts // self.width)
+
+    @staticmethod
+    def _key(key, bucket: int) -> str:
+        tenant, pattern = key
+        return f"lim:{tenant}:{bucket}:{pattern}"
+
+    def _ttl(self, bucket: int, now: float) -> float:
+        """Segundos hasta que el tramo sale de la ventana."""
+        return (bucket + 1) * self.width + self.window - now
+
+    def add(self, key, ts: float = None, n: int = 1):
+        now = time.time()
+        bucket = self._bucket(now if ts is None else ts)
+        if bucket <= self._bucket(now) - self.buckets:
+            return  # fuera de la ventana
+        self.state.incr(self._key(key, bucket), n, ttl=self._ttl(bucket, now))
+
+    def _closed_sum(self, key, bucket: int) -> int:
+        cached = self._closed.get(key)
+        if cached is not None and cached[0] == bucket:
+            return cached[1]
+        keys = [self._key(key, b)
+                for b in range(bucket - self.buckets + 1, bucket)]
+        total = sum(v or 0 for v in self.state.get_many(keys))
+        self._closed[key] = (bucket, total)
+        self._ops += 1
+        if self._ops % 10_000 == 0:
+            self._prune(bucket)
+        return total
+
+    def _prune(self, bucket: int):
+        stale = [k for k, (b, _) in list(self._closed.items()) if b < bucket]
+        for k in stale:
+            self._closed.pop(k, None)
+
+    def count(self, key) -> int:
+        bucket = self._bucket(time.time())
+        current = self.state.get(self._key(key, bucket)) or 0
+        return self._closed_sum(key, bucket) + current
+
+    def try_acquire(self, key, limit: int):
+        """
+        Suma un hit si la ventana no ha llegado a `limit`.
+        Devuelve (permitido, usados): usados incluye el hit si se permitió.
+
+        Se incrementa primero y se deshace si se pasa del límite, de modo que
+        con varios workers a la vez nunca se admiten más de `limit` hits.
+        """
+        bucket = self._bucket(time.time())
+        current = self._key(key, bucket)
+        used = self._closed_sum(key, bucket) + self.state.incr(
+            current, 1, ttl=self.window + self.width)
+        if used > limit:
+            self.state.incr(current, -1)
+            return False, used - 1
+        return True, used
+
+    def seed_from_db(self):
+        """
+        Reconstruye la ventana actual con los hits "limit:" de AccessLog.
+        Solo lo hace el primer worker que arranca sin la marca lim:seeded,
+        que dura una ventana. Los tramos se fijan con set() al total de la
+        base de datos, así que volver a sembrar con el estado vivo no cuenta
+        los hits dos veces (como mucho pierde los aún no volcados).
+        """
+        if not self.state.add("lim:seeded", 1, ttl=self.window):
+            return 0
+        since = datetime.utcnow() - timedelta(seconds=self.window)
+        # timestamp se guarda en UTC naive: se convierte sin zona local
+        epoch = datetime(1970, 1, 1)
+        db = SessionLocal()
+        try:
+            rows = db.query(AccessLog.tenant_id, AccessLog.rule,
+                            AccessLog.timestamp).filter(
+                                AccessLog.timestamp >= since,
+                                AccessLog.rule.like("limit:%")).all()
+        finally:
+            db.close()
+        counts = Counter()
+        for tenant_id, rule, ts in rows:
+            bucket = self._bucket((ts - epoch).total_seconds())
+            counts[(tenant_id, limit_pattern(rule)), bucket] += 1
+        now = time.time()
+        oldest = self._bucket(now) - self.buckets
+        self._closed.clear()
+        for (key, bucket), n in counts.items():
+            if bucket > oldest:
+                self.state.set(self._key(key, bucket), n,
+                               ttl=self._ttl(bucket, now))
+        return len(rows)
+
+limit_counters = SlidingWindowCounter(window=settings.LIMIT_WINDOW_SECONDS,
+                                      buckets=settings.LIMIT_WINDOW_BUCKETS,
+                                      state=state)
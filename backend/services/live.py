@@ -0,0 +1,218 @@
+# backend/services/live.py
+import asyncio
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+
+from config import settings
+from db import engine
+from models.models import AccessLog
+from services.state import state
+
+# Campos de cada log en /rest/logs y en los eventos de /rest/logs/live
+LOG_COLUMNS = ("id", "timestamp", "ip_address", "user_agent", "referrer",
+               "accept_language", "sec_ch_ua", "sec_ch_ua_mobile",
+               "sec_ch_ua_platform", "utm_source", "fingerprint", "path",
+               "outcome", "rule", "redirect_url", "js_executed",
+               "sample_weight")
+
+
+def log_dict(row) -> dict:
+    out = {name: getattr(row, name) for name in LOG_COLUMNS}
+    out["sample_weight"] = out["sample_weight"] or 1
+    return out
+
+
+def _seq_key(tenant: str) -> str:
+    return f"live:seq:{tenant}"
+
+
+def notify_live(conn, rows: list):
+    """
+    Hook de services/ingest.py: sube el contador live:seq de cada tenant
+    del lote en el estado compartido, que es lo que miran los LiveHub de
+    todos los workers.
+    """
+    for tenant in {row["tenant_id"] for row in rows if row.get("tenant_id")}:
+        state.incr(_seq_key(tenant), ttl=3600)
+
+
+class Subscriber:
+    """
+    Buffer acotado de un cliente de /rest/logs/live. Se llena desde el hilo
+    del LiveHub (call_soon_threadsafe) y se vacía en el event loop de la
+    petición. Si el cliente no da abasto y el buffer se llena, se marca
+    overflow y el stream se cierra.
+    """
+
+    def __init__(self, tenant: str, loop, max_events: int):
+        self.tenant = tenant
+        self.loop = loop
+        self.max_events = max_events
+        self.events = deque()
+        self.ready = asyncio.Event()
+        self.overflow = False
+
+    def _push(self, events: list):
+        if self.overflow:
+            return
+        if len(self.events) + len(events) > self.max_events:
+            self.overflow = True
+            self.events.clear()
+        else:
+            self.events.extend(events)
+        self.ready.set()
+
+    async def next(self, timeout: float) -> list:
+        """Eventos pendientes; lista vacía si pasa timeout sin ninguno."""
+        try:
+            await asyncio.wait_for(self.ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return []
+        self.ready.clear()
+        events = list(self.events)
+        self.events.clear()
+        return events
+
+
+class _Tail:
+    __slots__ = ("seq", "start", "read_at", "sent")
+
+    def __init__(self, seq, now):
+        self.seq = seq
+        self.start = now  # no se envía nada anterior a la suscripción
+        self.read_at = now
+        self.sent = {}  # id -> timestamp de lo enviado dentro de la ventana
+
+
+class LiveHub:
+    """
+    Reparte los logs nuevos de cada tenant a sus clientes de /rest/logs/live.
+
+    Un hilo por worker: cada interval segundos mira los contadores live:seq
+    de los tenants con clientes (una llamada al estado compartido) y solo
+    para los que han cambiado lee de access_log las filas nuevas, con el
+    índice (tenant_id, timestamp, id). Con N pestañas abiertas sigue siendo
+    una consulta por tenant y worker.
+
+    El writer de otro worker puede volcar filas con un timestamp anterior a
+    la última lectura, así que se lee desde lag segundos antes y se
+    descartan los ids ya enviados. En cada lectura se envían como mucho
+    max_rows filas, las más recientes.
+    """
+
+    def __init__(self, interval: float, lag: float, max_rows: int,
+                 max_events: int, max_clients: int):
+        self.interval = interval
+        self.lag = timedelta(seconds=lag)
+        self.max_rows = max_rows
+        self.max_events = max_events
+        self.max_clients = max_clients
+        self._subs = {}  # tenant -> set de Subscriber
+        self._tails = {}  # tenant -> _Tail
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="live-logs",
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        if self.running:
+            self._stop.set()
+            self._thread.join(timeout)
+            self._thread = None
+
+    def subscribe(self, tenant: str):
+        """Nuevo Subscriber en el loop actual, o None si el tenant está al límite."""
+        sub = Subscriber(tenant, asyncio.get_running_loop(), self.max_events)
+        with self._lock:
+            subs = self._subs.setdefault(tenant, set())
+            if len(subs) >= self.max_clients:
+                return None
+            subs.add(sub)
+            if tenant not in self._tails:
+                self._tails[tenant] = _Tail(state.get(_seq_key(tenant)),
+                                            datetime.utcnow())
+        return sub
+
+    def unsubscribe(self, sub: Subscriber):
+        with self._lock:
+            subs = self._subs.get(sub.tenant)
+            if subs is None:
+                return
+            subs.discard(sub)
+            if not subs:
+                del self._subs[sub.tenant]
+                self._tails.pop(sub.tenant, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"tenants": len(self._subs),
+                    "clients": sum(len(s) for s in self._subs.values())}
+
+    def _read(self, tenant: str, tail: _Tail) -> list:
+        now = datetime.utcnow()
+        low = max(tail.start, tail.read_at - self.lag)
+        columns = [getattr(AccessLog, name) for name in LOG_COLUMNS]
+        stmt = select(*columns).where(
+            AccessLog.tenant_id == tenant,
+            AccessLog.timestamp >= low).order_by(
+                AccessLog.timestamp.desc(),
+                AccessLog.id.desc()).limit(self.max_rows)
+        with engine.connect() as conn:
+            rows = conn.execute(stmt).all()
+        tail.read_at = now
+        tail.sent = {i: ts for i, ts in tail.sent.items() if ts >= low}
+        fresh = [row for row in reversed(rows) if row.id not in tail.sent]
+        for row in fresh:
+            tail.sent[row.id] = row.timestamp
+        return [log_dict(row) for row in fresh]
+
+    def _publish(self, tenant: str, events: list):
+        with self._lock:
+            subs = list(self._subs.get(tenant, ()))
+        for sub in subs:
+            try:
+                sub.loop.call_soon_threadsafe(sub._push, events)
+            except RuntimeError:  # loop cerrado: el cliente ya no está
+                self.unsubscribe(sub)
+
+    def poll_once(self):
+        with self._lock:
+            tails = list(self._tails.items())
+        if not tails:
+            return
+        seqs = state.get_many([_seq_key(tenant) for tenant, _ in tails])
+        for (tenant, tail), seq in zip(tails, seqs):
+            if seq == tail.seq:
+                continue
+            tail.seq = seq
+            events = self._read(tenant, tail)
+            if events:
+                self._publish(tenant, events)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.poll_once()
+            except Exception as e:
+                print(f"Error en el live tail de logs: {e}")
+
+
+live_hub = LiveHub(interval=settings.LIVE_POLL_INTERVAL,
+                   lag=settings.LIVE_LAG,
+                   max_rows=settings.LIVE_MAX_ROWS,
+                   max_events=settings.LIVE_BUFFER_EVENTS,
+                   max_clients=settings.LIVE_MAX_CLIENTS)
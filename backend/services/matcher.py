@@ -0,0 +1,180 @@
+# backend/services/matcher.py
+import re
+from collections import Counter
+from typing import NamedTuple, Optional
+
+from services.ip_ranges import build_index
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+
+# Longitud del n-grama con el que se indexa cada patrón
+GRAM = 4
+# Por debajo de este número de patrones es más barato probar las regex
+# compiladas una a una que extraer los n-gramas del UA (ver bench_matcher)
+MIN_INDEXED = 96
+
+# Texto típico de navegador: se evitan n-gramas que aparecen en casi todo UA
+_COMMON_UA = ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+              "(KHTML, like Gecko) Chrome/126.0.0.0 Mobile Safari/537.36 "
+              "(Macintosh; Intel Mac OS X 10_15_7) Version/17.5 "
+              "(X11; Linux x86_64; rv:127.0) Gecko/20100101 Firefox/127.0 "
+              "(iPhone; CPU iPhone OS 17_5 like Mac OS X) (compatible; ")
+
+
+def _compile(pattern: str) -> re.Pattern:
+    # Un patrón inválido se trata como literal en lugar de romper cada petición
+    try:
+        return re.compile(pattern)
+    except re.error:
+        return re.compile(re.escape(pattern))
+
+
+def required_literal(rx: re.Pattern) -> str:
+    """
+    Literal más largo que toda coincidencia de rx contiene obligatoriamente
+    (solo secuencias de LITERAL al nivel superior), o "" si no hay ninguno.
+    """
+    if rx.flags & re.IGNORECASE:
+        return ""
+    try:
+        parsed = sre_parse.parse(rx.pattern, rx.flags)
+    except Exception:
+        return ""
+    best, run = "", []
+    for op, av in parsed:
+        if op is sre_parse.LITERAL:
+            run.append(chr(av))
+            continue
+        if len(run) > len(best):
+            best = "".join(run)
+        run = []
+    if len(run) > len(best):
+        best = "".join(run)
+    return best
+
+
+class PatternSet:
+    """
+    Lista ordenada de expresiones regulares con un índice de n-gramas.
+
+    Cada patrón se indexa por un n-grama de un literal que toda coincidencia
+    debe contener. first(text) recorre text una sola vez para obtener sus
+    n-gramas, cruza el resultado con el índice y solo ejecuta las regex
+    candidatas (más las que no tienen literal indexable), respetando el orden.
+    Con pocos patrones se prueban directamente las regex ya compiladas.
+    """
+
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        self._single = [_compile(p) for p in self.patterns]
+        self._index = {}
+        self._always = []
+        if len(self._single) < MIN_INDEXED:
+            self._always = list(range(len(self._single)))
+            return
+
+        literals = [required_literal(rx) for rx in self._single]
+        popularity = Counter(lit[j:j + GRAM] for lit in literals
+                             for j in range(len(lit) - GRAM + 1))
+        for i, lit in enumerate(literals):
+            grams = [lit[j:j + GRAM] for j in range(len(lit) - GRAM + 1)]
+            if not grams:
+                self._always.append(i)
+                continue
+            gram = min(grams, key=lambda g: (g in _COMMON_UA, popularity[g]))
+            self._index.setdefault(gram, []).append(i)
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def compiled(self, i: int) -> re.Pattern:
+        return self._single[i]
+
+    def candidates(self, text: str) -> list:
+        if not self._index:
+            return self._always
+        grams = {text[j:j + GRAM] for j in range(len(text) - GRAM + 1)}
+        found = list(self._always)
+        for gram in self._index.keys() & grams:
+            found.extend(self._index[gram])
+        found.sort()
+        return found
+
+    def first(self, text: str) -> Optional[int]:
+        single = self._single
+        for i in self.candidates(text):
+            if single[i].search(text):
+                return i
+        return None
+
+
+class RuleMatch(NamedTuple):
+    policy: str  # "block" | "redirect" | "restricted"
+    pattern: str
+    url: Optional[str] = None
+    limit: Optional[int] = None
+
+
+# Prioridad entre políticas cuando encajan una regla de UA y una de IP
+_PRIORITY = {"block": 0, "redirect": 1, "restricted": 2}
+
+
+def prefer(a: Optional[RuleMatch], b: Optional[RuleMatch]) -> Optional[RuleMatch]:
+    if a is None or (b is not None and _PRIORITY[b.policy] < _PRIORITY[a.policy]):
+        return b
+    return a
+
+
+class CompiledRuleset:
+    """
+    Reglas de un tenant compiladas a partir del cfg de load_rules_from_db.
+    Respeta la prioridad original: block, después redirect y después limit,
+    y dentro de cada política el orden de las reglas.
+
+    Las reglas de IP (cfg["ipRules"]) van a un PrefixIndex aparte: gana el
+    rango más específico y, con el mismo rango, la política más prioritaria.
+    """
+
+    def __init__(self, cfg: dict, tenant: str = None, version: int = 0):
+        self.cfg = cfg
+        self.tenant = tenant
+        self.version = version
+        self._rules = []
+        for pat in cfg.get("blockedAgents", []):
+            self._rules.append(RuleMatch("block", pat))
+        for r in cfg.get("redirectAgents", []):
+            self._rules.append(RuleMatch("redirect", r["pattern"], url=r["url"]))
+        for pat, limit_cfg in cfg.get("limitedAgents", {}).items():
+            self._rules.append(
+                RuleMatch("restricted", pat, limit=limit_cfg["maxPerHour"]))
+        self._patterns = PatternSet(r.pattern for r in self._rules)
+        ip_rules = sorted(cfg.get("ipRules", []),
+                          key=lambda r: _PRIORITY.get(r["policy"], 3))
+        self._ip_index = build_index((r["ranges"], r) for r in ip_rules
+                                     if r["policy"] in _PRIORITY)
+
+    def __len__(self):
+        return len(self._rules) + (len(self._ip_index) if self._ip_index else 0)
+
+    def match(self, ua: str) -> Optional[RuleMatch]:
+        idx = self._patterns.first(ua)
+        return None if idx is None else self._rules[idx]
+
+    def match_ip(self, ip: str) -> Optional[RuleMatch]:
+        """Regla del rango más específico que contiene ip; pattern es "ip:<red>"."""
+        if self._ip_index is None or not ip:
+            return None
+        found = self._ip_index.lookup(ip)
+        if found is None:
+            return None
+        network, r = found
+        return RuleMatch(r["policy"], f"ip:{network}", url=r.get("url"),
+                         limit=r.get("limit"))
+
+
+def compile_ruleset(cfg: dict, tenant: str = None,
+                    version: int = 0) -> CompiledRuleset:
+    return CompiledRuleset(cfg, tenant=tenant, version=version)
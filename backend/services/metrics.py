@@ -0,0 +1,190 @@
+# backend/services/metrics.py
+import bisect
+import threading
+import time
+
+# Segundos; el pixel vive entre decenas de microsegundos y unos milisegundos
+DEFAULT_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001,
+                   0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+def _labels(names, values) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{v}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _value(v) -> str:
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class _CounterChild:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, n=1):
+        with self._lock:
+            self.value += n
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum", "_lock")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # el último es +Inf
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        i = bisect.bisect_left(self.bounds, seconds)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += seconds
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def render(self) -> list:
+        return [f"# HELP {self.name} {self.help}",
+                f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, n=1):
+        self.labels().inc(n)
+
+    def render(self):
+        lines = super().render()
+        for values, child in list(self._children.items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, values)} "
+                         f"{_value(child.value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.bounds = tuple(buckets)
+
+    def _new_child(self):
+        return _HistogramChild(self.bounds)
+
+    def observe(self, seconds: float):
+        self.labels().observe(seconds)
+
+    def render(self):
+        lines = super().render()
+        names = self.labelnames + ("le",)
+        for values, child in list(self._children.items()):
+            with child._lock:
+                counts, total = list(child.counts), child.sum
+            cumulative = 0
+            for bound, n in zip(self.bounds + ("+Inf",), counts):
+                cumulative += n
+                lines.append(f"{self.name}_bucket"
+                             f"{_labels(names, values + (bound,))} {cumulative}")
+            base = _labels(self.labelnames, values)
+            lines.append(f"{self.name}_sum{base} {total!r}")
+            lines.append(f"{self.name}_count{base} {cumulative}")
+        return lines
+
+
+class Gauge(_Metric):
+    """Valor leído al exportar: fn() devuelve un número o {etiquetas: valor}."""
+    kind = "gauge"
+
+    def __init__(self, name, help, fn, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self.fn = fn
+
+    def render(self):
+        lines = super().render()
+        try:
+            value = self.fn()
+        except Exception as e:
+            print(f"Error al leer la métrica {self.name}: {e}")
+            return lines
+        items = value.items() if isinstance(value, dict) else [((), value)]
+        for values, v in items:
+            if not isinstance(values, tuple):
+                values = (values,)
+            lines.append(f"{self.name}{_labels(self.labelnames, values)} "
+                         f"{_value(v)}")
+        return lines
+
+
+class Registry:
+    """Métricas del proceso en formato de texto de Prometheus."""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def _add(self, metric):
+        return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help, labelnames=()) -> Counter:
+        return self._add(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(),
+                  buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, labelnames, buckets))
+
+    def gauge(self, name, help, fn, labelnames=()) -> Gauge:
+        return self._add(Gauge(name, help, fn, labelnames))
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# Etapas del pixel: rules, rules_db, match, limit, quota, log
+detect_stage_seconds = registry.histogram(
+    "neptuno_detect_stage_seconds",
+    "Duración de cada etapa del pixel /rest/detect", ("stage",))
+detect_request_seconds = registry.histogram(
+    "neptuno_detect_request_seconds",
+    "Duración total del pixel /rest/detect", ("route",))
+detect_requests_total = registry.counter(
+    "neptuno_detect_requests_total",
+    "Peticiones al pixel por ruta y resultado", ("route", "outcome"))
+
+
+def stage(name: str, t0: float) -> float:
+    """Registra la etapa iniciada en t0 (perf_counter) y devuelve el instante actual."""
+    now = time.perf_counter()
+    detect_stage_seconds.labels(name).observe(now - t0)
+    return now
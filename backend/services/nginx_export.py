@@ -0,0 +1,435 @@
+# backend/services/nginx_export.py
+import os
+import re
+import shlex
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Optional
+from urllib.parse import unquote
+
+from config import settings
+from db import SessionLocal
+from models.models import FirewallRule
+from services.ingest import access_log_writer, build_log_row
+from services.matcher import _compile, compile_ruleset
+from services.state import state
+
+# Construcciones que no se traducen igual a PCRE o que dejan de funcionar
+# al anteponer "tenant|": anclas, grupos con nombre, referencias y flags
+# propios de Python. Esas reglas se siguen evaluando solo en Python.
+_NOT_PORTABLE = re.compile(r"\^|\\A|\(\?P|\(\?<[^=!]|\\[1-9]|\(\?[imsx-]*[aLu]")
+
+# Válidas en Python pero que PCRE rechaza o lee distinto: \uXXXX, \UXXXXXXXX
+# y \N{...} (en nginx serían un error de nginx -t y tumbarían el fichero
+# entero), {,n} (PCRE lo toma como literal) y las clases POSIX [:alpha:]
+# (Python las toma como un conjunto de caracteres).
+_NOT_PCRE = re.compile(r"\\[uUN]|\{,|\[:\^?[a-z]+:\]")
+
+HEADER = """\
+# Generado por services/nginx_export.py: no editar a mano.
+# Incluir dentro de http { } y usar $detect_block / $detect_redirect /
+# $detect_edge en la location del pixel (ver nginx.conf.paranoid).
+"""
+
+STATIC_MAPS = r"""
+map $uri $detect_tenant {
+    default "";
+    "~^/rest/detect/(?:async/)?(?<tenant>[^/|]+)\.png$" $tenant;
+}
+
+map $arg_ua $detect_ua {
+    default $arg_ua;
+    "" $http_user_agent;
+}
+
+map "$detect_block$detect_redirect" $detect_edge {
+    "0" 0;
+    default 1;
+}
+
+log_format neptuno_edge '$msec\t$detect_tenant\t$remote_addr\t$detect_block\t$detect_redirect\t$arg_src\t$uri\t$arg_fp\t$arg_noscript\t$detect_ua';
+"""
+
+
+def edge_pattern(pattern: str) -> Optional[str]:
+    """Regex equivalente para nginx, o None si la regla debe quedarse en Python."""
+    effective = _compile(pattern).pattern
+    if not effective or _NOT_PORTABLE.search(effective):
+        return None
+    if _NOT_PCRE.search(_strip_escaped_backslashes(effective)):
+        print(f"Regla '{pattern}' no válida en PCRE; se evalúa solo en Python")
+        return None
+    return effective
+
+
+def _strip_escaped_backslashes(pattern: str) -> str:
+    # "\\u" es una barra literal seguida de "u", no un escape \u
+    return pattern.replace("\\\\", "")
+
+
+def _quote(value: str) -> str:
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def _key(tenant: str, patterns) -> str:
+    alternatives = "|".join(f"(?:{p})" for p in patterns)
+    return _quote(f"~^{re.escape(tenant)}\\|.*?(?:{alternatives})")
+
+
+def render_maps(rules: dict) -> str:
+    """
+    rules: tenant -> {"block": [patrón], "redirect": [(patrón, url)],
+    "ip_block": bool}. Un tenant con algún "block" no exportable (o con
+    reglas block de IP, que solo se evalúan en Python) no exporta sus
+    "redirect": en Python el block tendría prioridad y en el borde no se vería.
+    """
+    block_lines, redirect_lines = [], []
+    for tenant in sorted(rules):
+        if "|" in tenant or "/" in tenant:
+            continue
+        blocks = [edge_pattern(p) for p in rules[tenant]["block"]]
+        exported = [p for p in blocks if p]
+        if exported:
+            block_lines.append(f"    {_key(tenant, exported)} 1;")
+        if len(exported) != len(blocks) or rules[tenant].get("ip_block"):
+            continue
+        for pattern, url in rules[tenant]["redirect"]:
+            edge = edge_pattern(pattern)
+            # Un "$" en el valor de un map se interpretaría como variable
+            if edge and url and "$" not in url:
+                redirect_lines.append(f"    {_key(tenant, [edge])} {_quote(url)};")
+
+    out = [HEADER, STATIC_MAPS]
+    out.append('map "$detect_tenant|$detect_ua" $detect_block {')
+    out.append("    default 0;")
+    out.extend(block_lines)
+    out.append("}\n")
+    out.append('map "$detect_tenant|$detect_ua" $detect_redirect {')
+    out.append('    default "";')
+    out.extend(redirect_lines)
+    out.append("}\n")
+    return "\n".join(out)
+
+
+def load_edge_rules() -> dict:
+    rules = defaultdict(lambda: {"block": [], "redirect": [], "ip_block": False})
+    db = SessionLocal()
+    try:
+        rows = db.query(FirewallRule.tenant_id, FirewallRule.policy,
+                        FirewallRule.pattern, FirewallRule.redirect_url,
+                        FirewallRule.match_type).filter(
+                            FirewallRule.policy.in_(("block", "redirect"))).all()
+    finally:
+        db.close()
+    for tenant, policy, pattern, url, match_type in rows:
+        if not tenant or not pattern:
+            continue
+        if match_type == "ip":
+            # Los rangos IP se quedan en el backend (índice de prefijos)
+            if policy == "block":
+                rules[tenant]["ip_block"] = True
+        elif policy == "block":
+            rules[tenant]["block"].append(pattern)
+        else:
+            rules[tenant]["redirect"].append((pattern, url))
+    return dict(rules)
+
+
+def _run(cmd: str) -> bool:
+    if not cmd:
+        return True
+    try:
+        result = subprocess.run(shlex.split(cmd), capture_output=True,
+                                text=True, timeout=30)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        # Sin binario (nginx en otro contenedor) no se ha validado ni
+        # recargado nada: ver NginxExporter para ese despliegue
+        print(f"Error al ejecutar '{cmd}': {e}")
+        return False
+    if result.returncode != 0:
+        print(f"'{cmd}' falló: {result.stderr.strip()}")
+        return False
+    return True
+
+
+class NginxExporter:
+    """
+    Exporta las reglas "block" y "redirect" de todos los tenants a un fichero
+    de maps de nginx, para que los bots conocidos se corten en el borde.
+
+    schedule() agrupa los cambios de reglas de los próximos `debounce`
+    segundos en una sola exportación. El fichero se sustituye con os.replace,
+    se valida con test_cmd (nginx -t) y, si falla, se restaura el anterior;
+    si pasa se ejecuta reload_cmd (nginx -s reload). Sin path no hace nada.
+
+    Si nginx corre en otro contenedor, el directorio de path tiene que ser un
+    volumen compartido con él (el de /etc/nginx/neptuno/) y los comandos se
+    lanzan dentro de ese contenedor, p. ej. NGINX_TEST_CMD="docker exec
+    nginx nginx -t" y NGINX_RELOAD_CMD="docker exec nginx nginx -s reload"
+    (con el socket de docker montado). Dejarlos vacíos es decir que otro
+    proceso valida y recarga (un inotifywait o un cron en el host): el
+    exportador ya no lo comprueba. Un comando que no se puede ejecutar cuenta
+    como fallo, no como éxito.
+    """
+
+    def __init__(self, path: str, test_cmd: str, reload_cmd: str,
+                 debounce: float):
+        self.path = path
+        self.test_cmd = test_cmd
+        self.reload_cmd = reload_cmd
+        self.debounce = debounce
+        self._pending = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._rulesets = {}  # tenant -> CompiledRuleset de lo exportado
+        self._mtime = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def schedule(self):
+        if self.enabled:
+            self._pending.set()
+
+    def export(self) -> bool:
+        rules = load_edge_rules()
+        self._remember(rules)
+        content = render_maps(rules)
+        try:
+            with open(self.path) as f:
+                if f.read() == content:
+                    return True
+        except FileNotFoundError:
+            pass
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        backup = None
+        if os.path.exists(self.path):
+            backup = self.path + ".bak"
+            shutil.copyfile(self.path, backup)
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            f.write(content)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, self.path)
+
+        if not _run(self.test_cmd):
+            if backup:
+                os.replace(backup, self.path)
+            else:
+                os.remove(self.path)
+            return False
+        return _run(self.reload_cmd)
+
+    def _remember(self, rules: dict):
+        try:
+            self._mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            self._mtime = None
+        self._rulesets = {
+            t: compile_ruleset({
+                "blockedAgents": r["block"],
+                "redirectAgents": [{"pattern": p, "url": u}
+                                   for p, u in r["redirect"]],
+                "limitedAgents": {},
+            }, tenant=t) for t, r in rules.items()
+        }
+
+    def resolve(self, tenant: str, ua: str):
+        """Regla que nginx ha aplicado a este UA, según la última exportación."""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime != self._mtime:  # exportado por otro worker
+            self._remember(load_edge_rules())
+        ruleset = self._rulesets.get(tenant)
+        return ruleset.match(ua) if ruleset else None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if not self.enabled or self.running:
+            return
+        if not os.path.exists(self.path):
+            self._pending.set()
+        else:
+            self._remember(load_edge_rules())
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name="nginx-exporter",
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        if self.running:
+            self._stop.set()
+            self._pending.set()
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._pending.wait()
+            if self._stop.wait(self.debounce):
+                return
+            self._pending.clear()
+            try:
+                self.export()
+            except Exception as e:
+                print(f"Error al exportar reglas a nginx: {e}")
+
+
+def _unescape(value: str) -> str:
+    # nginx escapa '"', '\' y los bytes no imprimibles como \xHH
+    if "\\x" not in value:
+        return value
+    raw = re.sub(r"\\x([0-9A-Fa-f]{2})",
+                 lambda m: chr(int(m.group(1), 16)), value)
+    return raw.encode("latin-1", "replace").decode("utf-8", "replace")
+
+
+class EdgeLogTailer:
+    """
+    Lee el access_log "neptuno_edge" de nginx y lleva a AccessLog una de cada
+    `sample` decisiones tomadas en el borde, a través del writer de ingest.
+    Solo un worker lo sigue a la vez (lease en el estado compartido).
+    """
+
+    LEASE = 30
+
+    def __init__(self, path: str, sample: int, exporter: NginxExporter):
+        self.path = path
+        self.sample = max(1, sample)
+        self.exporter = exporter
+        self._stop = threading.Event()
+        self._thread = None
+        self._seen = 0
+        self._owner = f"{os.getpid()}"
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if not self.path or self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name="nginx-edge-tailer",
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        if self.running:
+            self._stop.set()
+            self._thread.join(timeout)
+            self._thread = None
+            state.delete("nginx:tailer")
+
+    def _lease(self) -> bool:
+        pid = int(self._owner)
+        if state.add("nginx:tailer", pid, ttl=self.LEASE):
+            return True
+        if state.get("nginx:tailer") == pid:
+            state.set("nginx:tailer", pid, ttl=self.LEASE)
+            return True
+        return False
+
+    def _run(self):
+        f, inode = None, None
+        renewed = 0.0
+        first = True
+        while not self._stop.is_set():
+            now = time.monotonic()
+            if now - renewed > self.LEASE / 3:
+                if not self._lease():
+                    if f:
+                        f.close()
+                        f = None
+                    self._stop.wait(self.LEASE / 3)
+                    continue
+                renewed = now
+            try:
+                st = os.stat(self.path)
+            except FileNotFoundError:
+                self._stop.wait(1.0)
+                continue
+            if f is None or st.st_ino != inode or st.st_size < f.tell():
+                if f:
+                    f.close()
+                f, inode = open(self.path, encoding="latin-1"), st.st_ino
+                if first:
+                    f.seek(0, os.SEEK_END)  # no se reprocesa lo anterior
+                    first = False
+            line = f.readline()
+            if not line:
+                self._stop.wait(0.5)
+                continue
+            if line.endswith("\n"):
+                self.handle(line.rstrip("\n"))
+            else:
+                f.seek(f.tell() - len(line))  # línea a medio escribir
+                self._stop.wait(0.2)
+        if f:
+            f.close()
+
+    def handle(self, line: str):
+        parts = line.split("\t")
+        if len(parts) != 10:
+            return
+        self._seen += 1
+        if self._seen % self.sample:
+            return
+        msec, tenant, ip, block, redirect, src, uri, fp, noscript, ua = parts
+        if not tenant or tenant == "-":
+            return
+        ua = _unescape(ua)
+        ua = "" if ua == "-" else ua
+        hit = self.exporter.resolve(tenant, ua)
+        if block == "1":
+            outcome = "block"
+            rule = f"blocked:{hit.pattern}" if hit else "blocked:edge"
+            redirect_url = None
+        elif redirect and redirect != "-":
+            outcome = "redirect"
+            rule = f"redirect:{hit.pattern}" if hit else "redirect:edge"
+            redirect_url = _unescape(redirect)
+        else:
+            return
+        path = unquote(src) if src and src != "-" else _unescape(uri)
+        fingerprint = next((unquote(v) for v in (fp, noscript)
+                            if v and v != "-"), "")
+        row = build_log_row(tenant_id=tenant,
+                            ip_address=ip,
+                            user_agent=ua,
+                            fingerprint=fingerprint,
+                            path=path,
+                            outcome=outcome,
+                            rule=rule,
+                            redirect_url=redirect_url,
+                            sample_weight=self.sample)
+        try:
+            row["timestamp"] = datetime.utcfromtimestamp(float(msec))
+        except ValueError:
+            pass
+        access_log_writer.submit(row, wait=False)
+
+
+nginx_exporter = NginxExporter(path=settings.NGINX_EXPORT_PATH,
+                               test_cmd=settings.NGINX_TEST_CMD,
+                               reload_cmd=settings.NGINX_RELOAD_CMD,
+                               debounce=settings.NGINX_EXPORT_DEBOUNCE)
+
+edge_log_tailer = EdgeLogTailer(path=settings.NGINX_EDGE_LOG,
+                                sample=settings.NGINX_EDGE_SAMPLE,
+                                exporter=nginx_exporter)
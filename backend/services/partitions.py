@@ -0,0 +1,208 @@
+# backend/services/partitions.py
+import os
+import re
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from config import settings
+from db import engine
+from services.state import state
+
+# access_log está particionada por rango de timestamp en Postgres (migración
+# 9b3e6a0f4c12); en otros motores este módulo no hace nada.
+PARENT = "access_log"
+DEFAULT_PARTITION = "access_log_default"
+_BOUND = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+
+def _month_index(dt: datetime) -> int:
+    return dt.year * 12 + dt.month - 1
+
+
+def _from_index(i: int) -> datetime:
+    return datetime(i // 12, i % 12 + 1, 1)
+
+
+def partition_bounds(dt: datetime, months: int):
+    """[inicio, fin) de la partición que contiene dt, alineada a `months`."""
+    i = _month_index(dt)
+    i -= i % months
+    return _from_index(i), _from_index(i + months)
+
+
+def partition_name(start: datetime) -> str:
+    return f"{PARENT}_p{start:%Y%m}"
+
+
+def parse_bound(expr: str):
+    """(inicio, fin) de pg_get_expr(relpartbound), o None para DEFAULT."""
+    m = _BOUND.search(expr or "")
+    if not m:
+        return None
+    return (datetime.fromisoformat(m.group(1)),
+            datetime.fromisoformat(m.group(2)))
+
+
+def is_partitioned(conn) -> bool:
+    if conn.dialect.name != "postgresql":
+        return False
+    return conn.execute(
+        text("SELECT 1 FROM pg_partitioned_table "
+             "WHERE partrelid = to_regclass(:t)"), {"t": PARENT}).first() is not None
+
+
+def list_partitions(conn) -> dict:
+    """nombre -> (inicio, fin) o None para la partición por defecto."""
+    rows = conn.execute(
+        text("SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) "
+             "FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+             "WHERE i.inhparent = to_regclass(:t)"), {"t": PARENT})
+    return {name: parse_bound(expr) for name, expr in rows}
+
+
+def _create_partition(conn, name: str, start: datetime, end: datetime,
+                      has_default: bool):
+    bound = f"FROM ('{start:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')"
+    strays = has_default and conn.execute(text(
+        f'SELECT 1 FROM {DEFAULT_PARTITION} WHERE "timestamp" >= :s '
+        f'AND "timestamp" < :e LIMIT 1'), {"s": start, "e": end}).first()
+    if not strays:
+        conn.execute(text(f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF '
+                          f"{PARENT} FOR VALUES {bound}"))
+        return
+    # Postgres no deja crear la partición si la DEFAULT ya tiene filas de su
+    # rango: se separa la DEFAULT, se crea la partición, se le pasan esas
+    # filas y se vuelve a enganchar, todo en la transacción de conn
+    rng = {"s": start, "e": end}
+    where = '"timestamp" >= :s AND "timestamp" < :e'
+    conn.execute(text(f"ALTER TABLE {PARENT} DETACH PARTITION {DEFAULT_PARTITION}"))
+    conn.execute(text(f'CREATE TABLE "{name}" PARTITION OF {PARENT} '
+                      f"FOR VALUES {bound}"))
+    conn.execute(text(f'INSERT INTO "{name}" SELECT * FROM {DEFAULT_PARTITION} '
+                      f"WHERE {where}"), rng)
+    conn.execute(text(f"DELETE FROM {DEFAULT_PARTITION} WHERE {where}"), rng)
+    conn.execute(text(f"ALTER TABLE {PARENT} ATTACH PARTITION "
+                      f"{DEFAULT_PARTITION} DEFAULT"))
+
+
+def ensure_partitions(conn, now: datetime = None, ahead: int = None,
+                      months: int = None) -> list:
+    """
+    Crea las particiones desde la del mes actual hasta `ahead` meses por
+    delante. Un periodo que ya cubre otra partición (p.ej. creada con otro
+    ACCESS_LOG_PARTITION_MONTHS) se salta. Las filas de ese periodo que
+    hubieran caído en la partición por defecto pasan a la nueva.
+    """
+    now = now or datetime.utcnow()
+    ahead = settings.ACCESS_LOG_PARTITIONS_AHEAD if ahead is None else ahead
+    months = months or settings.ACCESS_LOG_PARTITION_MONTHS
+    partitions = list_partitions(conn)
+    has_default = DEFAULT_PARTITION in partitions
+    existing = [b for b in partitions.values() if b]
+    created = []
+    start, end = partition_bounds(now, months)
+    last = _from_index(_month_index(now) + ahead)
+    while start <= last:
+        if not any(s < end and start < e for s, e in existing):
+            name = partition_name(start)
+            _create_partition(conn, name, start, end, has_default)
+            existing.append((start, end))
+            created.append(name)
+        start, end = end, partition_bounds(end, months)[1]
+    return created
+
+
+def drop_expired(conn, retention_days: int = None, now: datetime = None) -> list:
+    """
+    Retención: separa y borra las particiones cuyo rango termina antes de
+    now - retention_days. Es un DROP TABLE por partición, sin DELETE masivo.
+    """
+    days = (settings.ACCESS_LOG_RETENTION_DAYS
+            if retention_days is None else retention_days)
+    if days <= 0:
+        return []
+    cutoff = (now or datetime.utcnow()) - timedelta(days=days)
+    dropped = []
+    for name, bounds in sorted(list_partitions(conn).items()):
+        if bounds and bounds[1] <= cutoff:
+            conn.execute(text(f'ALTER TABLE {PARENT} DETACH PARTITION "{name}"'))
+            conn.execute(text(f'DROP TABLE "{name}"'))
+            dropped.append(name)
+    return dropped
+
+
+def default_rows(conn) -> int:
+    """Filas que han caído en la partición por defecto (fuera de rango)."""
+    if DEFAULT_PARTITION not in list_partitions(conn):
+        return 0
+    return conn.execute(
+        text(f"SELECT count(*) FROM {DEFAULT_PARTITION}")).scalar() or 0
+
+
+class PartitionMaintainer:
+    """
+    Mantiene las particiones de access_log: crea las de los próximos meses y
+    aplica la retención. Cada interval segundos lo hace un solo worker
+    (clave en el estado compartido). Fuera de Postgres no arranca; en un
+    Postgres con access_log sin particionar avisa en cada pasada.
+    """
+
+    KEY = "access_log:partitions"
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running or engine.dialect.name != "postgresql":
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name="access-log-partitions",
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        if self.running:
+            self._stop.set()
+            self._thread.join(timeout)
+            self._thread = None
+
+    def run_once(self):
+        with engine.begin() as conn:
+            if not is_partitioned(conn):
+                # p.ej. creada por Base.metadata.create_all sin alembic
+                print(f"ERROR: {PARENT} no está particionada en Postgres: no se "
+                      f"crean particiones ni se aplica ACCESS_LOG_RETENTION_DAYS. "
+                      f"Hay que migrarla con alembic (9b3e6a0f4c12)")
+                return
+            created = ensure_partitions(conn)
+            dropped = drop_expired(conn)
+            stray = default_rows(conn)
+        if created or dropped:
+            print(f"Particiones de access_log: creadas {created}, "
+                  f"borradas {dropped}")
+        if stray:
+            print(f"{stray} filas en {DEFAULT_PARTITION}: faltan particiones "
+                  f"(revisa ACCESS_LOG_PARTITIONS_AHEAD)")
+
+    def _run(self):
+        while True:
+            if state.add(self.KEY, os.getpid(), ttl=self.interval * 0.9):
+                try:
+                    self.run_once()
+                except Exception as e:
+                    print(f"Error al mantener las particiones de access_log: {e}")
+            if self._stop.wait(self.interval):
+                return
+
+
+partition_maintainer = PartitionMaintainer(
+    interval=settings.PARTITION_MAINTENANCE_INTERVAL)
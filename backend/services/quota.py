@@ -0,0 +1,211 @@
+# backend/services/quota.py
+import threading
+
+from sqlalchemy import bindparam, func, select, update
+
+from config import settings
+from db import engine, async_engine
+from models.models import Subscription, SubscriptionPlan
+from services.state import StateBackend, call_state, state
+
+_remaining_expr = func.coalesce(Subscription.remaining_tokens,
+                                Subscription.traffic_limit)
+
+# _take(): el saldo compartido no existe (caducado o perdido) y hay que cargarlo
+_EXPIRED = object()
+
+# Saldo y tasa de muestreo de "allow" del plan de cada tenant
+_balance_query = select(
+    Subscription.user_id, _remaining_expr,
+    func.coalesce(SubscriptionPlan.allow_sample_rate, 1)).outerjoin(
+        SubscriptionPlan, SubscriptionPlan.plan == Subscription.plan)
+
+
+class QuotaMeter:
+    """
+    Cuota de tráfico (Subscription.remaining_tokens) por tenant en el estado
+    compartido (services/state.py).
+
+    consume() descuenta el saldo compartido y apunta el consumo pendiente con
+    dos incrementos atómicos, sin cargar User ni bloquear la fila. Un hilo de
+    fondo en cada worker recoge cada flush_interval el pendiente (pop atómico,
+    así ningún hit se vuelca dos veces) y lo aplica con UPDATE ... SET
+    remaining_tokens = remaining_tokens - :n.
+
+    El saldo compartido es el que manda: solo se escribe con incrementos y
+    se carga de la base de datos (menos lo pendiente) cuando no existe, al
+    registrar el tenant o cuando ha caducado (balance_ttl). Así los cambios
+    de saldo hechos fuera del pixel llegan como mucho en balance_ttl, y el
+    volcado de un worker no pisa lo que otros están descontando.
+    """
+
+    def __init__(self, flush_interval: float, state: StateBackend,
+                 balance_ttl: float = 300.0):
+        self.flush_interval = flush_interval
+        self.balance_ttl = balance_ttl
+        self.state = state
+        self._known = {}  # tenant -> tiene suscripción (caché de este worker)
+        self._rates = {}  # tenant -> allow_sample_rate de su plan
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def _key(tenant: str) -> str:
+        return f"quota:{tenant}"
+
+    @staticmethod
+    def _pending_key(tenant: str) -> str:
+        return f"quota:pending:{tenant}"
+
+    def _register(self, tenant: str, loaded):
+        remaining, rate = loaded or (None, 1)
+        self._rates[tenant] = rate
+        if remaining is not None:
+            # Lo pendiente aún no está en la base de datos. Si otro worker
+            # ya lo cargó, su saldo (con descuentos) manda
+            pending = self.state.get(self._pending_key(tenant)) or 0
+            self.state.add(self._key(tenant), remaining - pending,
+                           ttl=self.balance_ttl)
+        with self._lock:
+            self._known[tenant] = remaining is not None
+
+    def consume(self, tenant: str):
+        """
+        None si el tenant no tiene suscripción, False si la cuota está agotada
+        y True si se ha descontado un token.
+        """
+        known = self._known.get(tenant)
+        if known is None:
+            self._register(tenant, self._load([tenant]).get(tenant))
+        taken = self._take(tenant)
+        if taken is _EXPIRED:
+            self._register(tenant, self._load([tenant]).get(tenant))
+            taken = self._take(tenant)
+        return None if taken is _EXPIRED else taken
+
+    async def aconsume(self, tenant: str):
+        """
+        consume() para rutas async: la carga usa el motor async y el estado
+        compartido se toca con call_state().
+        """
+        await self.aregister(tenant)
+        taken = await call_state(self.state, self._take, tenant)
+        if taken is _EXPIRED:
+            await self.aregister(tenant, reload=True)
+            taken = await call_state(self.state, self._take, tenant)
+        return None if taken is _EXPIRED else taken
+
+    async def aregister(self, tenant: str, reload: bool = False):
+        """
+        Carga con el motor async el saldo de un tenant que este worker no
+        conoce (o cuyo saldo compartido ha caducado, con reload).
+        """
+        if reload or self._known.get(tenant) is None:
+            async with async_engine.connect() as conn:
+                rows = (await conn.execute(
+                    _balance_query.where(
+                        Subscription.user_id == tenant))).all()
+            await call_state(self.state, self._register, tenant,
+                             tuple(rows[0][1:]) if rows else None)
+
+    def _take(self, tenant: str):
+        """Como consume(), o _EXPIRED si no hay saldo compartido que descontar."""
+        if not self._known.get(tenant):
+            return None
+        key = self._key(tenant)
+        left = self.state.incr_existing(key, -1)
+        if left is None:
+            return _EXPIRED
+        if left < 0:
+            self.state.incr(key, 1)
+            return False
+        self.state.incr(self._pending_key(tenant), 1)
+        return True
+
+    def sample_rate(self, tenant: str) -> int:
+        """Se guarda 1 de cada N hits "allow" (1 = todos)."""
+        return self._rates.get(tenant) or 1
+
+    def _load(self, tenants) -> dict:
+        with engine.connect() as conn:
+            rows = conn.execute(
+                _balance_query.where(Subscription.user_id.in_(tenants))).all()
+        return {user_id: (remaining, rate) for user_id, remaining, rate in rows}
+
+    def flush(self):
+        with self._lock:
+            # Los tenants sin suscripción se vuelven a consultar en su próximo
+            # hit (como mucho una vez por intervalo) y no crecen sin límite
+            tenants = [t for t, has in self._known.items() if has]
+            self._known = {t: True for t in tenants}
+            self._rates = {t: self._rates.get(t, 1) for t in tenants}
+        pending = {}
+        for t in tenants:
+            n = self.state.pop(self._pending_key(t))
+            if n:
+                pending[t] = n
+        if pending:
+            try:
+                with engine.begin() as conn:
+                    conn.execute(
+                        update(Subscription).where(
+                            Subscription.user_id == bindparam("b_tenant")).
+                        values(remaining_tokens=_remaining_expr -
+                               bindparam("b_used")),
+                        [{"b_tenant": t, "b_used": n}
+                         for t, n in pending.items()])
+            except Exception as e:
+                print(f"Error al volcar cuotas: {e}")
+                for t, n in pending.items():
+                    self.state.incr(self._pending_key(t), n)
+                return
+        if not tenants:
+            return
+        # Tasas de muestreo y suscripciones dadas de baja. El saldo no se
+        # toca: se recarga solo cuando caduca (ver _take)
+        try:
+            fresh = self._load(tenants)
+        except Exception as e:
+            print(f"Error al refrescar cuotas: {e}")
+            return
+        for t in tenants:
+            value, rate = fresh.get(t) or (None, 1)
+            self._rates[t] = rate
+            if value is None:
+                with self._lock:
+                    self._known.pop(t, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            known = list(self._known.values())
+        return {"tenants": len(known), "subscribed": sum(known)}
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name="quota-meter",
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        if self.running:
+            self._stop.set()
+            self._thread.join(timeout)
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+
+quota_meter = QuotaMeter(flush_interval=settings.QUOTA_FLUSH_INTERVAL,
+                         state=state,
+                         balance_ttl=settings.QUOTA_BALANCE_TTL)
@@ -0,0 +1,202 @@
+# backend/services/rollup.py
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import case, func, select
+
+from db import engine
+from models.models import AccessLog, AccessLogHourly
+from services.agents import parse_agent
+
+HOUR = timedelta(hours=1)
+# Filas de access_log que se agregan en memoria antes de escribir (rebuild)
+REBUILD_CHUNK = 50_000
+
+
+def truncate_hour(ts: datetime) -> datetime:
+    return ts.replace(minute=0, second=0, microsecond=0)
+
+
+def agent_family(stored: Optional[str], crawler_family: Optional[str],
+                 ua: Optional[str]) -> str:
+    """
+    agent_family guardado al ingerir o, en filas anteriores a esa columna,
+    el mismo cálculo a partir del UA (services/agents.py).
+    """
+    return stored or parse_agent(ua, crawler_family).family
+
+
+def _aggregate(rows):
+    """(hits ponderados, filas guardadas) por clave del rollup."""
+    hits, stored = Counter(), Counter()
+    for row in rows:
+        key = (row["tenant_id"] or "", truncate_hour(row["timestamp"]),
+               row["outcome"] or "",
+               agent_family(row.get("agent_family"), row.get("crawler_family"),
+                            row.get("user_agent")))
+        hits[key] += row.get("sample_weight") or 1
+        stored[key] += 1
+    return hits, stored
+
+
+def insert_for(dialect: str):
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        return None
+    return insert
+
+
+def _upsert(conn, hits: Counter, stored: Counter):
+    if not hits:
+        return
+    # Orden fijo de claves: dos workers que suman a la vez no se bloquean
+    # mutuamente en Postgres
+    values = []
+    for key in sorted(hits):
+        tenant, hour, outcome, family = key
+        values.append({"tenant_id": tenant, "hour": hour, "outcome": outcome,
+                       "agent_family": family, "hits": hits[key],
+                       "rows": stored[key]})
+    insert = insert_for(conn.dialect.name)
+    table = AccessLogHourly.__table__
+    if insert is None:
+        # Otros dialectos: UPDATE y, si no existía, INSERT
+        for v in values:
+            updated = conn.execute(table.update().where(
+                table.c.tenant_id == v["tenant_id"], table.c.hour == v["hour"],
+                table.c.outcome == v["outcome"],
+                table.c.agent_family == v["agent_family"]).values(
+                    hits=table.c.hits + v["hits"],
+                    rows=table.c.rows + v["rows"]))
+            if not updated.rowcount:
+                conn.execute(table.insert(), v)
+        return
+    stmt = insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["tenant_id", "hour", "outcome", "agent_family"],
+        set_={
+            "hits": table.c.hits + stmt.excluded.hits,
+            "rows": table.c.rows + stmt.excluded.rows,
+        })
+    conn.execute(stmt, values)
+
+
+def update_hourly(conn, rows: list):
+    """
+    Hook de services/ingest.py: suma el lote recién insertado en
+    access_log_hourly (clave tenant, hora, outcome, agent_family).
+    """
+    _upsert(conn, *_aggregate(rows))
+
+
+def hourly_counts(db, cutoff: datetime, tenant: str = None) -> Counter:
+    """
+    Hits ponderados por (outcome, agent_family) desde cutoff. Las horas
+    completas salen de access_log_hourly; el tramo hasta la primera hora
+    en punto, de access_log (menos de una hora, por el índice de timestamp).
+    """
+    boundary = truncate_hour(cutoff)
+    if boundary < cutoff:
+        boundary += HOUR
+
+    rolled = db.query(AccessLogHourly.outcome, AccessLogHourly.agent_family,
+                      func.sum(AccessLogHourly.hits)).filter(
+                          AccessLogHourly.hour >= boundary)
+    if tenant is not None:
+        rolled = rolled.filter(AccessLogHourly.tenant_id == tenant)
+    counts = Counter()
+    for outcome, family, hits in rolled.group_by(AccessLogHourly.outcome,
+                                                 AccessLogHourly.agent_family):
+        counts[(outcome, family)] += int(hits or 0)
+
+    if boundary > cutoff:
+        # El UA solo hace falta en filas sin agent_family
+        legacy = AccessLog.agent_family.is_(None)
+        crawler = case((legacy, AccessLog.crawler_family))
+        ua = case((legacy, AccessLog.user_agent))
+        raw = db.query(AccessLog.outcome, AccessLog.agent_family, crawler, ua,
+                       func.sum(func.coalesce(AccessLog.sample_weight, 1))).filter(
+                           AccessLog.timestamp >= cutoff,
+                           AccessLog.timestamp < boundary)
+        if tenant is not None:
+            raw = raw.filter(AccessLog.tenant_id == tenant)
+        for outcome, stored, family, agent, hits in raw.group_by(
+                AccessLog.outcome, AccessLog.agent_family, crawler, ua):
+            counts[(outcome or "", agent_family(stored, family, agent))] += int(hits or 0)
+    return counts
+
+
+def approx_rows(db, cutoff: datetime, tenant: str) -> int:
+    """
+    Filas guardadas en access_log desde cutoff, aproximadas a horas enteras
+    (cuenta la hora de cutoff completa) y sin lo que aún no se ha volcado.
+    """
+    total = db.query(func.sum(AccessLogHourly.rows)).filter(
+        AccessLogHourly.tenant_id == tenant,
+        AccessLogHourly.hour >= truncate_hour(cutoff)).scalar()
+    return int(total or 0)
+
+
+def rows_since(db, tenant: str, since: Optional[datetime] = None) -> int:
+    """
+    Filas guardadas en access_log con timestamp > since (todas si no hay
+    since): horas completas desde access_log_hourly y el resto de la hora
+    de since desde access_log.
+    """
+    rolled = db.query(func.sum(AccessLogHourly.rows)).filter(
+        AccessLogHourly.tenant_id == tenant)
+    if since is None:
+        return int(rolled.scalar() or 0)
+    boundary = truncate_hour(since) + HOUR
+    total = rolled.filter(AccessLogHourly.hour >= boundary).scalar() or 0
+    total += db.query(func.count(AccessLog.id)).filter(
+        AccessLog.tenant_id == tenant, AccessLog.timestamp > since,
+        AccessLog.timestamp < boundary).scalar() or 0
+    return int(total)
+
+
+def outcome_totals(counts: Counter) -> Counter:
+    totals = Counter()
+    for (outcome, _), hits in counts.items():
+        totals[outcome] += hits
+    return totals
+
+
+def rebuild(since: datetime = None, until: datetime = None,
+            tenant: str = None) -> int:
+    """
+    Recalcula access_log_hourly desde access_log para las horas en
+    [since, until) (por defecto, todo hasta la hora en curso, que mantiene
+    el writer). Devuelve las filas de access_log leídas.
+    """
+    until = truncate_hour(until or datetime.utcnow())
+    since = truncate_hour(since) if since else None
+    table = AccessLogHourly.__table__
+    columns = (AccessLog.tenant_id, AccessLog.timestamp, AccessLog.outcome,
+               AccessLog.agent_family, AccessLog.crawler_family,
+               AccessLog.user_agent, AccessLog.sample_weight)
+
+    def scoped(stmt, ts_column, tenant_column):
+        stmt = stmt.where(ts_column < until)
+        if since is not None:
+            stmt = stmt.where(ts_column >= since)
+        if tenant is not None:
+            stmt = stmt.where(tenant_column == tenant)
+        return stmt
+
+    read = 0
+    with engine.begin() as conn:
+        conn.execute(scoped(table.delete(), table.c.hour, table.c.tenant_id))
+        # yield_per en la sentencia, no en la conexión: en Postgres las
+        # escrituras de _upsert irían también por un cursor de servidor
+        result = conn.execute(
+            scoped(select(*columns), AccessLog.timestamp,
+                   AccessLog.tenant_id).execution_options(yield_per=REBUILD_CHUNK))
+        for chunk in result.mappings().partitions():
+            read += len(chunk)
+            _upsert(conn, *_aggregate(chunk))
+    return read
@@ -0,0 +1,171 @@
+# backend/services/rule_cache.py
+import asyncio
+import itertools
+import threading
+import time
+import weakref
+
+from services.matcher import compile_ruleset
+from services.state import StateBackend, call_state, state
+
+# Cachés vivas en este proceso, para invalidarlas sin esperar a la comprobación
+_caches = weakref.WeakSet()
+
+
+class RuleGenerations:
+    """
+    Contador de generación de reglas por tenant en el estado compartido
+    (services/state.py): bump() al escribir reglas, current() al comprobar.
+    Las reglas compiladas no se comparten; cada worker recompila las suyas
+    cuando ve cambiar la generación.
+    """
+
+    def __init__(self, state: StateBackend):
+        self.state = state
+
+    @staticmethod
+    def _key(tenant: str) -> str:
+        return f"rules:gen:{tenant}"
+
+    def current(self, tenant: str):
+        return self.state.get(self._key(tenant))
+
+    async def acurrent(self, tenant: str):
+        return await call_state(self.state, self.current, tenant)
+
+    def bump(self, tenant: str):
+        self.state.incr(self._key(tenant))
+
+
+class _Entry:
+    __slots__ = ("ruleset", "generation", "loaded_at", "checked_at")
+
+    def __init__(self, ruleset, generation, now):
+        self.ruleset = ruleset
+        self.generation = generation
+        self.loaded_at = now
+        self.checked_at = now
+
+
+class RuleCache:
+    """
+    Caché de CompiledRuleset por tenant.
+
+    - Carga single-flight: ante un fallo solo un hilo llama al loader; si ya
+      hay una versión anterior, el resto la sigue sirviendo mientras tanto.
+    - Invalidación explícita con invalidate_rules() al escribir reglas; el
+      resto de workers la ven por el contador de generación, que se consulta
+      como mucho cada check_interval segundos.
+    - ttl se mantiene como red de seguridad.
+    Cada carga recibe un número de versión nuevo (ruleset.version).
+    aget() es la variante para rutas async, con un aloader corrutina.
+    """
+
+    def __init__(self, loader, default, ttl: float, check_interval: float,
+                 generations: RuleGenerations, aloader=None):
+        self.loader = loader
+        self.aloader = aloader
+        self.default = default
+        self.ttl = ttl
+        self.check_interval = check_interval
+        self.generations = generations
+        self._entries = {}
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        self._tasks = {}  # cargas async en curso por tenant
+        self._versions = itertools.count(1)
+        _caches.add(self)
+
+    def _lock_for(self, tenant: str) -> threading.Lock:
+        lock = self._locks.get(tenant)
+        if lock is None:
+            with self._locks_guard:
+                lock = self._locks.setdefault(tenant, threading.Lock())
+        return lock
+
+    def _fresh(self, entry: _Entry, now: float) -> bool:
+        if now - entry.loaded_at > self.ttl:
+            return False
+        if now - entry.checked_at > self.check_interval:
+            if self.generations.current(entry.ruleset.tenant) != entry.generation:
+                return False
+            entry.checked_at = now
+        return True
+
+    async def _afresh(self, entry: _Entry, now: float) -> bool:
+        if now - entry.loaded_at > self.ttl:
+            return False
+        if now - entry.checked_at > self.check_interval:
+            generation = await self.generations.acurrent(entry.ruleset.tenant)
+            if generation != entry.generation:
+                return False
+            entry.checked_at = now
+        return True
+
+    def get(self, tenant: str):
+        now = time.time()
+        entry = self._entries.get(tenant)
+        if entry is not None and self._fresh(entry, now):
+            return entry.ruleset
+
+        lock = self._lock_for(tenant)
+        if entry is not None:
+            if not lock.acquire(blocking=False):
+                return entry.ruleset  # otro hilo está recargando
+        else:
+            lock.acquire()
+        try:
+            current = self._entries.get(tenant)
+            if current is not None and current is not entry:
+                return current.ruleset  # lo ha cargado otro hilo
+            # La generación se lee antes de cargar: una escritura concurrente
+            # deja la entrada con una generación antigua y se recarga después
+            generation = self.generations.current(tenant)
+            return self._store(tenant, generation, self.loader(tenant))
+        finally:
+            lock.release()
+
+    async def aget(self, tenant: str):
+        entry = self._entries.get(tenant)
+        if entry is not None and await self._afresh(entry, time.time()):
+            return entry.ruleset
+        task = self._tasks.get(tenant)
+        if task is None:
+            task = asyncio.ensure_future(self._aload(tenant))
+            self._tasks[tenant] = task
+            task.add_done_callback(lambda t: self._loaded(tenant, t))
+        if entry is not None:
+            return entry.ruleset  # se sirve la versión anterior mientras carga
+        return await asyncio.shield(task)
+
+    def _loaded(self, tenant: str, task):
+        self._tasks.pop(tenant, None)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Error al cargar reglas de {tenant}: {task.exception()}")
+
+    async def _aload(self, tenant: str):
+        generation = await self.generations.acurrent(tenant)
+        return self._store(tenant, generation, await self.aloader(tenant))
+
+    def _store(self, tenant: str, generation, cfg: dict):
+        if not cfg["blockedAgents"] and not cfg["limitedAgents"] and not cfg[
+                "redirectAgents"] and not cfg.get("ipRules"):
+            cfg = self.default
+        ruleset = compile_ruleset(cfg,
+                                  tenant=tenant,
+                                  version=next(self._versions))
+        self._entries[tenant] = _Entry(ruleset, generation, time.time())
+        return ruleset
+
+    def invalidate(self, tenant: str):
+        self._entries.pop(tenant, None)
+
+
+rule_generations = RuleGenerations(state)
+
+
+def invalidate_rules(tenant: str):
+    """Llamar después de confirmar cambios en las FirewallRule de un tenant."""
+    for cache in list(_caches):
+        cache.invalidate(tenant)
+    rule_generations.bump(tenant)
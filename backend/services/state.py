@@ -0,0 +1,511 @@
+# backend/services/state.py
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from typing import Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from config import settings
+
+
+class StateBackend:
+    """
+    Estado compartido del pixel: contadores enteros por clave con caducidad
+    opcional (ttl en segundos). Lo usan las ventanas de limits.py, la cuota
+    de quota.py y las generaciones de reglas de rule_cache.py.
+
+    Implementaciones:
+      - "local": diccionario del proceso (un solo worker, pruebas).
+      - "shm":   fichero mmap compartido por los workers de una máquina.
+      - "redis": servidor con protocolo Redis, compartido entre máquinas.
+
+    blocking indica si las operaciones pueden bloquear (flock, red): las
+    rutas async las llaman con call_state().
+    """
+
+    blocking = True
+
+    def incr(self, key: str, amount: int = 1, ttl: float = None) -> int:
+        raise NotImplementedError
+
+    def incr_existing(self, key: str, amount: int = 1) -> Optional[int]:
+        """Como incr, pero None (sin crearla) si la clave no existe o ha caducado."""
+        raise NotImplementedError
+
+    def get(self, key: str) -> Optional[int]:
+        raise NotImplementedError
+
+    def get_many(self, keys: list) -> list:
+        return [self.get(k) for k in keys]
+
+    def set(self, key: str, value: int, ttl: float = None):
+        raise NotImplementedError
+
+    def add(self, key: str, value: int, ttl: float = None) -> bool:
+        """Como set, pero solo si la clave no existe. True si la ha creado."""
+        raise NotImplementedError
+
+    def pop(self, key: str) -> int:
+        """Lee y borra la clave de forma atómica (0 si no existía)."""
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+
+class LocalStateBackend(StateBackend):
+
+    blocking = False
+
+    def __init__(self):
+        self._data = {}  # clave -> [valor, caduca_en o None]
+        self._lock = threading.Lock()
+        self._ops = 0
+
+    def _live(self, key, now):
+        item = self._data.get(key)
+        if item is not None and item[1] is not None and item[1] <= now:
+            del self._data[key]
+            return None
+        return item
+
+    def _purge(self, now):
+        expired = [k for k, (_, exp) in self._data.items()
+                   if exp is not None and exp <= now]
+        for k in expired:
+            del self._data[k]
+
+    def incr(self, key, amount=1, ttl=None):
+        now = time.monotonic()
+        with self._lock:
+            item = self._live(key, now)
+            if item is None:
+                item = self._data[key] = [0, now + ttl if ttl else None]
+            item[0] += amount
+            self._ops += 1
+            if self._ops % 50_000 == 0:
+                self._purge(now)
+            return item[0]
+
+    def incr_existing(self, key, amount=1):
+        with self._lock:
+            item = self._live(key, time.monotonic())
+            if item is None:
+                return None
+            item[0] += amount
+            return item[0]
+
+    def get(self, key):
+        with self._lock:
+            item = self._live(key, time.monotonic())
+            return None if item is None else item[0]
+
+    def get_many(self, keys):
+        now = time.monotonic()
+        with self._lock:
+            out = []
+            for k in keys:
+                item = self._live(k, now)
+                out.append(None if item is None else item[0])
+            return out
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = [value, time.monotonic() + ttl if ttl else None]
+
+    def add(self, key, value, ttl=None):
+        now = time.monotonic()
+        with self._lock:
+            if self._live(key, now) is not None:
+                return False
+            self._data[key] = [value, now + ttl if ttl else None]
+            return True
+
+    def pop(self, key):
+        with self._lock:
+            item = self._live(key, time.monotonic())
+            self._data.pop(key, None)
+            return 0 if item is None else item[0]
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+
+class SharedMemoryStateBackend(StateBackend):
+    """
+    Tabla hash de direccionamiento abierto sobre un fichero mmap, compartida
+    por todos los procesos que abren la misma ruta. Cada hueco guarda el hash
+    de 64 bits de la clave, el valor y la caducidad (tiempo de pared). Las
+    operaciones se serializan con flock entre procesos y un Lock entre hilos.
+
+    La cabecera lleva los huecos ocupados (claves y lápidas) y el umbral de
+    compactación: al pasarlo se reescribe la tabla sin lápidas ni claves
+    caducadas, bajo el mismo flock. Si aun así una clave no cabe (o no se
+    puede recolocar al compactar), vive en un LocalStateBackend de este
+    proceso, por hash: se pierde el reparto entre workers para esa clave,
+    pero el pixel sigue respondiendo.
+
+    El fichero no se redimensiona nunca: uno de otro tamaño (otra versión u
+    otro STATE_SHM_SLOTS) puede estar mapeado por workers vivos, así que se
+    rechaza. Cada proceso mantiene un flock compartido sobre "<path>.users"
+    mientras vive; el primero que arranca sin ningún otro vivo vacía la
+    tabla, para no heredar ventanas ni saldos de cuota del despliegue anterior.
+    """
+
+    # versión, huecos ocupados, compactar al llegar a, última compactación
+    _HEADER = struct.Struct("<QQQd")
+    _SLOT = struct.Struct("<Qqd")  # hash, valor, caduca_en (0 = nunca)
+    _VERSION = 2
+    _EMPTY, _TOMBSTONE = 0, 1
+    MAX_PROBES = 256
+    MAX_LOAD = 0.7  # ocupación (con lápidas) que dispara la compactación
+    COMPACT_INTERVAL = 10.0  # segundos entre compactaciones por cadena llena
+
+    def __init__(self, path: str, slots: int):
+        self.path = path
+        self.slots = slots
+        size = self._HEADER.size + slots * self._SLOT.size
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        self._users = os.open(path + ".users", os.O_RDWR | os.O_CREAT, 0o600)
+        self._lock = threading.Lock()
+        self._spill = LocalStateBackend()  # hash -> valor
+        self._spilled = False
+        try:
+            self._open(size)
+        except BaseException:
+            os.close(self._users)
+            os.close(self._fd)
+            raise
+
+    def _open(self, size):
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            current = os.fstat(self._fd).st_size
+            if current == 0:
+                # Recién creado: nadie lo tiene mapeado todavía
+                os.ftruncate(self._fd, size)
+            elif current != size:
+                raise RuntimeError(
+                    f"{self.path} mide {current} bytes y con STATE_SHM_SLOTS="
+                    f"{self.slots} deberían ser {size}: es de otra versión o de "
+                    f"otra configuración. Borrarlo con todos los workers "
+                    f"parados o usar otro STATE_SHM_PATH")
+            self._mm = mmap.mmap(self._fd, size)
+            version = self._HEADER.unpack_from(self._mm, 0)[0]
+            if version not in (0, self._VERSION):
+                raise RuntimeError(f"{self.path} es de la versión {version} del "
+                                   f"estado compartido, no de la {self._VERSION}")
+            if self._first_user() or version == 0:
+                self._mm[:] = bytes(size)
+                self._set_header(0, self._threshold(0), 0.0)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _first_user(self) -> bool:
+        """
+        Apunta este proceso como usuario de la tabla; True si no había
+        ninguno vivo. Se llama con el flock exclusivo de la tabla, así que
+        dos procesos no pueden ver a la vez que son los primeros.
+        """
+        try:
+            fcntl.flock(self._users, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            first = True
+        except BlockingIOError:
+            first = False
+        fcntl.flock(self._users, fcntl.LOCK_SH)
+        return first
+
+    def _hash(self, key: str) -> int:
+        h = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(),
+                           "little")
+        return h if h > self._TOMBSTONE else h + 2
+
+    def _locked(self, fn, *args):
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                return fn(*args)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _threshold(self, used: int) -> int:
+        # Tras compactar una tabla casi llena de claves vivas, no se vuelve
+        # a compactar hasta que entre otra octava parte
+        return max(int(self.slots * self.MAX_LOAD), used + self.slots // 8)
+
+    def _set_header(self, used, compact_at, compacted_at):
+        self._HEADER.pack_into(self._mm, 0, self._VERSION, used, compact_at,
+                               compacted_at)
+
+    def _read(self, i):
+        return self._SLOT.unpack_from(self._mm,
+                                      self._HEADER.size + i * self._SLOT.size)
+
+    def _write(self, i, h, value, expires):
+        self._SLOT.pack_into(self._mm, self._HEADER.size + i * self._SLOT.size,
+                             h, value, expires)
+
+    def _find(self, h, now, create):
+        """Índice del hueco de la clave (o uno libre si create), o None."""
+        free = None
+        start = h % self.slots
+        for probe in range(self.MAX_PROBES):
+            i = (start + probe) % self.slots
+            slot_h, _, expires = self._read(i)
+            if slot_h == self._EMPTY:
+                return (free if free is not None else i) if create else None
+            expired = expires and expires <= now
+            if slot_h == h and not expired:
+                return i
+            if slot_h == self._TOMBSTONE or expired:
+                if expired:
+                    self._write(i, self._TOMBSTONE, 0, 0)
+                if free is None:
+                    free = i
+        return free if create else None
+
+    def _claim(self, h, now):
+        """
+        Hueco para escribir la clave, compactando si hace falta; None si la
+        tabla está llena de claves vivas.
+        """
+        _, used, compact_at, compacted_at = self._HEADER.unpack_from(self._mm, 0)
+        i = self._find(h, now, create=True)
+        if i is None:
+            # Cadena llena: se compacta, pero no en cada hit si lo está de verdad
+            if now - compacted_at < self.COMPACT_INTERVAL:
+                return None
+        elif self._read(i)[0] != self._EMPTY:
+            return i  # la propia clave o una lápida: no cambia la ocupación
+        elif used + 1 < compact_at:
+            self._set_header(used + 1, compact_at, compacted_at)
+            return i
+        self._compact(now)
+        i = self._find(h, now, create=True)
+        if i is not None and self._read(i)[0] == self._EMPTY:
+            _, used, compact_at, compacted_at = self._HEADER.unpack_from(self._mm, 0)
+            self._set_header(used + 1, compact_at, compacted_at)
+        return i
+
+    def _compact(self, now):
+        """Reescribe la tabla solo con las claves vivas."""
+        offset = self._HEADER.size
+        live = [(h, value, expires) for h, value, expires in
+                self._SLOT.iter_unpack(self._mm[offset:])
+                if h > self._TOMBSTONE and not (expires and expires <= now)]
+        self._mm[offset:] = bytes(self.slots * self._SLOT.size)
+        used = 0
+        for h, value, expires in live:
+            start = h % self.slots
+            for probe in range(self.MAX_PROBES):
+                i = (start + probe) % self.slots
+                if self._read(i)[0] == self._EMPTY:
+                    self._write(i, h, value, expires)
+                    used += 1
+                    break
+            else:
+                # Sin hueco en su cadena: se queda en este proceso
+                self._full(f"#{h:x}")
+                self._spill.set(h, value, expires - now if expires else None)
+        self._set_header(used, self._threshold(used), now)
+
+    def _get_locked(self, key, now):
+        i = self._find(self._hash(key), now, create=False)
+        return None if i is None else self._read(i)[1]
+
+    def _incr_locked(self, key, amount, ttl):
+        now = time.time()
+        h = self._hash(key)
+        i = self._claim(h, now)
+        if i is None:
+            return None
+        slot_h, value, expires = self._read(i)
+        if slot_h != h:
+            value, expires = 0, (now + ttl if ttl else 0)
+        value += amount
+        self._write(i, h, value, expires)
+        return value
+
+    def _incr_existing_locked(self, key, amount):
+        i = self._find(self._hash(key), time.time(), create=False)
+        if i is None:
+            return None
+        h, value, expires = self._read(i)
+        self._write(i, h, value + amount, expires)
+        return value + amount
+
+    def _set_locked(self, key, value, ttl, only_new):
+        now = time.time()
+        h = self._hash(key)
+        i = self._claim(h, now)
+        if i is None:
+            return None
+        if only_new and self._read(i)[0] == h:
+            return False
+        self._write(i, h, value, now + ttl if ttl else 0)
+        return True
+
+    def _pop_locked(self, key):
+        i = self._find(self._hash(key), time.time(), create=False)
+        if i is None:
+            return 0
+        value = self._read(i)[1]
+        self._write(i, self._TOMBSTONE, 0, 0)
+        return value
+
+    def _full(self, key):
+        if not self._spilled:
+            self._spilled = True
+            print(f"Estado compartido lleno ({self.path}): "
+                  f"las claves que no caben quedan en este proceso, p.ej. {key}")
+
+    def _spilled_key(self, key) -> bool:
+        return self._spilled and self._spill.get(self._hash(key)) is not None
+
+    def incr(self, key, amount=1, ttl=None):
+        if not self._spilled_key(key):
+            value = self._locked(self._incr_locked, key, amount, ttl)
+            if value is not None:
+                return value
+            self._full(key)
+        return self._spill.incr(self._hash(key), amount, ttl)
+
+    def incr_existing(self, key, amount=1):
+        value = self._locked(self._incr_existing_locked, key, amount)
+        if value is None and self._spilled:
+            return self._spill.incr_existing(self._hash(key), amount)
+        return value
+
+    def get(self, key):
+        value = self._locked(self._get_locked, key, time.time())
+        if value is None and self._spilled:
+            return self._spill.get(self._hash(key))
+        return value
+
+    def get_many(self, keys):
+        now = time.time()
+        values = self._locked(lambda: [self._get_locked(k, now) for k in keys])
+        if self._spilled:
+            values = [self._spill.get(self._hash(k)) if v is None else v
+                      for k, v in zip(keys, values)]
+        return values
+
+    def set(self, key, value, ttl=None):
+        if self._spilled:
+            self._spill.delete(self._hash(key))
+        if self._locked(self._set_locked, key, value, ttl, False) is None:
+            self._full(key)
+            self._spill.set(self._hash(key), value, ttl)
+
+    def add(self, key, value, ttl=None):
+        if self._spilled_key(key):
+            return False
+        created = self._locked(self._set_locked, key, value, ttl, True)
+        if created is None:
+            self._full(key)
+            return self._spill.add(self._hash(key), value, ttl)
+        return created
+
+    def pop(self, key):
+        value = self._locked(self._pop_locked, key)
+        if self._spilled:
+            value += self._spill.pop(self._hash(key))
+        return value
+
+    def delete(self, key):
+        self._locked(self._pop_locked, key)
+        if self._spilled:
+            self._spill.delete(self._hash(key))
+
+
+class RedisStateBackend(StateBackend):
+    """Cualquier servidor que hable el protocolo Redis (Redis, Valkey, KeyDB)."""
+
+    # INCRBY solo si la clave existe, en una sola operación del servidor
+    _INCR_EXISTING = ("if redis.call('EXISTS', KEYS[1]) == 1 then "
+                      "return redis.call('INCRBY', KEYS[1], ARGV[1]) end")
+
+    def __init__(self, url: str):
+        import redis  # dependencia solo necesaria con STATE_BACKEND=redis
+        self._r = redis.Redis.from_url(url)
+        self._incr_existing = self._r.register_script(self._INCR_EXISTING)
+
+    @staticmethod
+    def _int(value):
+        return None if value is None else int(value)
+
+    def incr(self, key, amount=1, ttl=None):
+        if not ttl:
+            return self._r.incrby(key, amount)
+        # Crear con caducidad y sumar en un solo MULTI: una clave nunca
+        # queda sin TTL aunque el proceso muera entre los dos comandos
+        pipe = self._r.pipeline(transaction=True)
+        pipe.set(key, 0, nx=True, px=int(ttl * 1000))
+        pipe.incrby(key, amount)
+        return pipe.execute()[1]
+
+    def incr_existing(self, key, amount=1):
+        return self._int(self._incr_existing(keys=[key], args=[amount]))
+
+    def get(self, key):
+        return self._int(self._r.get(key))
+
+    def get_many(self, keys):
+        return [self._int(v) for v in self._r.mget(keys)] if keys else []
+
+    def set(self, key, value, ttl=None):
+        self._r.set(key, value, px=int(ttl * 1000) if ttl else None)
+
+    def add(self, key, value, ttl=None):
+        return bool(
+            self._r.set(key, value, nx=True, px=int(ttl * 1000) if ttl else None))
+
+    def pop(self, key):
+        return self._int(self._r.getdel(key)) or 0
+
+    def delete(self, key):
+        self._r.delete(key)
+
+
+async def call_state(backend: StateBackend, fn, *args):
+    """fn(*args), que usa backend, sin bloquear el event loop."""
+    if not backend.blocking:
+        return fn(*args)
+    return await run_in_threadpool(fn, *args)
+
+
+def default_shm_path() -> str:
+    """
+    Fichero de estado propio de este despliegue (APP_NAME y DATABASE_URL),
+    con la versión del formato y el número de huecos en el nombre: cambiar
+    STATE_SHM_SLOTS o actualizar el código abre otro fichero en vez de
+    chocar con el de los workers que sigan vivos.
+    """
+    name = f"{settings.APP_NAME}|{settings.DATABASE_URL}"
+    digest = hashlib.blake2b(name.encode(), digest_size=6).hexdigest()
+    return os.path.join(
+        tempfile.gettempdir(),
+        f"neptuno-state-{digest}-v{SharedMemoryStateBackend._VERSION}"
+        f"-{settings.STATE_SHM_SLOTS}.shm")
+
+
+def create_state_backend(kind: str) -> StateBackend:
+    if kind == "local":
+        return LocalStateBackend()
+    if kind == "shm":
+        return SharedMemoryStateBackend(
+            settings.STATE_SHM_PATH or default_shm_path(),
+            settings.STATE_SHM_SLOTS)
+    if kind == "redis":
+        return RedisStateBackend(settings.REDIS_URL)
+    raise ValueError(f"STATE_BACKEND desconocido: {kind}")
+
+
+state = create_state_backend(settings.STATE_BACKEND)
@@ -0,0 +1,233 @@
+# backend/services/uniques.py
+import threading
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import func, select
+
+from config import settings
+from db import engine
+from models.models import AccessLog, AccessLogDailyUniques
+from services.hll import HyperLogLog
+from services.rollup import insert_for
+
+# métrica -> columna de access_log
+METRICS = {"ip": "ip_address", "fingerprint": "fingerprint"}
+DAY = timedelta(days=1)
+REBUILD_CHUNK = 50_000  # filas de access_log leídas de una vez (rebuild)
+
+
+def _sketches(rows) -> dict:
+    """HyperLogLog por (tenant, día, métrica) de un lote de filas."""
+    sketches = {}
+    for row in rows:
+        tenant = row["tenant_id"]
+        if not tenant:
+            continue
+        day = row["timestamp"].date()
+        for metric, column in METRICS.items():
+            value = row.get(column)
+            if not value:
+                continue
+            key = (tenant, day, metric)
+            sketch = sketches.get(key)
+            if sketch is None:
+                sketch = sketches[key] = HyperLogLog()
+            sketch.add(value)
+    return sketches
+
+
+def _merge_into(conn, key, sketch: HyperLogLog):
+    tenant, day, metric = key
+    table = AccessLogDailyUniques.__table__
+    where = (table.c.tenant_id == tenant, table.c.day == day,
+             table.c.metric == metric)
+    insert = insert_for(conn.dialect.name)
+    if insert is not None:
+        # Si no existía, queda el sketch del lote; si existía, el INSERT
+        # ya ha cogido el cerrojo de escritura en SQLite y FOR UPDATE lo
+        # coge en Postgres antes de leer
+        created = conn.execute(insert(table).values(
+            tenant_id=tenant, day=day, metric=metric,
+            sketch=sketch.to_bytes()).on_conflict_do_nothing())
+        if created.rowcount:
+            return
+    current = conn.execute(
+        select(table.c.sketch).where(*where).with_for_update()).scalar()
+    if current is None:
+        conn.execute(table.insert().values(tenant_id=tenant, day=day,
+                                           metric=metric,
+                                           sketch=sketch.to_bytes()))
+        return
+    sketch.merge(HyperLogLog.from_bytes(current))
+    conn.execute(table.update().where(*where).values(sketch=sketch.to_bytes()))
+
+
+def _merge_all(conn, sketches: dict):
+    # Orden fijo de claves, como en rollup: sin bloqueos cruzados
+    for key in sorted(sketches):
+        _merge_into(conn, key, sketches[key])
+
+
+def update_uniques(conn, rows: list):
+    """
+    Hook de services/ingest.py: fusiona las IPs y fingerprints del lote en
+    los sketches del día. Los "allow" que el muestreo no guarda llegan por
+    SampledUniques.
+    """
+    _merge_all(conn, _sketches(rows))
+
+
+class SampledUniques:
+    """
+    IPs y fingerprints de los hits que no llegan a access_log (los "allow"
+    descartados por allow_sample_rate), para que los sketches cuenten todos
+    los visitantes y no solo los guardados.
+
+    observe() solo apunta el valor en un conjunto de este worker; un hilo lo
+    vuelca cada flush_interval segundos en los sketches del día. Con más de
+    max_pending valores distintos pendientes, los nuevos se descartan hasta
+    el siguiente volcado (y se avisa al volcar).
+    """
+
+    def __init__(self, flush_interval: float, max_pending: int):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending = set()  # (tenant, día, métrica, valor)
+        self._dropped = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def observe(self, tenant: str, ip: str, fingerprint: str):
+        if not tenant:
+            return
+        day = datetime.utcnow().date()
+        with self._lock:
+            for metric, value in (("ip", ip), ("fingerprint", fingerprint)):
+                if not value:
+                    continue
+                if len(self._pending) >= self.max_pending:
+                    self._dropped += 1
+                    continue
+                self._pending.add((tenant, day, metric, value))
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, set()
+            dropped, self._dropped = self._dropped, 0
+        if dropped:
+            print(f"Únicos sin contar por exceso de pendientes: {dropped}")
+        if not pending:
+            return
+        sketches = {}
+        for tenant, day, metric, value in pending:
+            key = (tenant, day, metric)
+            sketch = sketches.get(key)
+            if sketch is None:
+                sketch = sketches[key] = HyperLogLog()
+            sketch.add(value)
+        try:
+            with engine.begin() as conn:
+                _merge_all(conn, sketches)
+        except Exception as e:
+            print(f"Error al volcar únicos muestreados: {e}")
+            with self._lock:
+                # Se reintentan en el siguiente volcado, sin pasar del límite
+                room = max(self.max_pending - len(self._pending), 0)
+                self._pending.update(list(pending)[:room])
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name="sampled-uniques",
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        if self.running:
+            self._stop.set()
+            self._thread.join(timeout)
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+
+def unique_counts(db, tenant: str, since: date, until: date = None) -> dict:
+    """
+    Distintos aproximados por métrica en los días [since, until] (hasta hoy
+    por defecto): un sketch por día fusionado, sin tocar access_log.
+    """
+    query = db.query(AccessLogDailyUniques.metric,
+                     AccessLogDailyUniques.sketch).filter(
+                         AccessLogDailyUniques.tenant_id == tenant,
+                         AccessLogDailyUniques.day >= since)
+    if until is not None:
+        query = query.filter(AccessLogDailyUniques.day <= until)
+    merged = {metric: HyperLogLog() for metric in METRICS}
+    for metric, data in query:
+        if metric in merged:
+            merged[metric].merge(HyperLogLog.from_bytes(data))
+    return {metric: sketch.count() for metric, sketch in merged.items()}
+
+
+def rebuild(since: date = None, until: date = None, tenant: str = None,
+            reset: bool = False) -> int:
+    """
+    Recalcula los sketches de los días [since, until) desde access_log (por
+    defecto desde el primer log hasta ayer; el de hoy lo mantiene el
+    writer). Va día a día para no tener en memoria más que los sketches de
+    un día. Devuelve las filas leídas.
+
+    Fusionar un sketch dos veces no cambia la cuenta, así que por defecto
+    se fusiona sobre lo que hay y se conservan los "allow" no guardados
+    (SampledUniques), que access_log no tiene. Con reset se borran antes.
+    """
+    until = until or datetime.utcnow().date()
+    if since is None:
+        with engine.connect() as conn:
+            first = conn.execute(select(func.min(AccessLog.timestamp))).scalar()
+        if first is None:
+            return 0
+        since = first.date()
+    table = AccessLogDailyUniques.__table__
+    columns = [AccessLog.tenant_id, AccessLog.timestamp]
+    columns += [getattr(AccessLog, column) for column in METRICS.values()]
+    read = 0
+    day = since
+    while day < until:
+        start = datetime.combine(day, datetime.min.time())
+        stmt = select(*columns).where(AccessLog.timestamp >= start,
+                                      AccessLog.timestamp < start + DAY)
+        delete = table.delete().where(table.c.day == day)
+        if tenant is not None:
+            stmt = stmt.where(AccessLog.tenant_id == tenant)
+            delete = delete.where(table.c.tenant_id == tenant)
+        with engine.begin() as conn:
+            if reset:
+                conn.execute(delete)
+            # yield_per en la sentencia: _merge_all escribe por la misma conexión
+            result = conn.execute(stmt.execution_options(yield_per=REBUILD_CHUNK))
+            sketches = {}
+            for chunk in result.mappings().partitions():
+                read += len(chunk)
+                for key, sketch in _sketches(chunk).items():
+                    if key in sketches:
+                        sketches[key].merge(sketch)
+                    else:
+                        sketches[key] = sketch
+            _merge_all(conn, sketches)
+        day += DAY
+    return read
+
+
+sampled_uniques = SampledUniques(flush_interval=settings.UNIQUES_FLUSH_INTERVAL,
+                                 max_pending=settings.UNIQUES_MAX_PENDING)
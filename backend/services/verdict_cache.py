@@ -0,0 +1,70 @@
+# backend/services/verdict_cache.py
+import hashlib
+import threading
+from collections import OrderedDict
+
+from config import settings
+
+_NO_MATCH = object()
+
+
+class VerdictCache:
+    """
+    LRU acotada con la parte estática del veredicto de detect_png: qué regla
+    (block/redirect/restricted) encaja con un User-Agent.
+
+    La clave es (tenant, versión del ruleset, hash del UA), así que recargar
+    las reglas deja obsoletas las entradas anteriores sin borrarlas a mano.
+    Los límites por hora y la cuota se siguen evaluando en cada petición.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _key(ruleset, ua: str):
+        digest = hashlib.blake2b(ua.encode("utf-8", "surrogatepass"),
+                                 digest_size=16).digest()
+        return (ruleset.tenant, ruleset.version, digest)
+
+    def match(self, ruleset, ua: str):
+        key = self._key(ruleset, ua)
+        with self._lock:
+            cached = self._data.get(key)
+            if cached is not None:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return None if cached is _NO_MATCH else cached
+            self.misses += 1
+
+        hit = ruleset.match(ua)
+        with self._lock:
+            self._data[key] = _NO_MATCH if hit is None else hit
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+        return hit
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "capacity": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+verdict_cache = VerdictCache(maxsize=settings.VERDICT_CACHE_SIZE)
@@ -0,0 +1,23 @@
+# backend/tasks/backfill_agents.py
+"""
+Rellena agent_family, agent_version e is_crawler en los logs guardados
+antes de esas columnas (services/agents.py). Se puede relanzar: solo toca
+filas con agent_family a NULL.
+
+    cd backend && python tasks/backfill_agents.py
+"""
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from services.agents import backfill
+
+
+def main():
+    done = backfill()
+    print(f"agent_family rellenado en {done} filas de access_log")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+# backend/tasks/check_partitions.py
+"""
+Comprueba contra Postgres el mantenimiento de particiones de access_log
+(services/partitions.py), en especial que ensure_partitions() crea una
+partición aunque access_log_default ya tenga filas de su rango.
+
+Trabaja en un esquema temporal dentro de una transacción que se deshace
+al final: no toca la access_log real.
+
+    cd backend && DATABASE_URL=postgresql://... python tasks/check_partitions.py
+"""
+import argparse
+import os
+import sys
+from datetime import datetime
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from sqlalchemy import text
+
+from db import engine
+from services.partitions import (DEFAULT_PARTITION, PARENT, default_rows,
+                                 ensure_partitions, is_partitioned,
+                                 list_partitions, partition_name)
+
+SCHEMA = "neptuno_check_partitions"
+
+
+def count(conn, table: str) -> int:
+    return conn.execute(text(f'SELECT count(*) FROM "{table}"')).scalar()
+
+
+def check(conn):
+    conn.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+    conn.execute(text(f"SET LOCAL search_path TO {SCHEMA}"))
+    conn.execute(text(
+        f'CREATE TABLE {PARENT} (id varchar NOT NULL, "timestamp" timestamp '
+        f'NOT NULL, PRIMARY KEY (id, "timestamp")) PARTITION BY RANGE ("timestamp")'))
+    conn.execute(text(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {PARENT} DEFAULT"))
+    assert is_partitioned(conn), "access_log de prueba sin particionar"
+
+    # Sin particiones todavía: todo cae en la DEFAULT
+    conn.execute(text(
+        f"INSERT INTO {PARENT} VALUES ('a', '2030-01-20'), ('b', '2030-03-02'), "
+        f"('c', '2030-03-31 23:59:59'), ('d', '2031-06-01')"))
+    assert default_rows(conn) == 4
+
+    created = ensure_partitions(conn, now=datetime(2030, 1, 15), ahead=3,
+                                months=1)
+    expected = [partition_name(datetime(2030, m, 1)) for m in range(1, 5)]
+    assert created == expected, f"creadas {created}, esperadas {expected}"
+    assert count(conn, partition_name(datetime(2030, 1, 1))) == 1
+    assert count(conn, partition_name(datetime(2030, 2, 1))) == 0
+    assert count(conn, partition_name(datetime(2030, 3, 1))) == 2
+    # La DEFAULT sigue enganchada y solo guarda lo que no tiene partición
+    assert list_partitions(conn).get(DEFAULT_PARTITION, ()) is None
+    assert default_rows(conn) == 1
+    assert count(conn, PARENT) == 4
+
+    # Segunda pasada: no hay nada que crear
+    assert ensure_partitions(conn, now=datetime(2030, 1, 15), ahead=3,
+                             months=1) == []
+    # Una fila nueva del rango va a su partición, no a la DEFAULT
+    conn.execute(text(f"INSERT INTO {PARENT} VALUES ('e', '2030-04-10')"))
+    assert count(conn, partition_name(datetime(2030, 4, 1))) == 1
+    assert default_rows(conn) == 1
+
+
+def main():
+    argparse.ArgumentParser(description=__doc__.splitlines()[1]).parse_args()
+    if engine.dialect.name != "postgresql":
+        sys.exit("DATABASE_URL debe apuntar a Postgres")
+    with engine.connect() as conn:
+        trans = conn.begin()
+        try:
+            check(conn)
+        finally:
+            trans.rollback()
+    print("Particiones de access_log: OK")
+
+
+if __name__ == "__main__":
+    main()
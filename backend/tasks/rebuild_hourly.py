@@ -0,0 +1,36 @@
+# backend/tasks/rebuild_hourly.py
+"""
+Recalcula access_log_hourly a partir de access_log (services/rollup.py).
+La migración rellena los conteos, pero solo conoce la familia de los
+crawlers (el resto queda como "Unknown"): hay que lanzarlo una vez después
+de migrar, y otra vez si el rollup se desvía:
+
+    cd backend && python tasks/rebuild_hourly.py [--since 2025-01-01] [--tenant ID]
+
+La hora en curso no se toca: la mantiene el writer de logs. Con la
+ingesta parada, --until permite incluirla.
+"""
+import argparse
+import os
+import sys
+from datetime import datetime
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from services.rollup import rebuild
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--since", type=datetime.fromisoformat,
+                        help="primera hora a recalcular (por defecto, todas)")
+    parser.add_argument("--until", type=datetime.fromisoformat,
+                        help="primera hora que no se recalcula (por defecto, la actual)")
+    parser.add_argument("--tenant")
+    args = parser.parse_args()
+    read = rebuild(since=args.since, until=args.until, tenant=args.tenant)
+    print(f"access_log_hourly recalculado con {read} filas de access_log")
+
+
+if __name__ == "__main__":
+    main()
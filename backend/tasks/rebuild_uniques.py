@@ -0,0 +1,39 @@
+# backend/tasks/rebuild_uniques.py
+"""
+Recalcula los sketches de IPs y fingerprints únicos por día
+(access_log_daily_uniques, services/uniques.py) a partir de access_log.
+Tras la migración, para rellenar los días anteriores:
+
+    cd backend && python tasks/rebuild_uniques.py [--since 2025-01-01] [--tenant ID]
+
+El día en curso no se toca: lo mantiene el writer de logs. Se fusiona
+sobre los sketches existentes, que también cuentan los "allow" no
+guardados por el muestreo; --reset los borra antes (se pierden esos).
+"""
+import argparse
+import os
+import sys
+from datetime import date
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from services.uniques import rebuild
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--since", type=date.fromisoformat,
+                        help="primer día a recalcular (por defecto, el del primer log)")
+    parser.add_argument("--until", type=date.fromisoformat,
+                        help="primer día que no se recalcula (por defecto, hoy)")
+    parser.add_argument("--tenant")
+    parser.add_argument("--reset", action="store_true",
+                        help="borra los sketches de cada día antes de recalcularlo")
+    args = parser.parse_args()
+    read = rebuild(since=args.since, until=args.until, tenant=args.tenant,
+                   reset=args.reset)
+    print(f"access_log_daily_uniques recalculado con {read} filas de access_log")
+
+
+if __name__ == "__main__":
+    main()
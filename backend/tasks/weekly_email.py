@@ -2,7 +2,8 @@
 from jinja2 import Environment, FileSystemLoader
 from sqlalchemy.orm import Session
 from db import SessionLocal
-from models.models import User, AccessLog
+from models.models import User
+from services.rollup import hourly_counts, outcome_totals
 from datetime import datetime, timedelta
 from utils.email import send_email  # lo implementamos abajo
 
@@ -10,15 +11,14 @@ env = Environment(loader=FileSystemLoader("templates"))
 
 def generate_user_summary(user: User, db: Session):
     start = datetime.utcnow() - timedelta(days=7)
-    logs = db.query(AccessLog).filter(
-        AccessLog.tenant_id == user.id,
-        AccessLog.timestamp >= start
-    ).all()
+    # access_log_hourly (services/rollup.py); los "allow" muestreados ya
+    # cuentan por su sample_weight
+    totals = outcome_totals(hourly_counts(db, start, tenant=user.id))
 
     stats = {
-        "total": len(logs),
-        "blocked": sum(1 for l in logs if l.outcome == "block"),
-        "limited": sum(1 for l in logs if l.outcome == "limit"),
+        "total": sum(totals.values()),
+        "blocked": totals["block"],
+        "limited": totals["limit"],
         "approaching_limit": False
     }
 
@@ -17,6 +17,7 @@ export interface Rule {
   policy: "allow" | "block" | "restricted" | "tariff";
   limit?: number | null;
   fee?: number | null;
+  match_type?: "user_agent" | "ip";
 }
 
 export default function FirewallManager() {
@@ -42,12 +43,13 @@ export default function FirewallManager() {
     setSaving(true);
     try {
       const cleanRules = rules.map(
-        ({ llm_name, pattern, policy, limit, fee }) => ({
+        ({ llm_name, pattern, policy, limit, fee, match_type }) => ({
           llm_name,
           pattern,
           policy,
           limit: limit === undefined ? null : limit,
           fee: fee === undefined ? null : fee,
+          match_type: match_type ?? "user_agent",
         })
       );
 
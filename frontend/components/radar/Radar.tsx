@@ -2,6 +2,7 @@
 import { useEffect, useState } from "react";
 import { apiFetch } from "../../utils/api";
 import { useRadarNotifications } from "../../hooks/useRadarNotifications";
+import { useLiveLogs } from "../../hooks/useLiveLogs";
 import SummaryCharts from "./SummaryCharts";
 import UsageLimits from "./UsageLimits";
 import RecentDetections from "./RecentDetections";
@@ -33,6 +34,13 @@ export default function Radar() {
   const [range, setRange] = useState<Range>("24h");
   const unseen = useRadarNotifications();
 
+  // Logs nuevos en vivo, sin volver a pedir la página entera
+  useLiveLogs((log) =>
+    setAllLogs((logs) =>
+      logs.some((l) => l.id === log.id) ? logs : [log, ...logs].slice(0, 1000)
+    )
+  );
+
   useEffect(() => {
     const fetchData = async () => {
       try {
@@ -0,0 +1,37 @@
+// frontend/hooks/useLiveLogs.tsx
+import { useEffect, useRef } from "react";
+import { Log } from "../components/types/radar";
+
+type Listener = (log: Log) => void;
+
+// Una sola conexión SSE por pestaña, compartida por todos los componentes
+const listeners = new Set<Listener>();
+let source: EventSource | null = null;
+
+function open() {
+  source = new EventSource("/rest/logs/live", { withCredentials: true });
+  source.addEventListener("log", (e) => {
+    const log = JSON.parse((e as MessageEvent).data) as Log;
+    listeners.forEach((fn) => fn(log));
+  });
+  // El servidor cierra si nos quedamos atrás; EventSource reconecta solo
+  source.addEventListener("overflow", () => console.warn("Live logs: overflow"));
+}
+
+export function useLiveLogs(onLog: Listener) {
+  const ref = useRef(onLog);
+  ref.current = onLog;
+
+  useEffect(() => {
+    const listener: Listener = (log) => ref.current(log);
+    listeners.add(listener);
+    if (!source) open();
+    return () => {
+      listeners.delete(listener);
+      if (listeners.size === 0 && source) {
+        source.close();
+        source = null;
+      }
+    };
+  }, []);
+}
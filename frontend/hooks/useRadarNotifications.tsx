@@ -1,6 +1,7 @@
 // frontend/hooks/useRadarNotifications.ts
 import { useEffect, useState } from "react";
 import { apiFetch } from "../utils/api";
+import { useLiveLogs } from "./useLiveLogs";
 
 export function useRadarNotifications() {
   const [unseen, setUnseen] = useState(0);
@@ -14,9 +15,13 @@ export function useRadarNotifications() {
     }
   };
 
+  // Los logs nuevos llegan por /rest/logs/live; el recuento solo se
+  // resincroniza de vez en cuando
+  useLiveLogs(() => setUnseen((n) => n + 1));
+
   useEffect(() => {
     fetchCount();
-    const interval = setInterval(fetchCount, 10000); // cada 10s
+    const interval = setInterval(fetchCount, 120000); // cada 2 min
     return () => clearInterval(interval);
   }, []);
 